@@ -0,0 +1,132 @@
+"""
+Compares the batched decay fitting (utils/post_selection/decay_compute.py) with
+the previous per-response scipy curve_fit in speed and agreement.
+
+Usage:
+    python benchmarks/decay_fit.py [--responses N] [--frames N] [--input FILE]
+
+Without --input, noisy synthetic decays are fitted. With --input, the decay
+windows after the local maxima above mean + 2 * std of every trace of a
+recording are used.
+"""
+
+import argparse
+import os
+import sys
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from scipy.optimize import curve_fit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from trace_selector.utils.post_selection.decay_compute import fit_decays
+
+
+def exp_decay(t, y0, A, invTau):
+    return y0 + A * np.exp(-t * invTau)
+
+
+def curve_fit_params(voltage: np.ndarray) -> np.ndarray:
+    """
+    The previous implementation of compute_tau.
+    """
+    if len(voltage) <= 1:
+        return np.full(3, np.nan)
+    frames = [i for i in range(len(voltage))]
+    try:
+        params, _ = curve_fit(exp_decay, frames, voltage, maxfev=5000)
+    except Exception:
+        return np.full(3, np.nan)
+    return params
+
+
+def squared_error(windows: np.ndarray, y0, A, inv_tau) -> np.ndarray:
+    t = np.arange(windows.shape[1])
+    model = exp_decay(t, y0[:, None], A[:, None], inv_tau[:, None])
+    return np.sum((windows - model) ** 2, axis=1)
+
+
+def synthetic_windows(n: int, frames: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    t = np.arange(frames)
+    y0 = rng.normal(100, 10, n)
+    amplitude = rng.uniform(20, 200, n)
+    inv_tau = rng.uniform(0.05, 1.0, n)
+    noise = rng.normal(0, 1, (n, frames)) * rng.uniform(0.5, 10, n)[:, None]
+    return y0[:, None] + amplitude[:, None] * np.exp(-inv_tau[:, None] * t) + noise
+
+
+def recording_windows(filepath: str, frames: int) -> np.ndarray:
+    df = (
+        pd.read_csv(filepath)
+        if not filepath.endswith(("xlsx", "xls"))
+        else pd.read_excel(filepath)
+    )
+    traces = df.select_dtypes("number").to_numpy(dtype=np.float64)
+    windows = []
+    for trace in traces.T:
+        threshold = np.mean(trace) + 2 * np.std(trace)
+        is_max = (trace[1:-1] > trace[:-2]) & (trace[1:-1] >= trace[2:])
+        for peak in np.flatnonzero(is_max & (trace[1:-1] > threshold)) + 1:
+            if peak + frames <= len(trace):
+                windows.append(trace[peak : peak + frames])
+    return np.array(windows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--responses", type=int, default=2000)
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--input", default="")
+    args = parser.parse_args()
+
+    if args.input != "":
+        windows = recording_windows(args.input, args.frames)
+    else:
+        windows = synthetic_windows(args.responses, args.frames)
+    print(f"{len(windows)} decay windows of {args.frames} frames")
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        start = time.perf_counter()
+        reference = np.array([curve_fit_params(window) for window in windows])
+        curve_fit_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        estimate = fit_decays(windows, refine=False)
+        estimate_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fit = fit_decays(windows)
+        fit_time = time.perf_counter() - start
+
+    print(f"curve_fit (per response):  {curve_fit_time * 1000:9.1f} ms")
+    print(f"closed-form estimate:      {estimate_time * 1000:9.1f} ms")
+    print(
+        f"estimate + batched LM:     {fit_time * 1000:9.1f} ms "
+        f"({curve_fit_time / fit_time:.0f}x faster)"
+    )
+    reference_fitted = np.all(np.isfinite(reference), axis=1)
+    with np.errstate(over="ignore", invalid="ignore"):
+        reference_error = squared_error(windows, *reference.T)
+    print(f"curve_fit: fitted {np.sum(reference_fitted)}/{len(windows)}")
+    for name, result in [("estimate", estimate), ("batched LM", fit)]:
+        both = reference_fitted & result["converged"]
+        rel_diff = np.abs(result["inv_tau"][both] - reference[both, 2]) / np.abs(
+            reference[both, 2]
+        )
+        error = squared_error(windows, result["y0"], result["A"], result["inv_tau"])
+        # curve_fit starts at (1, 1, 1) and often ends in a worse local minimum
+        not_worse = error[both] <= reference_error[both] * (1 + 1e-6)
+        print(
+            f"{name}: fitted {np.sum(result['converged'])}/{len(windows)}, "
+            f"invTau within 1% of curve_fit: {np.mean(rel_diff < 0.01):.1%}, "
+            f"squared error <= curve_fit: {np.mean(not_worse):.1%}, "
+            f"median R²: {np.nanmedian(result['r_squared']):.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Measures the import time of the entry points with python -X importtime, so
+regressions of the startup time (e.g. a heavy module imported eagerly) show up.
+
+Usage:
+    python benchmarks/startup.py [--modules MODULE ...] [--repeat N] [--top N]
+
+Every module is imported --repeat times in a fresh interpreter, the fastest
+run is reported with the packages that took the most time (own import time of
+all their modules).
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+repo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+DEFAULT_MODULES = ["trace_selector", "trace_selector.gui.gui", "trace_selector.batch"]
+
+
+def import_times(module: str) -> list[tuple[str, int, int]]:
+    """
+    Imports module in a fresh interpreter. Returns the name, own and
+    cumulative import time in µs of every imported module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=repo_path,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        times.append((name.strip(), int(own), int(cumulative)))
+    return times
+
+
+def package_times(
+    times: list[tuple[str, int, int]], exclude: set[str]
+) -> dict[str, int]:
+    packages = defaultdict(int)
+    for name, own, _ in times:
+        if name not in exclude:
+            packages[name.split(".")[0]] += own
+    return packages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    args = parser.parse_args()
+
+    # modules the interpreter imports on startup anyway
+    startup = {name for name, _, _ in import_times("sys")}
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        # the module itself is imported last
+        fastest = min(runs, key=lambda times: times[-1][2])
+        total = fastest[-1][2]
+        print(f"import {module}: {total / 1000:.1f} ms (fastest of {args.repeat})")
+        packages = sorted(
+            package_times(fastest, startup).items(),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        for package, own in packages[: args.top]:
+            print(f"    {package:<24} {own / 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
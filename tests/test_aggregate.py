@@ -0,0 +1,86 @@
+import os
+
+import pandas as pd
+
+from trace_selector.utils.aggregate import AggregateStore, aggregate_folder
+from trace_selector.utils.configuration import default_config_path, read_settings
+from trace_selector.utils.trace_data import SynapseResponseData
+
+repo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+test_data_path = os.path.join(repo_path, "test_data.txt")
+STIM_FRAMES = [20, 60, 100]
+
+
+def aggregate_settings(output_path: str) -> dict:
+    settings = read_settings(default_config_path)
+    settings["output_filepath"] = str(output_path)
+    settings["aggregate_results"] = True
+    settings["aggregate_folder"] = ""
+    settings["compute_ppr"] = True
+    return settings
+
+
+def opened_file(settings: dict) -> SynapseResponseData:
+    """
+    test_data.txt with the first three traces kept, each with two responses.
+    """
+    synapse_response = SynapseResponseData()
+    synapse_response.open_file(
+        test_data_path,
+        "test_data.txt",
+        settings["meta_columns"],
+        settings["normalization_use_median"],
+        settings["normalization_sliding_window_size"],
+        compute_hash=True,
+    )
+    synapse_response.keep_data = synapse_response.columns[:3]
+    synapse_response.discard_data = synapse_response.columns[3:]
+    synapse_response.add_responses(
+        [0, 0, 1, 1, 2, 2],
+        [22, 62, 21, 101, 61, 102],
+        [True] * 6,
+        settings["frames_for_decay"],
+        STIM_FRAMES,
+        settings["stim_frames_patience"],
+    )
+    return synapse_response
+
+
+def exported(settings: dict, export_path) -> dict[str, pd.DataFrame]:
+    os.makedirs(export_path)
+    AggregateStore(aggregate_folder(settings)).export(str(export_path / "all.csv"))
+    return {
+        filename[len("all_") : -len(".csv")]: pd.read_csv(export_path / filename)
+        for filename in os.listdir(export_path)
+    }
+
+
+def test_saving_a_file_again_replaces_its_tables(tmp_path):
+    settings = aggregate_settings(tmp_path / "output")
+    synapse_response = opened_file(settings)
+    synapse_response.save(STIM_FRAMES, settings, None)
+    expected = exported(settings, tmp_path / "first")
+    assert len(expected["responses"]) == 6
+    synapse_response.save(STIM_FRAMES, settings, None)
+    keep_files = os.listdir(tmp_path / "output" / "keep_folder")
+    assert "test_data(1).csv" in keep_files
+    tables = exported(settings, tmp_path / "second")
+    assert set(tables) == set(expected)
+    for table, df in tables.items():
+        pd.testing.assert_frame_equal(df, expected[table])
+
+
+def test_tables_missing_in_a_new_save_are_removed(tmp_path):
+    settings = aggregate_settings(tmp_path / "output")
+    synapse_response = opened_file(settings)
+    synapse_response.save(STIM_FRAMES, settings, None)
+    store = AggregateStore(aggregate_folder(settings))
+    assert len(store.partitions("PPR")) == 1
+    settings["compute_ppr"] = False
+    synapse_response.save([], settings, None)
+    assert store.partitions("PPR") == []
+    assert store.partitions("failure_analysis") == []
+    assert len(store.partitions("responses")) == 1
+    tables = exported(settings, tmp_path / "export")
+    assert set(tables) == {"responses", "stimulations"}
+    assert len(tables["responses"]) == 6
@@ -0,0 +1,81 @@
+import os
+import shutil
+
+from trace_selector.batch import output_prefixes, run_batch
+from trace_selector.utils.aggregate import (
+    AGGREGATED_TABLES,
+    AggregateStore,
+    aggregate_folder,
+)
+from trace_selector.utils.configuration import default_config_path, read_settings
+from trace_selector.utils.hash import sha256_hash
+
+repo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+test_data_path = os.path.join(repo_path, "test_data.txt")
+
+
+def batch_settings(output_path: str) -> dict:
+    settings = read_settings(default_config_path)
+    settings["output_filepath"] = str(output_path)
+    settings["file_cache_enabled"] = False
+    settings["aggregate_results"] = True
+    settings["aggregate_folder"] = ""
+    return settings
+
+
+def test_output_prefixes_of_same_names_are_unique(tmp_path):
+    settings = batch_settings(tmp_path / "output")
+    input_files = [
+        str(tmp_path / "a" / "rec.csv"),
+        str(tmp_path / "b" / "rec.csv"),
+        str(tmp_path / "b" / "other.csv"),
+    ]
+    prefixes = output_prefixes(input_files, settings)
+    assert prefixes == {
+        input_files[0]: "a_rec",
+        input_files[1]: "b_rec",
+        input_files[2]: "other",
+    }
+
+
+def test_output_prefixes_skip_taken_and_reserved_names(tmp_path):
+    settings = batch_settings(tmp_path / "output")
+    keep_path = tmp_path / "output" / "keep_folder"
+    keep_path.mkdir(parents=True)
+    (keep_path / "rec.csv").touch()
+    input_files = [
+        str(tmp_path / "rec.csv"),
+        # would be rec.csv as well without the extension
+        str(tmp_path / "rec(1).csv"),
+    ]
+    prefixes = output_prefixes(input_files, settings)
+    assert prefixes == {input_files[0]: "rec(1)", input_files[1]: "rec(1)(1)"}
+
+
+def test_same_names_in_different_folders_keep_all_outputs(tmp_path):
+    input_files = []
+    for folder in ["a", "b", "c"]:
+        os.makedirs(tmp_path / "input" / folder)
+        input_files.append(str(tmp_path / "input" / folder / "rec.txt"))
+        shutil.copy(test_data_path, input_files[-1])
+        # different files (by hash) with the same traces
+        with open(input_files[-1], "a") as f:
+            f.write("\n" * (len(input_files)))
+    settings = batch_settings(tmp_path / "output")
+    # every aggregated table is written
+    settings.update(stim_used=True, stim_frames_start=20, compute_ppr=True)
+    results = run_batch(input_files, settings, workers=3)
+    assert len(results) == 3
+    keep_files = sorted(os.listdir(tmp_path / "output" / "keep_folder"))
+    assert [name for name in keep_files if name.endswith("rec.csv")] == [
+        "a_rec.csv",
+        "b_rec.csv",
+        "c_rec.csv",
+    ]
+    store = AggregateStore(aggregate_folder(settings))
+    for table in AGGREGATED_TABLES:
+        file_keys = {
+            os.path.splitext(os.path.basename(path))[0]
+            for path in store.partitions(table)
+        }
+        assert file_keys == {sha256_hash(path) for path in input_files}
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from trace_selector.utils.configuration import default_config_path, read_settings
+from trace_selector.utils.csv_reader import count_lines, read_csv_chunked, split_columns
+from trace_selector.utils.trace_data import read_input_file
+
+repo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+test_data_path = os.path.join(repo_path, "test_data.txt")
+meta_columns = read_settings(default_config_path)["meta_columns"]
+
+
+def read_with_pandas(filepath: str) -> tuple:
+    """
+    The previous (whole file) parsing of read_input_file.
+    """
+    df = pd.read_csv(filepath, sep=",")
+    df.columns = [str(col) for col in df.columns]
+    meta, columns = split_columns(df, meta_columns)
+    dtypes = {
+        col: str(dtype)
+        for col, dtype in df[columns].dtypes.items()
+        if dtype != np.float64
+    }
+    return df[columns].to_numpy(dtype=np.float64), columns, dtypes, df[meta]
+
+
+def assert_same(result: tuple, expected: tuple) -> None:
+    traces, columns, dtypes, meta_df = result
+    np.testing.assert_array_equal(traces, expected[0])
+    assert traces.dtype == np.float64
+    assert traces.flags.f_contiguous
+    assert columns == expected[1]
+    assert dtypes == expected[2]
+    pd.testing.assert_frame_equal(
+        meta_df.reset_index(drop=True), expected[3].reset_index(drop=True)
+    )
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 7, 50_000])
+def test_matches_pandas_on_test_data(chunk_rows):
+    percentages = []
+    result = read_csv_chunked(
+        test_data_path, meta_columns, percentages.append, chunk_rows
+    )
+    assert_same(result, read_with_pandas(test_data_path))
+    assert percentages == sorted(percentages)
+    assert percentages[-1] == 100
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        # integer ROI and text meta columns, no line break at the end
+        "Time,Name,ROI 1,ROI 2\n0,rec,1,1.5\n1,rec,2,2.5\n2,rec,3,3.5",
+        # blank lines, missing values and an integer column turning float
+        "Time,ROI 1,ROI 2\n0,1,\n\n1,2,2.5\n2,3.5,3\n\n",
+        # header only
+        "Time,ROI 1,ROI 2\n",
+    ],
+)
+def test_matches_pandas(tmp_path, content):
+    path = tmp_path / "input.csv"
+    path.write_text(content)
+    assert_same(
+        read_csv_chunked(str(path), meta_columns, chunk_rows=2),
+        read_with_pandas(str(path)),
+    )
+
+
+def test_text_after_the_first_chunk_falls_back_to_pandas(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_text("Time,ROI 1,ROI 2\n0,1,2\n1,2,3\n2,abc,4\n3,4,5\n")
+    with pytest.raises(ValueError):
+        read_csv_chunked(str(path), meta_columns, chunk_rows=2)
+    # ROI 1 holds text, so it is a meta column
+    result = read_input_file(str(path), "input.csv", meta_columns)
+    assert "ROI 1" not in result[1]
+    assert "ROI 1" in result[3].columns
+    assert_same(result, read_with_pandas(str(path)))
+
+
+def test_malformed_file_raises(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_text("Time,ROI 1\n0,1\n1,2,3,4\n")
+    with pytest.raises(pd.errors.ParserError):
+        read_input_file(str(path), "input.csv", meta_columns)
+
+
+def test_count_lines(tmp_path):
+    path = tmp_path / "input.csv"
+    for content, n_lines in [("", 0), ("a", 1), ("a\n", 1), ("a\nb", 2)]:
+        path.write_text(content)
+        assert count_lines(str(path), buffersize=1) == n_lines
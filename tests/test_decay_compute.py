@@ -0,0 +1,101 @@
+import json
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.optimize import curve_fit
+
+from trace_selector.utils.post_selection.decay_compute import (
+    decay_windows,
+    fit_decays,
+    levenberg_marquardt,
+)
+
+repo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+test_data_path = os.path.join(repo_path, "test_data.txt")
+default_settings_path = os.path.join(
+    repo_path, "trace_selector", "settings", "default_settings.json"
+)
+
+
+def exp_decay(t, y0, A, invTau):
+    return y0 + A * np.exp(-t * invTau)
+
+
+def legacy_params(voltage: np.ndarray) -> np.ndarray:
+    """
+    The previous curve_fit implementation of compute_tau.
+    """
+    frames = [i for i in range(len(voltage))]
+    try:
+        params, _ = curve_fit(exp_decay, frames, voltage, maxfev=5000)
+    except Exception:
+        return np.full(3, np.nan)
+    return params
+
+
+def squared_error(window: np.ndarray, params: np.ndarray) -> float:
+    return np.sum((window - exp_decay(np.arange(len(window)), *params)) ** 2)
+
+
+def recording_peaks() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Traces of test_data.txt and all local maxima above mean + std.
+    """
+    with open(default_settings_path) as f:
+        meta_columns = json.load(f)["meta_columns"]
+    df = pd.read_csv(test_data_path)
+    traces = df.drop(columns=[c for c in df.columns if c in meta_columns])
+    traces = traces.to_numpy(dtype=np.float64)
+    peaks, rois = [], []
+    for roi, trace in enumerate(traces.T):
+        threshold = np.mean(trace) + np.std(trace)
+        is_max = (trace[1:-1] > trace[:-2]) & (trace[1:-1] >= trace[2:])
+        frames = np.flatnonzero(is_max & (trace[1:-1] > threshold)) + 1
+        peaks += list(frames)
+        rois += [roi] * len(frames)
+    return traces, np.array(peaks), np.array(rois)
+
+
+@pytest.mark.parametrize("frames_for_decay", [6, 10])
+def test_squared_error_not_above_curve_fit(frames_for_decay):
+    traces, peaks, rois = recording_peaks()
+    windows, lengths = decay_windows(traces, peaks, rois, frames_for_decay)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        fit = fit_decays(windows, lengths)
+        for i, (window, length) in enumerate(zip(windows, lengths)):
+            window = window[:length]
+            reference = legacy_params(window)
+            if length < 3 or not np.all(np.isfinite(reference)):
+                continue
+            assert fit["converged"][i]
+            params = np.array([fit["y0"][i], fit["A"][i], fit["inv_tau"][i]])
+            # up to the relative tolerance both fits stop at (ftol of curve_fit)
+            assert squared_error(window, params) <= squared_error(window, reference) * (
+                1 + 1.5e-8
+            )
+
+
+def test_stalled_fit_is_not_converged():
+    t = np.arange(8, dtype=np.float64)
+    y = exp_decay(t, 100, 50, 0.5)[None, :]
+    mask = np.ones_like(y)
+    # far from the minimum, a single iteration can't converge
+    _, _, converged = levenberg_marquardt(y, mask, t, np.ones((1, 3)), max_iter=1)
+    assert not converged[0]
+    params, cost, converged = levenberg_marquardt(y, mask, t, np.ones((1, 3)))
+    assert converged[0]
+    np.testing.assert_allclose(params[0], [100, 50, 0.5], rtol=1e-5)
+    assert cost[0] < 1e-12
+
+
+def test_windows_that_cant_be_fitted_are_nan():
+    windows = np.array(
+        [[5.0, 3.0, 2.0, 1.5, 1.2], [5.0, np.nan, 2.0, 1.5, 1.2], [5.0, 3.0, 0, 0, 0]]
+    )
+    fit = fit_decays(windows, np.array([5, 5, 2]))
+    assert list(fit["converged"]) == [True, False, False]
+    assert np.isfinite(fit["tau"][0])
+    assert np.all(np.isnan(fit["tau"][1:]))
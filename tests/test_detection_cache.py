@@ -0,0 +1,143 @@
+import numpy as np
+
+from trace_selector.detection.detection_cache import DetectionCache, entry_size
+from trace_selector.detection.response_detection import (
+    PEAK_SETTINGS,
+    PREDICTION_SETTINGS,
+    THRESHOLD_SETTINGS,
+    detect_responses,
+    precompute_detection,
+    stage_key,
+    stimulation_frames,
+)
+from trace_selector.utils.configuration import default_config_path, read_settings
+from trace_selector.utils.normalization import sliding_window_normalization
+
+# 256 KiB per entry, four fit into 1 MB
+ENTRY = np.zeros(32 * 1024)
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    cache = DetectionCache(max_mb=1)
+    for key in "abcd":
+        cache.put(key, ENTRY.copy())
+    assert cache.size == 4 * ENTRY.nbytes
+    # a is used again, b is the least recently used entry now
+    assert cache.get("a", lambda: None) is not None
+    cache.put("e", ENTRY.copy())
+    assert list(cache.entries) == ["c", "d", "a", "e"]
+    assert cache.size == 4 * ENTRY.nbytes
+    # replacing an entry doesn't count it twice
+    cache.put("e", np.zeros(16))
+    assert cache.size == 3 * ENTRY.nbytes + 16 * 8
+    # entries larger than the cache aren't stored
+    cache.put("big", np.zeros(256 * 1024))
+    assert "big" not in cache.entries
+    assert cache.size == sum(size for _, size in cache.entries.values())
+    cache.clear()
+    assert cache.size == 0 and len(cache.entries) == 0
+
+
+def test_computed_once():
+    cache = DetectionCache()
+    calls = []
+    for _ in range(3):
+        value = cache.get("key", lambda: calls.append(1) or [1, 2, 3])
+    assert value == [1, 2, 3]
+    assert len(calls) == 1
+    assert entry_size([np.zeros(10), np.zeros(5)]) > 15 * 8
+
+
+def test_stage_keys_dont_collide():
+    settings = read_settings(default_config_path)
+    keys = {
+        stage_key(("file", column), stage, settings, setting_keys, *extra)
+        for column in ["ROI 1", "ROI 2"]
+        for stage, setting_keys, extra in [
+            ("threshold", THRESHOLD_SETTINGS, ()),
+            ("peaks", PEAK_SETTINGS, ((10, 20),)),
+            ("peaks", PEAK_SETTINGS, ((10, 30),)),
+            ("probabilities", PREDICTION_SETTINGS, ()),
+        ]
+    }
+    assert len(keys) == 8
+    # same key for the same trace, stage and relevant settings
+    threshold_key = stage_key(
+        ("file", "ROI 1"), "threshold", settings, THRESHOLD_SETTINGS
+    )
+    changed = dict(settings, threshold_slider_ml=settings["threshold_slider_ml"] + 1)
+    assert threshold_key == stage_key(
+        ("file", "ROI 1"), "threshold", changed, THRESHOLD_SETTINGS
+    )
+    changed = dict(settings, threshold_mult=settings["threshold_mult"] + 1)
+    assert threshold_key != stage_key(
+        ("file", "ROI 1"), "threshold", changed, THRESHOLD_SETTINGS
+    )
+    # the stage is part of the key, even with the same settings
+    assert stage_key(("a", "b"), "peaks", settings, PEAK_SETTINGS) != stage_key(
+        ("a", "b"), "threshold", settings, PEAK_SETTINGS
+    )
+
+
+def traces(settings: dict) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(0)
+    raw = rng.normal(100, 5, (300, 4))
+    raw[50::40] += 60
+    norm = sliding_window_normalization(
+        raw,
+        settings["normalization_use_median"],
+        settings["normalization_sliding_window_size"],
+    )
+    return np.asfortranarray(raw), np.asfortranarray(norm)
+
+
+def test_only_stages_depending_on_a_changed_setting_are_recomputed():
+    settings = read_settings(default_config_path)
+    raw, norm = traces(settings)
+    stim_frames = stimulation_frames(settings, len(raw))
+    cache = DetectionCache()
+
+    def detect(settings: dict):
+        return detect_responses(
+            raw[:, 0], norm[:, 0], settings, stim_frames, None, None, cache, "t"
+        )
+
+    expected = detect_responses(raw[:, 0], norm[:, 0], settings, stim_frames)
+    result = detect(settings)
+    assert len(cache.entries) == 2
+    assert result[0] == expected[0] and result[1] == expected[1]
+    detect(dict(settings, threshold_slider_ml=10))
+    assert len(cache.entries) == 2
+    detect(dict(settings, stim_frames_patience=settings["stim_frames_patience"] + 1))
+    assert len(cache.entries) == 3
+    changed = dict(settings, threshold_mult=settings["threshold_mult"] + 1)
+    result = detect(changed)
+    assert len(cache.entries) == 5
+    expected = detect_responses(raw[:, 0], norm[:, 0], changed, stim_frames)
+    assert result[0] == expected[0] and result[1] == expected[1]
+
+
+def test_precomputed_file_matches_single_traces():
+    settings = read_settings(default_config_path)
+    raw, norm = traces(settings)
+    stim_frames = stimulation_frames(settings, len(raw))
+    columns = ["ROI 1", "ROI 2", "ROI 3", "ROI 4"]
+    cache = DetectionCache()
+    precompute_detection(cache, "file", columns, raw, norm, settings, stim_frames)
+    n_entries = len(cache.entries)
+    for i, column in enumerate(columns):
+        expected = detect_responses(raw[:, i], norm[:, i], settings, stim_frames)
+        result = detect_responses(
+            raw[:, i],
+            norm[:, i],
+            settings,
+            stim_frames,
+            None,
+            None,
+            cache,
+            ("file", column),
+        )
+        assert result[0] == expected[0]
+        assert list(result[1]) == list(expected[1])
+    # everything came from the cache
+    assert len(cache.entries) == n_entries
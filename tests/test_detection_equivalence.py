@@ -0,0 +1,189 @@
+import warnings
+import numpy as np
+import pytest
+from scipy.signal import find_peaks
+
+from trace_selector.detection.nms import non_maximum_suppression, stimulation_nms
+from trace_selector.detection.peak_detection import (
+    peak_detection_matrix,
+    peak_detection_scipy,
+)
+from trace_selector.utils.threshold import compute_threshold, compute_thresholds
+
+
+def legacy_non_maximum_suppression(
+    peaks: list[int], intensity: np.ndarray, window_size: int
+) -> list[int]:
+    """
+    The previous loop implementation of non_maximum_suppression.
+    """
+    result_arr = []
+    processed_peaks = []
+    for idx, peak in enumerate(peaks):
+        if peak in processed_peaks:
+            continue
+        tmp_arr = []
+        for inner_idx in range(idx, len(peaks)):
+            if peaks[inner_idx] <= peak + (window_size // 2):
+                tmp_arr.append(peaks[inner_idx])
+        max_idx = tmp_arr[0]
+        for peak_idx in tmp_arr:
+            if intensity[peak_idx] >= intensity[max_idx]:
+                max_idx = peak_idx
+            processed_peaks.append(peak_idx)
+        result_arr.append(max_idx)
+    return result_arr
+
+
+def legacy_stimulation_nms(
+    peaks: list[int], intensity: np.ndarray, stimframes: list[int], patience: int
+) -> list[int]:
+    """
+    The previous loop of SynapseResponseData.non_max_supression.
+    """
+    nms_peaks = []
+    for stimframe in stimframes:
+        tmp_peaks = []
+        tmp_amplitudes = []
+        for peak in peaks:
+            if peak < stimframe or peak > stimframe + patience:
+                continue
+            tmp_peaks.append(peak)
+            tmp_amplitudes.append(intensity[peak])
+        if len(tmp_peaks) > 1:
+            _ = tmp_peaks.pop(np.argmax(tmp_amplitudes))
+            for peak in tmp_peaks:
+                nms_peaks.append(peak)
+    return nms_peaks
+
+
+def legacy_peak_detection(
+    intenstiy: np.ndarray,
+    threshold: float,
+    stim_used: bool,
+    stim_frames: list[int],
+    patience: int,
+) -> list[int]:
+    """
+    The previous per-stimulation implementation of peak_detection_scipy.
+    """
+    peaks = []
+    if stim_used and len(stim_frames) > 0:
+        for frame in stim_frames:
+            tmp_peaks, _ = find_peaks(
+                intenstiy[frame - 1 : frame + patience + 1], height=threshold
+            )
+            peaks += [peak + frame - 1 for peak in tmp_peaks]
+    else:
+        tmp_peaks, _ = find_peaks(intenstiy, height=threshold)
+        peaks += list(tmp_peaks)
+    peaks = sorted(list(set(peaks)))
+    return peaks
+
+
+def random_trace(
+    rng: np.random.Generator, length: int, nan_fraction: float = 0.0
+) -> np.ndarray:
+    """
+    Noisy trace with rounded values (plateaus) and optionally NaN frames.
+    """
+    trace = np.round(rng.normal(0, 1, length), int(rng.integers(0, 3)))
+    trace[rng.random(length) < nan_fraction] = np.nan
+    return trace
+
+
+def random_stim_frames(rng: np.random.Generator, length: int) -> list[int]:
+    n = int(rng.integers(0, 12))
+    # includes frame 0, overlapping windows and frames past the trace
+    return sorted(set(int(frame) for frame in rng.integers(0, length + 5, n)))
+
+
+@pytest.mark.parametrize("nan_fraction", [0.0, 0.1])
+def test_non_maximum_suppression(nan_fraction):
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        length = int(rng.integers(1, 200))
+        intensity = random_trace(rng, length, nan_fraction)
+        n_peaks = int(rng.integers(0, length + 1))
+        peaks = sorted(set(rng.integers(0, length, n_peaks).tolist()))
+        window_size = int(rng.integers(0, 30))
+        expected = legacy_non_maximum_suppression(peaks, intensity, window_size)
+        result = non_maximum_suppression(np.array(peaks), intensity, window_size)
+        assert result.tolist() == expected
+
+
+@pytest.mark.parametrize("nan_fraction", [0.0, 0.1])
+def test_stimulation_nms(nan_fraction):
+    rng = np.random.default_rng(1)
+    for _ in range(500):
+        length = int(rng.integers(1, 200))
+        intensity = random_trace(rng, length, nan_fraction)
+        peaks = rng.integers(0, length, int(rng.integers(0, 40)))
+        peaks = list(rng.permutation(np.unique(peaks)).tolist())
+        stim_frames = random_stim_frames(rng, length)
+        patience = int(rng.integers(0, 30))
+        expected = legacy_stimulation_nms(peaks, intensity, stim_frames, patience)
+        result = stimulation_nms(np.array(peaks), intensity, stim_frames, patience)
+        assert result.tolist() == expected
+
+
+@pytest.mark.parametrize("stim_used", [False, True])
+@pytest.mark.parametrize("nan_fraction", [0.0, 0.1])
+def test_peak_detection_scipy(stim_used, nan_fraction):
+    rng = np.random.default_rng(2)
+    for _ in range(500):
+        length = int(rng.integers(0, 200))
+        intensity = random_trace(rng, length, nan_fraction)
+        threshold = rng.normal(0.5, 0.5)
+        stim_frames = random_stim_frames(rng, length)
+        patience = int(rng.integers(1, 30))
+        expected = legacy_peak_detection(
+            intensity, threshold, stim_used, stim_frames, patience
+        )
+        result = peak_detection_scipy(
+            intensity, threshold, stim_used, stim_frames, patience
+        )
+        assert result.tolist() == expected
+
+
+@pytest.mark.parametrize("stim_used", [False, True])
+def test_peak_detection_matrix(stim_used):
+    rng = np.random.default_rng(3)
+    for _ in range(50):
+        length = int(rng.integers(0, 150))
+        n_rois = int(rng.integers(1, 20))
+        traces = np.stack(
+            [random_trace(rng, length, 0.05) for _ in range(n_rois)], axis=1
+        )
+        thresholds = rng.normal(0.5, 0.5, n_rois)
+        stim_frames = random_stim_frames(rng, length)
+        patience = int(rng.integers(1, 30))
+        rois, frames = peak_detection_matrix(
+            traces, thresholds, stim_used, stim_frames, patience, block_size=4
+        )
+        for roi in range(n_rois):
+            expected = legacy_peak_detection(
+                traces[:, roi], thresholds[roi], stim_used, stim_frames, patience
+            )
+            assert frames[rois == roi].tolist() == expected
+        assert np.all(np.diff(rois) >= 0)
+
+
+@pytest.mark.parametrize("stim_used", [False, True])
+def test_compute_thresholds(stim_used):
+    rng = np.random.default_rng(4)
+    for n_frames, n_rois in [(1, 1), (30, 5), (130, 7), (400, 150)]:
+        traces = rng.normal(100, 10, (n_frames, n_rois))
+        traces[rng.random(traces.shape) < 0.01] = np.nan
+        # the baseline of a single frame is empty
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            thresholds = compute_thresholds(
+                stim_used, traces, 2.5, 5, 50, block_size=64
+            )
+            expected = [
+                compute_threshold(stim_used, traces[:, roi], 2.5, 5, 50)
+                for roi in range(n_rois)
+            ]
+        # bit-identical, NaN where a trace contains NaN
+        np.testing.assert_array_equal(thresholds, expected)
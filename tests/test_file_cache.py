@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from trace_selector.utils.configuration import default_config_path, read_settings
+from trace_selector.utils.file_cache import FileCache
+from trace_selector.utils.trace_data import load_file
+
+repo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+test_data_path = os.path.join(repo_path, "test_data.txt")
+
+
+def parsed_file(n_frames: int = 100) -> tuple:
+    traces = np.asfortranarray(np.arange(n_frames * 4, dtype=np.float64).reshape(-1, 4))
+    meta_df = pd.DataFrame(
+        {"Time": np.arange(n_frames) * 0.5, "Name": ["rec"] * n_frames}
+    )
+    return traces, ["a", "b", "c", "d"], {"d": "int64"}, meta_df
+
+
+def test_round_trip(tmp_path):
+    cache = FileCache(str(tmp_path))
+    traces, columns, dtypes, meta_df = parsed_file()
+    assert cache.load("key") is None
+    cached_traces = cache.store("key", traces, columns, dtypes, meta_df, "rec.csv")
+    assert isinstance(cached_traces, np.memmap)
+    loaded = cache.load("key")
+    np.testing.assert_array_equal(loaded[0], traces)
+    assert loaded[0].flags.f_contiguous
+    assert loaded[1:3] == (columns, dtypes)
+    pd.testing.assert_frame_equal(loaded[3], meta_df)
+
+
+def test_cached_file_equals_parsed_file(tmp_path):
+    meta_columns = read_settings(default_config_path)["meta_columns"]
+    cache = FileCache(str(tmp_path))
+    parsed, _ = load_file(test_data_path, "test_data.txt", meta_columns)
+    stored, file_hash = load_file(test_data_path, "test_data.txt", meta_columns, cache)
+    cached, _ = load_file(test_data_path, "test_data.txt", meta_columns, cache)
+    assert file_hash is not None
+    assert len(cache.entries()) == 1
+    for store in [stored, cached]:
+        np.testing.assert_array_equal(store.traces, parsed.traces)
+        assert store.columns == parsed.columns
+        pd.testing.assert_frame_equal(
+            store.to_frame(store.columns), parsed.to_frame(parsed.columns)
+        )
+
+
+@pytest.mark.parametrize(
+    "suffix, content",
+    [
+        # UnpicklingError
+        (".meta.pkl", b"not a pickle"),
+        # pickle of a class that doesn't exist (e.g. after a pandas upgrade)
+        (".meta.pkl", b"cno_module_xy\nDataFrame\n."),
+        (".npy", b"\x93NUMPY truncated"),
+        (".json", b'{"columns": ['),
+        (".json", b'{"version": 1}'),
+    ],
+)
+def test_corrupted_entry_is_a_miss(tmp_path, suffix, content):
+    cache = FileCache(str(tmp_path))
+    cache.store("key", *parsed_file())
+    with open(tmp_path / f"key{suffix}", "wb") as f:
+        f.write(content)
+    assert cache.load("key") is None
+    assert os.listdir(tmp_path) == []
+    # the entry is written again on the next open
+    cache.store("key", *parsed_file())
+    assert cache.load("key") is not None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = FileCache(str(tmp_path))
+    cache.store("a", *parsed_file(1000))
+    entry_size = cache.entries()[0][1]
+    # room for two entries
+    cache.max_mb = 2.5 * entry_size / 1024 / 1024
+    os.utime(tmp_path / "a.json", (1, 1))
+    cache.store("b", *parsed_file(1000))
+    os.utime(tmp_path / "b.json", (2, 2))
+    # a is used again, b is the least recently used entry now
+    assert cache.load("a") is not None
+    cache.store("c", *parsed_file(1000))
+    assert sorted(key for _, _, key in cache.entries()) == ["a", "c"]
+    assert not os.path.exists(tmp_path / "b.npy")
+    # the new entry is kept even if it doesn't fit
+    cache.max_mb = 0
+    cache.store("d", *parsed_file(1000))
+    assert [key for _, _, key in cache.entries()] == ["d"]
@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from trace_selector.utils.configuration import default_config_path, read_settings
+from trace_selector.utils.export import create_peak_df
+from trace_selector.utils.journal import SessionJournal
+from trace_selector.utils.trace_data import SynapseResponseData
+
+repo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+test_data_path = os.path.join(repo_path, "test_data.txt")
+STIM_FRAMES = [20, 60, 100]
+
+
+def open_file(settings: dict) -> SynapseResponseData:
+    synapse_response = SynapseResponseData()
+    synapse_response.open_file(
+        test_data_path,
+        "test_data.txt",
+        settings["meta_columns"],
+        settings["normalization_use_median"],
+        settings["normalization_sliding_window_size"],
+        compute_hash=True,
+    )
+    return synapse_response
+
+
+def start_session(settings: dict, folder: str) -> SynapseResponseData:
+    synapse_response = open_file(settings)
+    journal = SessionJournal(synapse_response.file_hash, str(folder))
+    journal.start(synapse_response.filename, synapse_response.columns)
+    synapse_response.journal = journal
+    return synapse_response
+
+
+def decide(synapse_response: SynapseResponseData, settings: dict, actions: list):
+    """
+    Makes the decisions like the GUI, which shows the next trace after every
+    decision. Keeps are given as the dict of peaks and whether they are selected.
+    """
+    for action in actions:
+        if action == "discard":
+            synapse_response.discard()
+        elif action == "back":
+            if not synapse_response.back():
+                continue
+        elif action == "discard_rest":
+            synapse_response.discard_rest()
+        else:
+            synapse_response.keep(
+                True,
+                settings["frames_for_decay"],
+                action,
+                STIM_FRAMES,
+                settings["stim_frames_patience"],
+            )
+        if synapse_response.end_of_file():
+            return
+        synapse_response.next(
+            settings["normalization_use_median"],
+            settings["normalization_sliding_window_size"],
+        )
+
+
+def resumed(settings: dict, folder: str) -> tuple[SynapseResponseData, bool]:
+    """
+    Opens the file again after a crash and replays its journal.
+    """
+    synapse_response = open_file(settings)
+    journal = SessionJournal(synapse_response.file_hash, str(folder))
+    assert journal.exists()
+    complete = synapse_response.replay(
+        journal.records(),
+        settings["normalization_use_median"],
+        settings["normalization_sliding_window_size"],
+    )
+    journal.resume()
+    synapse_response.journal = journal
+    return synapse_response, complete
+
+
+def assert_same_state(replayed: SynapseResponseData, original: SynapseResponseData):
+    assert replayed.idx == original.idx
+    assert replayed.keep_data == original.keep_data
+    assert replayed.discard_data == original.discard_data
+    assert replayed.last == original.last
+    pd.testing.assert_frame_equal(
+        create_peak_df(replayed.selected_peaks),
+        create_peak_df(original.selected_peaks),
+        check_dtype=False,
+    )
+    np.testing.assert_array_equal(replayed.intensity, original.intensity)
+    np.testing.assert_array_equal(replayed.norm_intensity, original.norm_intensity)
+
+
+ACTIONS = [
+    {22: True, 40: False},
+    "discard",
+    {61: True, 101: True},
+    "back",
+    {62: True},
+    "discard",
+    {},
+]
+
+
+def test_replay_restores_the_session(tmp_path):
+    settings = read_settings(default_config_path)
+    original = start_session(settings, tmp_path)
+    decide(original, settings, ACTIONS)
+    assert original.idx == 5
+    assert len(original.selected_peaks) == 2
+
+    replayed, complete = resumed(settings, tmp_path)
+    assert not complete
+    assert_same_state(replayed, original)
+    # the resumed session goes on like the original one
+    decide(original, settings, ["discard", {30: True}])
+    decide(replayed, settings, ["discard", {30: True}])
+    assert_same_state(replayed, original)
+
+
+def test_partially_written_record_is_ignored(tmp_path):
+    settings = read_settings(default_config_path)
+    original = start_session(settings, tmp_path)
+    decide(original, settings, ACTIONS)
+    with open(original.journal.path, "a") as f:
+        f.write('{"action": "keep", "idx": 5, "respo')
+
+    replayed, _ = resumed(settings, tmp_path)
+    assert_same_state(replayed, original)
+    # the partial line was cut off, new records are readable
+    decide(replayed, settings, ["discard"])
+    records = SessionJournal(replayed.file_hash, str(tmp_path)).records()
+    assert len(records) == len(ACTIONS) + 2
+    assert records[-1] == {"action": "discard", "idx": 5}
+
+
+def test_replay_of_a_finished_file(tmp_path):
+    settings = read_settings(default_config_path)
+    original = start_session(settings, tmp_path)
+    decide(original, settings, [{22: True}, "discard_rest"])
+
+    replayed, complete = resumed(settings, tmp_path)
+    assert complete
+    assert replayed.idx == len(replayed.columns) - 1
+    assert replayed.keep_data == original.keep_data
+    assert replayed.discard_data == original.discard_data
+    assert len(replayed.keep_data) + len(replayed.discard_data) == len(replayed.columns)
@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from trace_selector.detection.model_wraper import torch_model  # noqa: E402
+from trace_selector.utils.hash import HashIndex  # noqa: E402
+
+
+class Scale(torch.nn.Module):
+    def __init__(self, scale: float) -> None:
+        super().__init__()
+        self.scale = scale
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return torch.sigmoid(x * self.scale)
+
+
+def save_model(path, scale: float) -> str:
+    torch.jit.script(Scale(scale)).save(str(path))
+    return str(path)
+
+
+def expected(trace: np.ndarray, scale: float) -> np.ndarray:
+    return 1 / (1 + np.exp(-trace * scale))
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """
+    torch_model that records the paths of all loaded and warmed up models.
+    """
+    model = torch_model(max_sessions=2)
+    model.loaded = []
+    model.warmed_up = []
+    names = {}
+    load_module, warm_up = model.load_module, model.warm_up
+
+    def record_load(model_path: str, optimize: bool = False):
+        model.loaded.append((os.path.basename(model_path), optimize))
+        module = load_module(model_path, optimize)
+        names[id(module)] = os.path.basename(model_path)
+        return module
+
+    def record_warm_up(module) -> None:
+        warm_up(module)
+        model.warmed_up.append(names[id(module)])
+
+    monkeypatch.setattr(model, "load_module", record_load)
+    monkeypatch.setattr(model, "warm_up", record_warm_up)
+    return model
+
+
+def test_least_recently_used_model_is_evicted(tmp_path, model):
+    paths = [save_model(tmp_path / f"{name}.pt", 1.0) for name in "abc"]
+    for path in paths + paths[1:]:
+        assert model.load_weights(path)
+    # b and c are cached, a is loaded again
+    assert [name for name, _ in model.loaded] == ["a.pt", "b.pt", "c.pt"]
+    model.load_weights(paths[0])
+    assert [name for name, _ in model.loaded] == ["a.pt", "b.pt", "c.pt", "a.pt"]
+    assert [os.path.basename(key[0]) for key in model.sessions] == ["c.pt", "a.pt"]
+
+
+def test_changed_model_file_is_loaded_again(tmp_path, model, monkeypatch):
+    model.hash_index = HashIndex(str(tmp_path / "index.json"))
+    saves = []
+    save = model.hash_index.save
+    monkeypatch.setattr(model.hash_index, "save", lambda: saves.append(save()))
+    path = save_model(tmp_path / "a.pt", 1.0)
+    trace = np.linspace(-2, 2, 50)
+    model.load_weights(path)
+    np.testing.assert_allclose(
+        model.probabilities(trace), expected(trace, 1.0), rtol=1e-6
+    )
+    assert os.path.isfile(tmp_path / "index.json")
+    # the index is only saved when a hash was computed, not on every load
+    model.load_weights(path)
+    assert len(saves) == 1
+    assert len(model.loaded) == 1
+
+    save_model(path, 3.0)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    model.load_weights(path)
+    assert len(model.loaded) == 2
+    assert len(saves) == 2
+    np.testing.assert_allclose(
+        model.probabilities(trace), expected(trace, 3.0), rtol=1e-6
+    )
+
+
+def test_set_optimize_rebuilds_the_model(tmp_path, model):
+    path = save_model(tmp_path / "a.pt", 2.0)
+    trace = np.linspace(-2, 2, 50)
+    model.load_weights(path)
+    model.cache["trace"] = np.zeros(50)
+    model.set_optimize(True)
+    assert model.loaded == [("a.pt", False), ("a.pt", True)]
+    assert model.cache == {}
+    np.testing.assert_allclose(
+        model.probabilities(trace), expected(trace, 2.0), rtol=1e-6
+    )
+    # switching back uses the cached model
+    model.set_optimize(False)
+    model.set_optimize(False)
+    assert len(model.loaded) == 2
+    assert [key[2] for key in model.sessions] == [True, False]
+
+
+def test_models_are_warmed_up_before_they_are_used(tmp_path, model):
+    a = save_model(tmp_path / "a.pt", 1.0)
+    b = save_model(tmp_path / "b.pt", 1.0)
+    model.load_weights(a)
+    assert model.warmed_up == ["a.pt"]
+    # a preloaded model is handed over once it is warmed up, not loaded again
+    future = model.preload(b)
+    model.load_weights(b)
+    assert future.done()
+    assert model.loaded == [("a.pt", False), ("b.pt", False)]
+    assert model.warmed_up == ["a.pt", "b.pt"]
+    assert model.model is model.cached_session(model.session_key(b))
+    # nothing to do for a cached model
+    model.preload(a).result()
+    assert len(model.loaded) == 2
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from trace_selector.detection.model_zoo import PART_SUFFIX, ModelZoo
+
+MODELS = {
+    "a.pt": bytes(range(256)) * 1000,
+    "b.pt": bytes(reversed(range(256))) * 1500,
+}
+
+
+class ModelServer(BaseHTTPRequestHandler):
+    """
+    Serves the GitHub API listing (/api), models.json (/info) and the models
+    (/models/<name>). Range requests are answered with 206 unless
+    supports_range is False.
+    """
+
+    protocol_version = "HTTP/1.1"
+    supports_range = True
+    requests = []
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def send_body(self, status: int, body: bytes, headers: dict | None = None) -> None:
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        port = self.server.server_address[1]
+        range_header = self.headers.get("Range")
+        ModelServer.requests.append((self.path, range_header))
+        if self.path == "/api":
+            listing = [
+                {"name": name, "download_url": f"http://127.0.0.1:{port}/models/{name}"}
+                for name in MODELS
+            ]
+            self.send_body(200, json.dumps(listing).encode())
+        elif self.path == "/info":
+            info = {
+                name.split(".pt")[0]: hashlib.sha256(data).hexdigest()
+                for name, data in MODELS.items()
+            }
+            self.send_body(200, json.dumps(info).encode())
+        else:
+            data = MODELS[self.path.split("/")[-1]]
+            match = re.match(r"bytes=(\d+)-", range_header or "")
+            if match is None or not ModelServer.supports_range:
+                self.send_body(200, data)
+                return
+            start = int(match.group(1))
+            if start >= len(data):
+                self.send_body(416, b"")
+                return
+            self.send_body(
+                206,
+                data[start:],
+                {"Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}"},
+            )
+
+
+@pytest.fixture
+def server():
+    ModelServer.supports_range = True
+    ModelServer.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ModelServer)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def model_zoo(path, server: str) -> ModelZoo:
+    return ModelZoo(str(path), f"{server}/api", f"{server}/info")
+
+
+def model_requests() -> list[tuple[str, str | None]]:
+    return [request for request in ModelServer.requests if "/models/" in request[0]]
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_update_downloads_missing_models(tmp_path, server, capsys):
+    zoo = model_zoo(tmp_path, server)
+    zoo.update()
+    for name, data in MODELS.items():
+        assert (tmp_path / name).read_bytes() == data
+        assert zoo.model_hash(name.split(".pt")[0]) == sha256(data)
+    assert "All models are up-to-date." not in capsys.readouterr().out
+    # nothing to download anymore
+    ModelServer.requests = []
+    model_zoo(tmp_path, server).update()
+    assert model_requests() == []
+    assert "All models are up-to-date." in capsys.readouterr().out
+
+
+def test_interrupted_download_is_resumed(tmp_path, server):
+    data = MODELS["a.pt"]
+    (tmp_path / f"a.pt{PART_SUFFIX}").write_bytes(data[:1000])
+    zoo = model_zoo(tmp_path, server)
+    assert zoo.download_model(f"{server}/models/a.pt", "a.pt", sha256(data))
+    assert model_requests() == [("/models/a.pt", "bytes=1000-")]
+    assert (tmp_path / "a.pt").read_bytes() == data
+    assert not (tmp_path / f"a.pt{PART_SUFFIX}").exists()
+
+
+def test_ignored_range_downloads_whole_file(tmp_path, server):
+    ModelServer.supports_range = False
+    data = MODELS["a.pt"]
+    (tmp_path / f"a.pt{PART_SUFFIX}").write_bytes(data[:1000])
+    zoo = model_zoo(tmp_path, server)
+    assert zoo.download_model(f"{server}/models/a.pt", "a.pt", sha256(data))
+    assert (tmp_path / "a.pt").read_bytes() == data
+
+
+def test_complete_part_file_restarts(tmp_path, server):
+    data = MODELS["a.pt"]
+    (tmp_path / f"a.pt{PART_SUFFIX}").write_bytes(data)
+    zoo = model_zoo(tmp_path, server)
+    assert zoo.download_model(f"{server}/models/a.pt", "a.pt", sha256(data))
+    assert model_requests() == [
+        ("/models/a.pt", f"bytes={len(data)}-"),
+        ("/models/a.pt", None),
+    ]
+    assert (tmp_path / "a.pt").read_bytes() == data
+
+
+def test_stale_part_is_downloaded_again(tmp_path, server):
+    (tmp_path / "a.pt").write_bytes(b"previous weights")
+    # a stale part of different weights is resumed, but fails the hash check
+    (tmp_path / f"a.pt{PART_SUFFIX}").write_bytes(b"\0" * 1000)
+    zoo = model_zoo(tmp_path, server)
+    assert zoo.download_model(f"{server}/models/a.pt", "a.pt", sha256(MODELS["a.pt"]))
+    assert model_requests() == [
+        ("/models/a.pt", "bytes=1000-"),
+        ("/models/a.pt", None),
+    ]
+    assert (tmp_path / "a.pt").read_bytes() == MODELS["a.pt"]
+    assert not (tmp_path / f"a.pt{PART_SUFFIX}").exists()
+
+
+def test_hash_mismatch_keeps_the_model(tmp_path, server):
+    (tmp_path / "a.pt").write_bytes(b"previous weights")
+    zoo = model_zoo(tmp_path, server)
+    assert not zoo.download_model(f"{server}/models/a.pt", "a.pt", sha256(b"other"))
+    # not retried, nothing was resumed
+    assert model_requests() == [("/models/a.pt", None)]
+    # a stale part is resumed and downloaded again once
+    ModelServer.requests = []
+    (tmp_path / f"a.pt{PART_SUFFIX}").write_bytes(b"\0" * 1000)
+    assert not zoo.download_model(f"{server}/models/a.pt", "a.pt", sha256(b"other"))
+    assert len(model_requests()) == 2
+    assert (tmp_path / "a.pt").read_bytes() == b"previous weights"
+    assert not (tmp_path / f"a.pt{PART_SUFFIX}").exists()
+
+
+def test_part_without_hash_is_not_resumed(tmp_path, server):
+    (tmp_path / f"a.pt{PART_SUFFIX}").write_bytes(b"\0" * 1000)
+    zoo = model_zoo(tmp_path, server)
+    assert zoo.download_model(f"{server}/models/a.pt", "a.pt")
+    assert model_requests() == [("/models/a.pt", None)]
+    assert (tmp_path / "a.pt").read_bytes() == MODELS["a.pt"]
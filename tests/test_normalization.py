@@ -0,0 +1,75 @@
+import warnings
+import numpy as np
+import pytest
+
+from trace_selector.utils.normalization import sliding_window_normalization
+
+
+def legacy_normalization(
+    trace: np.ndarray, use_median: bool, window_size: int
+) -> np.ndarray:
+    """
+    The previous per-frame implementation of sliding_window_normalization.
+    """
+    norm_trace = np.empty_like(trace, dtype=np.float64)
+    for pos, dp in enumerate(trace):
+        start = max(0, pos - window_size // 2)
+        end = min(pos + window_size // 2, len(trace) - 1)
+        window = trace[start:end]
+        norm_factor = np.median(window) if use_median else np.mean(window)
+        norm_trace[pos] = dp / norm_factor
+    return norm_trace
+
+
+def random_trace(rng: np.random.Generator, length: int) -> np.ndarray:
+    return rng.normal(100, 10, length) + rng.uniform(0, 50) * np.sin(
+        np.arange(length) / rng.uniform(5, 50)
+    )
+
+
+@pytest.mark.parametrize("use_median", [True, False])
+@pytest.mark.parametrize("window_size", [1, 2, 7, 50])
+def test_matches_legacy(use_median, window_size):
+    rng = np.random.default_rng(window_size)
+    for _ in range(20):
+        trace = random_trace(rng, int(rng.integers(window_size + 1, 400)))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = legacy_normalization(trace, use_median, window_size)
+            result = sliding_window_normalization(trace, use_median, window_size)
+        np.testing.assert_allclose(result, expected, rtol=1e-9, equal_nan=True)
+
+
+@pytest.mark.parametrize("use_median", [True, False])
+@pytest.mark.parametrize("value", [np.nan, np.inf, -np.inf])
+def test_non_finite_frame_only_affects_its_windows(use_median, value):
+    rng = np.random.default_rng(1)
+    trace = random_trace(rng, 300)
+    trace[150] = value
+    window_size = 20
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        expected = legacy_normalization(trace, use_median, window_size)
+        result = sliding_window_normalization(trace, use_median, window_size)
+    np.testing.assert_allclose(result, expected, rtol=1e-9, equal_nan=True)
+    # frames whose window doesn't contain the non-finite frame stay finite
+    assert np.all(np.isfinite(result[:100]))
+    assert np.all(np.isfinite(result[200:]))
+
+
+@pytest.mark.parametrize("use_median", [True, False])
+def test_columns_match_single_traces(use_median):
+    rng = np.random.default_rng(2)
+    traces = np.stack([random_trace(rng, 250) for _ in range(6)], axis=1)
+    traces[40, 2] = np.nan
+    traces[100, 4] = np.inf
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        result = sliding_window_normalization(traces, use_median, 30)
+        for i in range(traces.shape[1]):
+            np.testing.assert_allclose(
+                result[:, i],
+                sliding_window_normalization(traces[:, i], use_median, 30),
+                rtol=1e-12,
+                equal_nan=True,
+            )
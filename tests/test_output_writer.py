@@ -0,0 +1,127 @@
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+from trace_selector.utils.configuration import default_config_path, read_settings
+from trace_selector.utils.output_writer import OutputWriter, write_atomic, write_table
+from trace_selector.utils.trace_data import SynapseResponseData
+
+repo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+test_data_path = os.path.join(repo_path, "test_data.txt")
+
+
+def failing_write(tmp_path: str) -> None:
+    with open(tmp_path, "w") as f:
+        f.write("partial")
+    raise OSError("disk full")
+
+
+def test_failed_write_leaves_no_partial_file(tmp_path):
+    path = str(tmp_path / "out.csv")
+    with pytest.raises(OSError):
+        write_atomic(path, failing_write)
+    assert os.listdir(tmp_path) == []
+
+
+def test_interrupted_write_keeps_the_previous_file(tmp_path):
+    path = tmp_path / "out.xlsx"
+    path.write_text("previous")
+
+    def interrupted_write(tmp_path: str) -> None:
+        with open(tmp_path, "w") as f:
+            f.write("partial")
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        write_atomic(str(path), interrupted_write)
+    assert os.listdir(tmp_path) == ["out.xlsx"]
+    assert path.read_text() == "previous"
+
+
+@pytest.mark.parametrize("extension", [".csv", ".xlsx"])
+def test_write_table(tmp_path, extension):
+    df = pd.DataFrame({"Time": [0.0, 0.5, 1.0], "ROI 1": [1.5, 2.5, 3.5]})
+    path = str(tmp_path / f"out{extension}")
+    write_table(df, path)
+    read = pd.read_csv if extension == ".csv" else pd.read_excel
+    pd.testing.assert_frame_equal(read(path), df)
+    assert os.listdir(tmp_path) == [f"out{extension}"]
+
+
+def test_saves_are_written_in_order_and_reserve_their_paths(tmp_path):
+    writer = OutputWriter()
+    release = threading.Event()
+    written = []
+
+    def write(name: str, wait: bool = False):
+        def run() -> None:
+            if wait:
+                release.wait(5)
+            (tmp_path / name).write_text(name)
+            written.append(name)
+
+        return run
+
+    first = writer.submit([(str(tmp_path / "a"), write("a", wait=True))])
+    second = writer.submit([(str(tmp_path / "b"), write("b"))])
+    # pending outputs count as existing, so they aren't overwritten
+    assert writer.exists(str(tmp_path / "a"))
+    assert writer.exists(str(tmp_path / "b"))
+    assert not writer.exists(str(tmp_path / "c"))
+    release.set()
+    second.result()
+    assert first.done()
+    assert written == ["a", "b"]
+    writer.close()
+
+
+def test_failed_save_reports_the_error(tmp_path):
+    writer = OutputWriter()
+    path = str(tmp_path / "out.csv")
+    future = writer.submit([(path, lambda: write_atomic(path, failing_write))])
+    with pytest.raises(OSError, match="disk full"):
+        future.result()
+    assert not writer.exists(path)
+    # later saves are still written
+    writer.submit([(path, lambda: write_table(pd.DataFrame({"a": [1]}), path))])
+    writer.wait()
+    assert os.path.exists(path)
+    writer.close()
+
+
+def test_background_save_equals_direct_save(tmp_path):
+    settings = read_settings(default_config_path)
+    synapse_response = SynapseResponseData()
+    synapse_response.open_file(
+        test_data_path,
+        "test_data.txt",
+        settings["meta_columns"],
+        settings["normalization_use_median"],
+        settings["normalization_sliding_window_size"],
+    )
+    synapse_response.keep_data = synapse_response.columns[::2]
+    synapse_response.discard_data = synapse_response.columns[1::2]
+    outputs = []
+    for name, writer in [("direct", None), ("background", OutputWriter())]:
+        settings["output_filepath"] = str(tmp_path / name)
+        future = synapse_response.save([], settings, None, writer)
+        if writer is not None:
+            future.result()
+            writer.close()
+        folder = tmp_path / name / "keep_folder"
+        outputs.append(
+            {
+                filename: (folder / filename).read_bytes()
+                for filename in os.listdir(folder)
+                if filename.endswith(".csv")
+            }
+        )
+    assert outputs[0] == outputs[1]
+    keep = pd.read_csv(tmp_path / "direct" / "keep_folder" / "test_data.csv")
+    df = pd.read_csv(test_data_path)
+    meta_columns = [col for col in df.columns if col in settings["meta_columns"]]
+    assert list(keep.columns) == meta_columns + synapse_response.columns[::2]
+    for column in synapse_response.columns[::2]:
+        pd.testing.assert_series_equal(keep[column], df[column])
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+
+from trace_selector.detection.detection_cache import DetectionCache
+from trace_selector.detection.response_detection import stimulation_frames
+from trace_selector.gui.prefetch import TracePrefetcher
+from trace_selector.utils.configuration import default_config_path, read_settings
+from trace_selector.utils.trace_data import SynapseResponseData, load_file
+
+repo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+test_data_path = os.path.join(repo_path, "test_data.txt")
+
+
+def open_traces(synapse_response: SynapseResponseData, settings: dict, scale: float):
+    """
+    (Re)opens test_data.txt with all traces multiplied by scale, like a file
+    that changed on disk.
+    """
+    store, _ = load_file(test_data_path, "test_data.txt", settings["meta_columns"])
+    store.traces *= scale
+    synapse_response.set_file(
+        "test_data.txt",
+        store,
+        None,
+        settings["normalization_use_median"],
+        settings["normalization_sliding_window_size"],
+    )
+
+
+def test_reopened_file_doesnt_use_prepared_traces():
+    settings = read_settings(default_config_path)
+    synapse_response = SynapseResponseData()
+    open_traces(synapse_response, settings, 1.0)
+    stim_frames = stimulation_frames(settings, len(synapse_response.time))
+    prefetcher = TracePrefetcher(3, DetectionCache(16))
+    state = prefetcher.make_state(synapse_response.file_id, settings)
+    prefetcher.prefetch(synapse_response, state, settings, stim_frames)
+    assert prefetcher.get(1, state).intensity[0] == synapse_response.store.traces[0, 1]
+
+    open_traces(synapse_response, settings, 2.0)
+    new_state = prefetcher.make_state(synapse_response.file_id, settings)
+    assert new_state != state
+    assert prefetcher.get(2, new_state) is None
+    prefetcher.prefetch(synapse_response, new_state, settings, stim_frames)
+    prepared = prefetcher.get(2, new_state)
+    np.testing.assert_array_equal(
+        prepared.intensity, synapse_response.store.traces[:, 2]
+    )
+
+
+def test_invalidate_drops_prepared_traces():
+    settings = read_settings(default_config_path)
+    synapse_response = SynapseResponseData()
+    open_traces(synapse_response, settings, 1.0)
+    prefetcher = TracePrefetcher(3)
+    state = prefetcher.make_state(synapse_response.file_id, settings)
+    prefetcher.prefetch(synapse_response, state, settings, [])
+    prefetcher.invalidate()
+    assert prefetcher.get(1, state) is None
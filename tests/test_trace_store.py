@@ -0,0 +1,108 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from trace_selector.utils import trace_store
+from trace_selector.utils.configuration import default_config_path, read_settings
+from trace_selector.utils.trace_data import load_file
+from trace_selector.utils.trace_store import (
+    TraceStore,
+    allocate_traces,
+    release_traces,
+    temporary_path,
+)
+
+repo_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+test_data_path = os.path.join(repo_path, "test_data.txt")
+meta_columns = read_settings(default_config_path)["meta_columns"]
+
+
+@pytest.fixture
+def spill(monkeypatch):
+    """
+    Traces of more than 1 KiB are memory-mapped.
+    """
+    monkeypatch.setattr(trace_store, "MEMMAP_THRESHOLD_MB", 1 / 1024)
+
+
+def parsed_file() -> tuple:
+    rng = np.random.default_rng(0)
+    traces = np.asfortranarray(rng.normal(0, 1, (200, 5)))
+    traces[:, 4] = np.round(traces[:, 4] * 100)
+    meta_df = pd.DataFrame(
+        {"Time": np.arange(200) * 0.5, "Name": ["rec"] * 200, "Empty": [np.nan] * 200}
+    )
+    return traces, ["a", "b", "c", "d", "e"], {"e": "int64"}, meta_df
+
+
+def test_spilled_store_matches_memory(monkeypatch):
+    traces, columns, dtypes, meta_df = parsed_file()
+    in_memory = TraceStore(traces.copy(), columns, dtypes, meta_df)
+    assert not isinstance(in_memory.traces, np.memmap)
+    monkeypatch.setattr(trace_store, "MEMMAP_THRESHOLD_MB", 1 / 1024)
+    spilled = TraceStore(traces.copy(), columns, dtypes, meta_df)
+    assert isinstance(spilled.traces, np.memmap)
+    assert spilled.traces.flags.f_contiguous
+    path = spilled.tmp_path
+    assert os.path.dirname(path) == os.path.abspath(tempfile.gettempdir())
+    for col in columns:
+        np.testing.assert_array_equal(
+            spilled.column(col), traces[:, columns.index(col)]
+        )
+    pd.testing.assert_frame_equal(
+        spilled.to_frame(["e", "b"]), in_memory.to_frame(["e", "b"])
+    )
+    norm = traces * 2
+    pd.testing.assert_frame_equal(
+        spilled.to_frame(columns, norm), in_memory.to_frame(columns, norm)
+    )
+    spilled.close()
+    assert not os.path.exists(path)
+    assert spilled.traces.shape == (0, 5)
+
+
+def test_small_traces_stay_in_memory():
+    traces, columns, dtypes, meta_df = parsed_file()
+    store = TraceStore(traces, columns, dtypes, meta_df)
+    assert not isinstance(store.traces, np.memmap)
+    assert store.tmp_path is None
+    frame = store.to_frame(columns)
+    assert list(frame.columns) == ["Time", "Name", "Empty"] + columns
+    assert frame["e"].dtype == np.int64
+    pd.testing.assert_frame_equal(frame[["Time", "Name", "Empty"]], meta_df)
+    # the constant columns are stored once
+    assert store.meta_constant == {"Time": False, "Name": True, "Empty": True}
+    assert len(store.meta["Name"]) == 1
+
+
+def test_loaded_file_spilled_to_disk_matches_memory(spill):
+    spilled, _ = load_file(test_data_path, "test_data.txt", meta_columns)
+    assert isinstance(spilled.traces, np.memmap)
+    df = pd.read_csv(test_data_path)
+    for col in spilled.columns:
+        np.testing.assert_array_equal(spilled.column(col), df[col].to_numpy(float))
+    file_meta_columns = [col for col in df.columns if col not in spilled.columns]
+    pd.testing.assert_frame_equal(
+        spilled.to_frame(spilled.columns), df[file_meta_columns + spilled.columns]
+    )
+    path = spilled.tmp_path
+    spilled.close()
+    assert not os.path.exists(path)
+
+
+def test_release_only_removes_temporary_files(spill, tmp_path):
+    mapped = allocate_traces(100, 10)
+    path = temporary_path(mapped)
+    assert os.path.isfile(path)
+    release_traces(mapped)
+    assert not os.path.exists(path)
+    # files mapped from elsewhere (e.g. the file cache) are left alone
+    other = np.memmap(tmp_path / "cache.npy", dtype=np.float64, mode="w+", shape=(10,))
+    assert temporary_path(other) is None
+    release_traces(other)
+    assert os.path.isfile(tmp_path / "cache.npy")
+    # small traces aren't mapped
+    release_traces(allocate_traces(2, 2))
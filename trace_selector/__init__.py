@@ -1,26 +1,35 @@
-from .gui.gui import MainWindow
-from .utils.configuration import gui_settings
-from .detection.model_zoo import ModelZoo
-
-from PyQt6.QtWidgets import QApplication
 import sys
-from platformdirs import user_data_dir
+
 
 class App:
-    main: MainWindow = None
-    def start(): 
+    main: "MainWindow" = None
+
+    def start():
+        # the GUI and its dependencies are only imported when it is started,
+        # e.g. batch mode doesn't need them
+        from PyQt6.QtCore import Qt
+        from PyQt6.QtWidgets import QApplication
+        from platformdirs import user_data_dir
+        from .gui.gui import MainWindow
+        from .utils.configuration import gui_settings
+        from .detection.model_zoo import ModelZoo
+
+        # allows importing QtWebEngine after the application was created, the
+        # plotly view is only created once a file is opened
+        QApplication.setAttribute(Qt.ApplicationAttribute.AA_ShareOpenGLContexts)
+        app = QApplication(sys.argv)
+
         # get modelzoo directory
         modelzoo_folder = user_data_dir("trace_selector")
 
-        # check for available ML models
+        # available ML models, updates are checked once the window is shown
         modelzoo = ModelZoo(modelzoo_folder)
-        modelzoo.check_for_updates()
 
         # initalize settings
         settings = gui_settings(modelzoo)
 
         # initalize GUI
-        app = QApplication(sys.argv)
         App.main = MainWindow(settings)
         App.main.show()
-        sys.exit(app.exec())
\ No newline at end of file
+        modelzoo.update_in_background(App.main.models_updated.emit)
+        sys.exit(app.exec())
@@ -1,3 +1,9 @@
+import sys
 from . import App
+
 if __name__ == "__main__":
-    App.start()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        from .batch import main
+
+        sys.exit(main(sys.argv[2:]))
+    App.start()
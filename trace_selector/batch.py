@@ -0,0 +1,305 @@
+"""
+Headless batch processing of recordings.
+
+Runs the response detection on every trace of every input file, keeps all
+traces with at least `--min-responses` detected responses, discards the rest
+and writes the same output files as the GUI.
+
+Usage:
+    python -m trace_selector batch INPUT [INPUT ...] [-o OUTPUT] [--settings SETTINGS]
+                                   [--workers N] [--min-responses N] [--recursive]
+                                   [--aggregate EXPORT_PATH]
+"""
+import argparse
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from .utils.configuration import read_settings
+from .utils.trace_data import (
+    SynapseResponseData,
+    output_extension,
+    unique_output_prefix,
+)
+from .utils.file_cache import file_cache_from_settings
+from .utils.aggregate import AggregateStore, aggregate_folder
+from .detection.response_detection import (
+    combine_peaks,
+    detect_file,
+    stimulation_frames,
+)
+
+INPUT_EXTENSIONS = (".txt", ".csv", ".xlsx", ".xls")
+
+
+def collect_input_files(paths: list[str], recursive: bool = False) -> list[str]:
+    """
+    Expands all folders in paths to the supported input files they contain.
+    """
+    input_files = []
+    for path in paths:
+        if os.path.isfile(path):
+            input_files.append(path)
+            continue
+        if recursive:
+            for root, _, filenames in os.walk(path):
+                input_files += [
+                    os.path.join(root, filename)
+                    for filename in sorted(filenames)
+                    if filename.endswith(INPUT_EXTENSIONS)
+                ]
+        else:
+            input_files += [
+                os.path.join(path, filename)
+                for filename in sorted(os.listdir(path))
+                if filename.endswith(INPUT_EXTENSIONS)
+            ]
+    return input_files
+
+
+def output_prefixes(input_files: list[str], settings: dict) -> dict[str, str]:
+    """
+    Reserves a unique output name (without extension) for every input file
+    before the files are distributed to the workers, which can't see each
+    other's outputs. Input files with the same name (e.g. in different
+    folders with --recursive) are named after their path relative to the
+    common folder of all inputs. Names whose output exists already are
+    numbered as in the GUI.
+    """
+    if len(input_files) == 0:
+        return {}
+    keep_path = os.path.join(settings["output_filepath"], "keep_folder")
+    names = [os.path.basename(filepath) for filepath in input_files]
+    name_counts = Counter(names)
+    root = os.path.commonpath(
+        [os.path.dirname(os.path.abspath(filepath)) for filepath in input_files]
+    )
+    reserved = set()
+    prefixes = {}
+    for filepath, name in zip(input_files, names):
+        if name_counts[name] > 1:
+            name = os.path.relpath(os.path.abspath(filepath), root)
+            name = name.replace(os.sep, "_")
+        extension = output_extension(name, settings)
+        file_prefix = ".".join(name.split(".")[:-1])
+        prefix = unique_output_prefix(
+            file_prefix,
+            lambda prefix: prefix in reserved
+            or os.path.exists(os.path.join(keep_path, f"{prefix}{extension}")),
+        )
+        if prefix != file_prefix:
+            print(
+                f"{file_prefix}{extension} is taken, {filepath} is saved as {prefix}{extension}"
+            )
+        reserved.add(prefix)
+        prefixes[filepath] = prefix
+    return prefixes
+
+
+def process_file(
+    filepath: str, settings: dict, min_responses: int, output_prefix: str | None = None
+) -> dict:
+    """
+    Runs detection on all traces of a file, keeps or discards every trace by
+    the number of detected responses and saves the results (named
+    output_prefix, if given).
+    """
+    start_time = time.perf_counter()
+    synapse_response = SynapseResponseData()
+    synapse_response.open_file(
+        filepath,
+        os.path.basename(filepath),
+        settings["meta_columns"],
+        settings["normalization_use_median"],
+        settings["normalization_sliding_window_size"],
+        file_cache_from_settings(settings),
+        # identifies the file in the aggregated results
+        compute_hash=settings["aggregate_results"],
+    )
+
+    norm_traces = synapse_response.get_norm_traces(
+        settings["normalization_use_median"],
+        settings["normalization_sliding_window_size"],
+    )
+    model = None
+    if settings["ml_detection"]:
+        from .detection.model_wraper import torch_model
+
+        model = torch_model(
+            settings["ml_batch_size"],
+            settings["ml_num_threads"],
+            settings["ml_optimize_for_inference"],
+        )
+        if not model.load_weights(settings["model_path"]):
+            raise FileNotFoundError(f"Model {settings['model_path']} does not exist.")
+        model.predict_batch(norm_traces, synapse_response.columns)
+
+    stim_frames = stimulation_frames(settings, len(synapse_response.time))
+    # threshold-based candidates of all traces in one pass over the file
+    candidates = None
+    if settings["th_detection"]:
+        _, candidates = detect_file(
+            synapse_response.store.traces, norm_traces, settings, stim_frames
+        )
+    response_rois = []
+    response_peaks = []
+    while True:
+        column = synapse_response.columns[synapse_response.idx]
+        th_peaks = []
+        if candidates is not None:
+            th_peaks = candidates.peaks(synapse_response.column_index[column])
+        preds = np.empty(0, dtype=np.float64)
+        if model is not None:
+            preds = model.probabilities(synapse_response.norm_intensity, column)
+        peaks = combine_peaks(
+            th_peaks, preds, synapse_response.norm_intensity, settings
+        )
+        synapse_response.add_automatic_peaks(peaks)
+        if len(peaks) >= min_responses:
+            synapse_response.keep(
+                False,
+                settings["frames_for_decay"],
+                {},
+                stim_frames,
+                settings["stim_frames_patience"],
+            )
+            response_rois += [synapse_response.idx] * len(peaks)
+            response_peaks += peaks
+        else:
+            synapse_response.discard()
+        if synapse_response.end_of_file():
+            break
+        synapse_response.next(
+            settings["normalization_use_median"],
+            settings["normalization_sliding_window_size"],
+        )
+    # metrics of all kept responses of the file at once
+    synapse_response.add_responses(
+        response_rois,
+        response_peaks,
+        [True] * len(response_peaks),
+        settings["frames_for_decay"],
+        stim_frames,
+        settings["stim_frames_patience"],
+    )
+    responses = len(response_peaks)
+    synapse_response.save(stim_frames, settings, None, output_prefix=output_prefix)
+    return {
+        "filepath": filepath,
+        "traces": len(synapse_response),
+        "kept": len(synapse_response.keep_data),
+        "responses": responses,
+        "seconds": time.perf_counter() - start_time,
+    }
+
+
+def run_batch(
+    input_files: list[str], settings: dict, min_responses: int = 1, workers: int = 1
+) -> list[dict]:
+    """
+    Processes all input files with a pool of worker processes and prints a
+    throughput summary.
+    """
+    start_time = time.perf_counter()
+    results = []
+    failed = []
+    prefixes = output_prefixes(input_files, settings)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                process_file, filepath, settings, min_responses, prefixes[filepath]
+            ): filepath
+            for filepath in input_files
+        }
+        for future in as_completed(futures):
+            filepath = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"[FAILED] {filepath}: {e}", flush=True)
+                failed.append(filepath)
+                continue
+            results.append(result)
+            print(
+                f"[DONE] {filepath}: kept {result['kept']}/{result['traces']} traces "
+                f"with {result['responses']} responses ({result['seconds']:.2f} s)",
+                flush=True,
+            )
+    elapsed = time.perf_counter() - start_time
+    total_traces = sum(result["traces"] for result in results)
+    total_kept = sum(result["kept"] for result in results)
+    total_responses = sum(result["responses"] for result in results)
+    print(
+        f"Processed {len(results)} files ({len(failed)} failed) in {elapsed:.2f} s "
+        f"with {workers} worker(s)."
+    )
+    print(f"Kept {total_kept}/{total_traces} traces with {total_responses} responses.")
+    if elapsed > 0:
+        print(
+            f"Throughput: {len(results) / elapsed * 60:.1f} files/min, "
+            f"{total_traces / elapsed:.1f} traces/s."
+        )
+    return results
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m trace_selector batch",
+        description="Run response detection and analysis on recordings without the GUI.",
+    )
+    parser.add_argument("inputs", nargs="+", help="input files or folders")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="",
+        help="output folder (default: output folder of the settings)",
+    )
+    parser.add_argument(
+        "--settings",
+        default="",
+        help="settings .json file (default: settings of the last GUI session)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of files processed in parallel",
+    )
+    parser.add_argument(
+        "--min-responses",
+        type=int,
+        default=1,
+        help="keep a trace if at least this many responses are detected",
+    )
+    parser.add_argument(
+        "--recursive", action="store_true", help="search input folders recursively"
+    )
+    parser.add_argument(
+        "--aggregate",
+        default="",
+        metavar="EXPORT_PATH",
+        help="collect the analysis tables of all files and export them combined "
+        "to EXPORT_PATH (.xlsx workbook, otherwise one .csv per table)",
+    )
+    args = parser.parse_args(argv)
+
+    settings = read_settings(args.settings)
+    # responses are always analysed in batch mode
+    settings["select_responses"] = True
+    if args.output != "":
+        settings["output_filepath"] = args.output
+    if settings["output_filepath"] == "":
+        parser.error("no output folder set, use --output")
+    if args.aggregate != "":
+        settings["aggregate_results"] = True
+
+    input_files = collect_input_files(args.inputs, args.recursive)
+    if len(input_files) == 0:
+        parser.error("no input files found")
+    results = run_batch(input_files, settings, args.min_responses, args.workers)
+    if args.aggregate != "":
+        AggregateStore(aggregate_folder(settings)).export(args.aggregate)
+        print(f"Exported aggregated results to {args.aggregate}")
+    return 0 if len(results) == len(input_files) else 1
@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from typing import Callable, Hashable
+import sys
+import threading
+import numpy as np
+
+
+def entry_size(value) -> int:
+    """
+    Approximate memory of a cached value in bytes.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(entry_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class DetectionCache:
+    """
+    LRU cache of the intermediate detection results of traces (thresholds,
+    threshold-based peaks and model probabilities). Every entry is keyed by
+    the trace (file and column), the detection stage and only the settings
+    that stage depends on, so changing a setting only recomputes the stages
+    that use it. The least recently used entries are evicted once the cache
+    holds more than max_mb.
+
+    Shared by the GUI and the prefetcher, so all access is locked.
+    """
+
+    def __init__(self, max_mb: int = 256) -> None:
+        self.max_bytes = max_mb * 1024 * 1024
+        self.entries: OrderedDict[Hashable, tuple[object, int]] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, compute: Callable[[], object]):
+        """
+        Returns the cached value of key or computes and caches it.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+        # computed without holding the lock, a concurrent computation of the
+        # same key only does the work twice
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key: Hashable, value) -> None:
+        size = entry_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
@@ -1,33 +1,278 @@
 import torch
 import numpy as np
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Hashable
+
+from ..utils.hash import HashIndex, sha256_hash
+
+# loaded models kept in memory, so switching back to them is instant
+MAX_SESSIONS = 3
+# dummy trace of the warm-up, TorchScript optimizes the graph during the
+# first runs of a model
+WARMUP_FRAMES = 1024
+WARMUP_RUNS = 2
 
 
 class torch_model:
+    """
+    Wrapper of a TorchScript model predicting response probabilities.
+
+    Loaded models are kept in an LRU cache keyed by path, hash and whether they
+    are optimized, so switching between models doesn't load them again. Models
+    are warmed up when they are loaded, so the first prediction doesn't pay for
+    the optimization of the graph, and can be preloaded in the background
+    (e.g. when selected in the settings) before switching to them. With
+    optimize, models are frozen and optimized for inference when loaded.
+    """
+
     def __init__(
         self,
+        batch_size: int = 32,
+        num_threads: int = 0,
+        optimize: bool = False,
+        hash_index: HashIndex | None = None,
+        max_sessions: int = MAX_SESSIONS,
     ) -> None:
         self.model = None
+        self.model_path = ""
         self.weights_loaded = False
+        self.preds = np.empty(0, dtype=np.float32)
+        self.batch_size = batch_size
+        self.set_num_threads(num_threads)
+        # per trace probabilities of the current model
+        self.cache: dict[Hashable, np.ndarray] = {}
+        self.cache_generation = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batch_future: Future = None
+        self.optimize = optimize
+        # hashes of the model files (e.g. the index of the model zoo)
+        self.hash_index = hash_index
+        # loaded models by (path, hash, optimize), least recently used first
+        self.sessions: OrderedDict[
+            tuple[str, str, bool], torch.jit.ScriptModule
+        ] = OrderedDict()
+        self.max_sessions = max_sessions
+        self.sessions_lock = threading.Lock()
+        # loads and warms up models in the background
+        self.loader = ThreadPoolExecutor(max_workers=1)
+        self.preloading: dict[str, Future] = {}
 
     def load_weights(self, model_path: str) -> bool:
         if not os.path.exists(model_path):
             return False
-        self.model = torch.jit.load(model_path)
-        self.model.eval()
+        self.model = self.get_session(model_path)
+        self.model_path = model_path
         self.weights_loaded = True
+        self.clear_cache()
         return True
 
+    def set_optimize(self, optimize: bool) -> None:
+        """
+        Switches optimize_for_inference on or off. The current model is loaded
+        again (from the cache if it was used with this setting before).
+        """
+        if optimize == self.optimize:
+            return
+        self.optimize = optimize
+        if self.weights_loaded:
+            self.load_weights(self.model_path)
+
+    def session_key(self, model_path: str) -> tuple[str, str, bool]:
+        if self.hash_index is not None:
+            file_hash = self.hash_index.lookup(model_path)
+            if file_hash is None:
+                file_hash = self.hash_index.hash(model_path)
+                # the model zoo only saves the index when checking for updates
+                self.hash_index.save()
+        else:
+            file_hash = sha256_hash(model_path)
+        return os.path.abspath(model_path), file_hash, self.optimize
+
+    def load_module(
+        self, model_path: str, optimize: bool = False
+    ) -> torch.jit.ScriptModule:
+        model = torch.jit.load(model_path)
+        model.eval()
+        if optimize:
+            try:
+                # freezes the model and fuses operations for inference
+                model = torch.jit.optimize_for_inference(model)
+            except Exception as e:
+                print(f"Could not optimize {model_path}, using it as is: {e}")
+        return model
+
+    def warm_up(self, model: torch.jit.ScriptModule) -> None:
+        """
+        Runs the model on a dummy trace, so the first prediction doesn't wait
+        for the optimization of the graph.
+        """
+        dummy = torch.zeros((1, 1, WARMUP_FRAMES), dtype=torch.float32)
+        try:
+            with torch.inference_mode():
+                for _ in range(WARMUP_RUNS):
+                    model(dummy)
+        except RuntimeError as e:
+            print(f"Could not warm up the model: {e}")
+
+    def add_session(self, key: tuple[str, str, bool], model: torch.jit.ScriptModule):
+        with self.sessions_lock:
+            self.sessions[key] = model
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def cached_session(
+        self, key: tuple[str, str, bool]
+    ) -> torch.jit.ScriptModule | None:
+        with self.sessions_lock:
+            if key not in self.sessions:
+                return None
+            self.sessions.move_to_end(key)
+            return self.sessions[key]
+
+    def load_session(self, model_path: str) -> torch.jit.ScriptModule:
+        """
+        Returns the cached model of model_path or loads and warms it up. Runs
+        on the loader, so a model is only loaded once at a time.
+        """
+        key = self.session_key(model_path)
+        model = self.cached_session(key)
+        if model is None:
+            model = self.load_module(model_path, key[2])
+            self.warm_up(model)
+            self.add_session(key, model)
+        return model
+
+    def get_session(self, model_path: str) -> torch.jit.ScriptModule:
+        """
+        Returns the loaded model of model_path, from the cache if the file is
+        unchanged. Waits for a preload of the model that is in progress,
+        otherwise loads and warms it up before returning it.
+        """
+        preload = self.preloading.get(os.path.abspath(model_path))
+        if preload is not None:
+            try:
+                preload.result()
+            except Exception:
+                # loaded again below, which reports the error
+                pass
+        model = self.cached_session(self.session_key(model_path))
+        if model is None:
+            model = self.loader.submit(self.load_session, model_path).result()
+        return model
+
+    def preload(self, model_path: str) -> Future | None:
+        """
+        Loads and warms up a model in the background without switching to it,
+        so a later load_weights of it is instant.
+        """
+        if not os.path.exists(model_path):
+            return None
+        path = os.path.abspath(model_path)
+        future = self.loader.submit(self.load_session, model_path)
+        self.preloading[path] = future
+
+        def done(future: Future) -> None:
+            # a later preload of the same model may have replaced it
+            if self.preloading.get(path) is future:
+                self.preloading.pop(path, None)
+
+        # called right away if the model was loaded already
+        future.add_done_callback(done)
+        return future
+
+    def set_num_threads(self, num_threads: int) -> None:
+        """
+        Sets the number of threads used for inference. 0 keeps the torch default.
+        """
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+
+    def clear_cache(self) -> None:
+        """
+        Drops all cached probabilities. Batches that are still running won't
+        write their results to the cache anymore.
+        """
+        self.cache = {}
+        self.cache_generation += 1
+
+    def predict_probabilities(self, traces: np.ndarray) -> np.ndarray:
+        """
+        Runs the model on a (traces x length) array at once and returns the
+        probabilities with the same shape.
+        """
+        input_tensor = torch.from_numpy(
+            np.ascontiguousarray(traces, dtype=np.float32)
+        ).unsqueeze(1)
+        with torch.inference_mode():
+            preds = self.model(input_tensor)
+        return preds.reshape(traces.shape[0], -1).numpy()
+
+    def predict_batch(
+        self,
+        traces: np.ndarray,
+        keys: list[Hashable],
+        batch_size: int = 0,
+    ) -> None:
+        """
+        Predicts the probabilities of all traces of a (length x traces) array
+        in chunks of batch_size traces and caches them under the given keys.
+        Stops once the cache is cleared (e.g. the weights changed).
+        """
+        # results only go into the cache the job started with, a cleared cache
+        # is replaced, so late results can't end up in the new one
+        generation, cache = self.cache_generation, self.cache
+        batch_size = batch_size if batch_size > 0 else self.batch_size
+        for start in range(0, len(keys), batch_size):
+            stop = min(start + batch_size, len(keys))
+            if all(key in cache for key in keys[start:stop]):
+                continue
+            preds = self.predict_probabilities(traces[:, start:stop].T)
+            if generation != self.cache_generation:
+                return
+            for key, pred in zip(keys[start:stop], preds):
+                cache[key] = pred
+
+    def predict_batch_async(
+        self,
+        get_traces: Callable[[], np.ndarray],
+        keys: list[Hashable],
+        batch_size: int = 0,
+    ) -> Future:
+        """
+        Runs predict_batch in a background worker. get_traces is called in the
+        worker, so it may block until the traces are available.
+        """
+        self.batch_future = self.executor.submit(
+            lambda: self.predict_batch(get_traces(), keys, batch_size)
+        )
+        return self.batch_future
+
+    def probabilities(self, arr: np.ndarray, key: Hashable = None) -> np.ndarray:
+        """
+        Returns the probabilities of a single trace, either from the cache or by
+        running the model. Doesn't change the state of the model, so it can be
+        called from background workers.
+        """
+        generation, cache = self.cache_generation, self.cache
+        if key is not None and key in cache:
+            return cache[key]
+        # reshape input to (1, 1, length)
+        preds = self.predict_probabilities(arr.reshape(1, -1))[0]
+        if key is not None and generation == self.cache_generation:
+            cache[key] = preds
+        return preds
+
     def predict(
         self,
         arr: np.ndarray,
         threshold: float = 0.5,
+        key: Hashable = None,
     ) -> list[int]:
-        # reshape input to (1, 1, length)
-        input_tensor = torch.reshape(
-            torch.tensor(arr, dtype=torch.float), (1, 1, arr.shape[0])
-        )
-        self.preds = np.array(self.model(input_tensor).detach().flatten())
+        self.preds = self.probabilities(arr, key)
         infered_peaks = list(np.argwhere(self.preds > threshold).flatten())
         return infered_peaks
 
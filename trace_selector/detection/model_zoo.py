@@ -1,6 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
 import os
-import requests
-from ..utils.hash import sha256_hash
+import threading
+from typing import Callable
+from ..utils.hash import HashIndex
+
+GITHUB_API_URL = (
+    "https://api.github.com/repos/s-weissbach/synapse_selector_modelzoo/contents/models"
+)
+MODEL_INFO_URL = "https://raw.githubusercontent.com/s-weissbach/synapse_selector_modelzoo/main/models.json"
+# seconds to wait for GitHub before giving up (e.g. when offline)
+REQUEST_TIMEOUT = 10
+# hashes of the downloaded models, stored in the model zoo folder
+HASH_INDEX_FILENAME = "model_hashes.json"
+# models downloaded in parallel
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# suffix of incomplete downloads, resumed on the next update
+PART_SUFFIX = ".part"
 
 
 class ModelZoo:
@@ -11,49 +28,136 @@ class ModelZoo:
     - models_folder (str): The folder name where models are stored locally.
     - github_repo_url (str): The URL of the GitHub repository containing the models.
     - github_api_url (str): The API URL for accessing the contents of the models folder on GitHub.
+    - model_info_url (str): The URL of the models.json with the hashes of all models.
 
     Methods:
+    - update(): Loads the model information and checks for updates.
+    - update_in_background(callback): Runs update() in a background thread.
     - check_for_updates(): Checks for updates in the GitHub repository and downloads new models.
-    - download_model(url, local_path): Downloads a model from a given URL and saves it locally.
+    - download_model(url, filename, expected_hash): Downloads a model from a given URL and saves it locally.
+
+    The constructor only lists the downloaded models, it neither hashes them
+    nor accesses the network, so it doesn't delay the startup. Hashes of the
+    downloaded models are kept in an index in the model zoo folder, a model is
+    only hashed again when its size or modification time changed.
+
+    Models are downloaded concurrently with a shared session. Every download
+    is streamed into a .part file and hashed on the fly, it replaces the model
+    only once it is complete and matches the hash of models.json. An
+    interrupted download is resumed with an HTTP range request.
 
     Example:
     ```
-    model_zoo = ModelZoo()
-    model_zoo.check_for_updates()
+    model_zoo = ModelZoo(modelzoo_path)
+    model_zoo.update_in_background()
     ```
     """
 
-    def __init__(self, modelzoo_path: str):
+    def __init__(
+        self,
+        modelzoo_path: str,
+        github_api_url: str = GITHUB_API_URL,
+        model_info_url: str = MODEL_INFO_URL,
+    ):
         """
         Initializes a ModelZoo instance.
 
-        Sets default values for models_folder, github_repo_url, and constructs github_api_url.
+        Sets default values for models_folder, github_repo_url, github_api_url and model_info_url.
         """
         self.modelzoo_path = modelzoo_path
         self.github_repo_url = (
             "https://github.com/s-weissbach/synapse_selector_modelzoo.git"
         )
-        self.github_api_url = "https://api.github.com/repos/s-weissbach/synapse_selector_modelzoo/contents/models"
-        # find all downloaded models
+        self.github_api_url = github_api_url
+        self.model_info_url = model_info_url
+        # hashes of the models on GitHub
+        self.model_info = {}
+        # shared by all requests, created on first use
+        self.session = None
+        self.lock = threading.Lock()
+        # find all downloaded models, hashed only when checking for updates
         self.available_models = {}
         os.makedirs(self.modelzoo_path, exist_ok=True)
+        self.hash_index = HashIndex(
+            os.path.join(self.modelzoo_path, HASH_INDEX_FILENAME)
+        )
         for filename in os.listdir(self.modelzoo_path):
             if not filename.endswith(".pt"):
                 continue
             filename_no_ext = filename.split(".pt")[0]
             self.available_models[filename_no_ext] = {
                 "filepath": os.path.join(self.modelzoo_path, filename),
-                "hash": sha256_hash(os.path.join(self.modelzoo_path, filename)),
             }
+
+    def model_hash(self, name: str) -> str:
+        """
+        Returns the hash of a downloaded model, only computed if the model
+        isn't indexed or changed.
+        """
+        return self.hash_index.hash(self.available_models[name]["filepath"])
+
+    def hash_models(self) -> dict[str, str]:
+        """
+        Returns the hashes of all downloaded models. Models that changed are
+        hashed concurrently and the index is saved.
+        """
+        models = self.available_models
+        hashes = self.hash_index.hash_files(
+            [model["filepath"] for model in models.values()]
+        )
+        return {name: hashes[model["filepath"]] for name, model in models.items()}
+
+    def get_session(self):
+        """
+        Returns the requests session, its connection pool fits all parallel
+        downloads.
+        """
+        import requests
+
+        with self.lock:
+            if self.session is None:
+                self.session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=DOWNLOAD_WORKERS)
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+            return self.session
+
+    def update(self) -> None:
+        """
+        Loads the model information and downloads new or changed models.
+        """
         self.load_model_info()
+        self.check_for_updates()
+
+    def update_in_background(
+        self, callback: Callable[[], None] | None = None
+    ) -> threading.Thread:
+        """
+        Runs update() in a daemon thread, so neither the startup nor closing
+        the program waits for the network. callback is called from that thread
+        once the update is done.
+        """
+
+        def run() -> None:
+            self.update()
+            if callback is not None:
+                callback()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
 
     def load_model_info(self):
         """
         Loads model information from the 'model.json' file in the GitHub repository.
         """
+        # requests is only needed once the window is shown
+        import requests
+
         try:
-            model_json_url = "https://raw.githubusercontent.com/s-weissbach/synapse_selector_modelzoo/main/models.json"
-            response = requests.get(model_json_url)
+            response = self.get_session().get(
+                self.model_info_url, timeout=REQUEST_TIMEOUT
+            )
             response.raise_for_status()
             self.model_info = response.json()
         except requests.RequestException as e:
@@ -66,11 +170,17 @@ class ModelZoo:
         Raises:
         - requests.RequestException: If an error occurs during the update check.
         """
+        import requests
+
         try:
-            response = requests.get(self.github_api_url)
+            response = self.get_session().get(
+                self.github_api_url, timeout=REQUEST_TIMEOUT
+            )
             response.raise_for_status()
             github_files = response.json()
+            local_hashes = self.hash_models()
 
+            downloads = []
             for file_info in github_files:
                 filename = file_info["name"]
                 download_url = file_info["download_url"]
@@ -80,45 +190,121 @@ class ModelZoo:
                     # model exists
                     filename_no_ext = filename.split(".pt")[0]
                     if filename_no_ext in self.model_info.keys():
-                        if (
-                            self.model_info[filename_no_ext]
-                            == self.available_models[filename_no_ext]["hash"]
+                        if self.model_info[filename_no_ext] == local_hashes.get(
+                            filename_no_ext
                         ):
                             # weights are unchanged, otherwise reload model
                             continue
                         print(f"Model {filename_no_ext} has new weights.")
                 # in all other cases -> load new model weights
-                self.download_model(download_url, filename)
+                downloads.append(
+                    (
+                        download_url,
+                        filename,
+                        self.model_info.get(filename.split(".pt")[0]),
+                    )
+                )
 
-            print("All models are up-to-date.")
+            if len(downloads) == 0:
+                print("All models are up-to-date.")
+                return
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+                downloaded = list(
+                    pool.map(lambda args: self.download_model(*args), downloads)
+                )
+            failed = len(downloaded) - sum(downloaded)
+            if failed > 0:
+                print(f"{failed} of {len(downloaded)} models could not be downloaded.")
 
         except requests.RequestException as e:
             print(f"Error checking for updates: {e}")
 
-    def download_model(self, url, filename):
+    def download_model(
+        self, url: str, filename: str, expected_hash: str | None = None
+    ) -> bool:
         """
         Downloads a model from the given URL and saves it locally.
 
+        The download is streamed into a .part file and hashed on the fly. A
+        .part file left by an interrupted download is resumed if expected_hash
+        is given, without it the resumed file couldn't be verified and the
+        download starts over. If a resumed file doesn't match expected_hash
+        (e.g. the part was left by other weights), the whole file is
+        downloaded once more. The model is only replaced (atomically) once the
+        download is complete and matches expected_hash (if given). Returns
+        whether the model was downloaded.
+
         Args:
         - url (str): The URL from which to download the model.
-
-        Raises:
-        - requests.RequestException: If an error occurs during the model download.
+        - filename (str): The filename of the model in the model zoo folder.
+        - expected_hash (str): The sha256 hash of the model from models.json.
         """
+        import requests
+
+        local_path = os.path.join(self.modelzoo_path, filename)
+        part_path = local_path + PART_SUFFIX
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            local_path = os.path.join(self.modelzoo_path, filename)
-            with open(local_path, "wb") as file:
-                file.write(response.content)
-            filename_no_ext = filename.split(".pt")[0]
-            self.available_models[filename_no_ext] = {
-                "filepath": os.path.join(self.modelzoo_path, filename),
-                "hash": sha256_hash(local_path),
+            if expected_hash is None and os.path.isfile(part_path):
+                os.remove(part_path)
+            resumed = os.path.isfile(part_path) and os.path.getsize(part_path) > 0
+            file_hash = self.download_part(url, part_path)
+            if resumed and file_hash != expected_hash:
+                os.remove(part_path)
+                file_hash = self.download_part(url, part_path)
+            if expected_hash is not None and file_hash != expected_hash:
+                os.remove(part_path)
+                print(
+                    f"Error downloading model: {filename} doesn't match its hash "
+                    f"({file_hash} instead of {expected_hash})"
+                )
+                return False
+            os.replace(part_path, local_path)
+        except (requests.RequestException, OSError) as e:
+            print(f"Error downloading model: {e}")
+            return False
+        filename_no_ext = filename.split(".pt")[0]
+        self.hash_index.add(local_path, file_hash)
+        self.hash_index.save()
+        with self.lock:
+            # replaced instead of changed, the GUI might iterate over the models
+            self.available_models = {
+                **self.available_models,
+                filename_no_ext: {"filepath": local_path},
             }
-            print(
-                f'Downloaded model: {filename_no_ext} ({self.available_models[filename_no_ext]["hash"]})'
-            )
+        print(f"Downloaded model: {filename_no_ext} ({file_hash})")
+        return True
 
-        except requests.RequestException as e:
-            print(f"Error downloading model: {e}")
+    def download_part(self, url: str, part_path: str) -> str:
+        """
+        Downloads url into part_path, continuing after the bytes that are
+        already there if the server supports range requests. Returns the sha256
+        hash of the complete file.
+        """
+        hasher = sha256()
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+        session = self.get_session()
+        response = session.get(
+            url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT
+        )
+        if response.status_code == 416:
+            # the partial file is not a prefix of the model anymore
+            response.close()
+            offset = 0
+            response = session.get(url, stream=True, timeout=REQUEST_TIMEOUT)
+        with response:
+            response.raise_for_status()
+            if response.status_code != 206 or not response.headers.get(
+                "Content-Range", ""
+            ).startswith(f"bytes {offset}-"):
+                # the server sends the whole file
+                offset = 0
+            if offset > 0:
+                with open(part_path, "rb") as f:
+                    while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+                        hasher.update(chunk)
+            with open(part_path, "ab" if offset > 0 else "wb") as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    f.write(chunk)
+        return hasher.hexdigest()
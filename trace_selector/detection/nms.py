@@ -0,0 +1,90 @@
+import numpy as np
+
+
+def chain_starts(next_start: np.ndarray) -> np.ndarray:
+    """
+    Marks the nodes visited when following next_start from node 0 (next_start
+    maps every node to a later node, len(next_start) ends the chain). Uses
+    pointer doubling, so it takes O(n log n) instead of one step per node.
+    """
+    n = len(next_start)
+    jump = np.append(next_start, n)
+    visited = np.zeros(n + 1, dtype=bool)
+    visited[0] = True
+    # after round k all nodes less than 2^k steps away are visited
+    for _ in range(int(np.ceil(np.log2(n + 1))) + 1):
+        visited[jump[visited]] = True
+        jump = jump[jump]
+    return visited[:n]
+
+
+def non_maximum_suppression(
+    peaks: np.ndarray, intensity: np.ndarray, window_size: int
+) -> np.ndarray:
+    """
+    Keeps only the highest of all peaks that lie within half the window size
+    after the first not yet processed peak (the last one on ties). peaks have
+    to be sorted and unique.
+
+    The groups are chained (every group starts at the first peak after the
+    previous group), they are found with searchsorted and pointer doubling and
+    the maximum per group with reduceat.
+    """
+    peaks = np.asarray(peaks, dtype=np.int64)
+    if len(peaks) == 0:
+        return peaks
+    # first peak after the group starting at every peak
+    next_start = np.searchsorted(peaks, peaks + window_size // 2, side="right")
+    starts = np.flatnonzero(chain_starts(next_start))
+    values = np.asarray(intensity, dtype=np.float64)[peaks]
+    # NaN never replaces the maximum (>= is False)
+    comparable = np.where(np.isnan(values), -np.inf, values)
+    maxima = np.maximum.reduceat(comparable, starts)
+    group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(peaks))))
+    candidates = np.where(comparable == maxima[group], np.arange(len(peaks)), -1)
+    best = np.maximum.reduceat(candidates, starts)
+    # a NaN at the start of a group is never replaced either
+    first_nan = np.isnan(values[starts])
+    best[first_nan] = starts[first_nan]
+    return peaks[best]
+
+
+def stimulation_nms(
+    peaks: np.ndarray,
+    intensity: np.ndarray,
+    stim_frames: list[int],
+    patience: int,
+) -> np.ndarray:
+    """
+    Returns the peaks to remove so that only the highest peak per stimulation
+    window [stim, stim + patience] is kept. Ordered by stimulation, then by the
+    order of peaks. A peak within several windows appears once per window in
+    which it is not the maximum.
+    """
+    peaks = np.asarray(peaks, dtype=np.int64)
+    stims = np.asarray(stim_frames, dtype=np.int64)
+    order = np.argsort(peaks, kind="stable")
+    sorted_peaks = peaks[order]
+    lo = np.searchsorted(sorted_peaks, stims, side="left")
+    hi = np.searchsorted(sorted_peaks, stims + patience, side="right")
+    counts = np.maximum(hi - lo, 0)
+    # (stimulation, peak index) pairs, in the order of stimulations and peaks
+    pair_stim = np.repeat(np.arange(len(stims)), counts)
+    offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_peak = order[np.repeat(lo, counts) + offsets]
+    pairs = np.lexsort((pair_peak, pair_stim))
+    pair_stim, pair_peak = pair_stim[pairs], pair_peak[pairs]
+    if len(pair_peak) == 0:
+        return pair_peak
+    # the first maximum (or the first NaN, as np.argmax) of every window
+    values = np.asarray(intensity, dtype=np.float64)[peaks[pair_peak]]
+    comparable = np.where(np.isnan(values), np.inf, values)
+    starts = np.flatnonzero(np.append(True, pair_stim[1:] != pair_stim[:-1]))
+    maxima = np.maximum.reduceat(comparable, starts)
+    group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(values))))
+    position = np.arange(len(values))
+    first_max = np.minimum.reduceat(
+        np.where(comparable == maxima[group], position, len(values)), starts
+    )
+    remove = (counts[pair_stim] > 1) & (position != first_max[group])
+    return peaks[pair_peak[remove]]
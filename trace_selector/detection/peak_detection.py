@@ -1,29 +1,147 @@
-from scipy.signal import find_peaks
 import numpy as np
 
 
+def local_maxima(
+    x: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the local maxima along axis 0 of a (frames x traces) array with the
+    same rules as scipy.signal.find_peaks: a peak rises from its left neighbour
+    and falls to its right one, plateaus count once at their middle (rounded
+    down) and the first and last frame are never peaks.
+
+    Returns the frame, trace, and left and right plateau edge of every peak,
+    ordered by trace, then frame.
+    """
+    n = x.shape[0]
+    if n < 3:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty
+    rise = np.zeros(x.shape, dtype=bool)
+    fall = np.zeros(x.shape, dtype=bool)
+    equal = np.zeros(x.shape, dtype=bool)
+    # comparisons with NaN are False, as in find_peaks
+    rise[1:] = x[:-1] < x[1:]
+    fall[:-1] = x[1:] < x[:-1]
+    equal[:-1] = x[1:] == x[:-1]
+    # last frame of the plateau starting at every frame
+    ends = np.where(equal, n, np.arange(n)[:, None])
+    ends = np.minimum.accumulate(ends[::-1], axis=0)[::-1]
+    start = rise & (ends <= n - 2)
+    traces, left = np.nonzero(start.T)
+    right = ends[left, traces]
+    is_peak = fall[right, traces]
+    traces, left, right = traces[is_peak], left[is_peak], right[is_peak]
+    return (left + right) // 2, traces, left, right
+
+
+def stimulation_window_starts(n_frames: int, stim_frames: list[int]) -> np.ndarray:
+    """
+    Latest stimulation frame at or before every frame (-1 if there is none).
+    Precomputed once per file, it tells for every frame which stimulation
+    window it could belong to. Stimulation frames below 1 have no window.
+    """
+    starts = np.full(n_frames, -1, dtype=np.int64)
+    stims = np.asarray(stim_frames, dtype=np.int64)
+    stims = stims[(stims >= 1) & (stims < n_frames)]
+    starts[stims] = stims
+    return np.maximum.accumulate(starts)
+
+
+def in_stimulation_window(
+    left: np.ndarray, right: np.ndarray, window_starts: np.ndarray, patience: int
+) -> np.ndarray:
+    """
+    Whether every peak (plateau from left to right) lies completely within
+    [stim, stim + patience - 1] of a stimulation. These are the peaks find_peaks
+    detects on the slice [stim - 1, stim + patience] of the trace.
+    """
+    stim = window_starts[left]
+    return (stim >= 0) & (right <= stim + patience - 1)
+
+
 def peak_detection_scipy(
     intenstiy: np.ndarray,
     threshold: float,
     stim_used: bool,
     stim_frames: list[int],
     patience: int,
-) -> list[int]:
+    prominence: float | None = None,
+    width: float | None = None,
+) -> np.ndarray:
     """
     Peak detection using scipy.
+
+    All local maxima above the threshold are found in a single pass over the
+    trace, with stimulation only those within a stimulation window are kept.
+    prominence and width are passed on to scipy.signal.find_peaks (computed
+    on the whole trace). Returns the sorted peaks.
     """
-    peaks = []
+    if prominence is None and width is None:
+        peaks, _, left, right = local_maxima(intenstiy[:, None])
+    else:
+        # scipy.signal takes about a second to import
+        from scipy.signal import find_peaks
+
+        peaks, properties = find_peaks(
+            intenstiy, prominence=prominence, width=width, plateau_size=1
+        )
+        left, right = properties["left_edges"], properties["right_edges"]
+    keep = intenstiy[peaks] >= threshold
     if stim_used and len(stim_frames) > 0:
-        for frame in stim_frames:
-            tmp_peaks, _ = find_peaks(
-                intenstiy[frame - 1 : frame + patience + 1], height=threshold
+        window_starts = stimulation_window_starts(len(intenstiy), stim_frames)
+        keep &= in_stimulation_window(left, right, window_starts, patience)
+    return peaks[keep]
+
+
+def peak_detection_matrix(
+    traces: np.ndarray,
+    thresholds: np.ndarray,
+    stim_used: bool,
+    stim_frames: list[int],
+    patience: int,
+    prominence: float | None = None,
+    width: float | None = None,
+    block_size: int = 64,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    peak_detection_scipy for all traces of a (frames x ROIs) array with one
+    threshold per ROI. Returns the ROI and the frame of every peak, ordered by
+    ROI, then frame. ROIs are processed in blocks to bound the memory.
+    """
+    n_frames, n_rois = traces.shape
+    thresholds = np.broadcast_to(np.asarray(thresholds, dtype=np.float64), n_rois)
+    window_starts = stimulation_window_starts(n_frames, stim_frames)
+    use_windows = stim_used and len(stim_frames) > 0
+    rois, frames = [], []
+    for first in range(0, n_rois, block_size):
+        block = traces[:, first : first + block_size]
+        if prominence is None and width is None:
+            peaks, block_rois, left, right = local_maxima(block)
+        else:
+            from scipy.signal import find_peaks
+
+            results = [
+                find_peaks(
+                    block[:, i], prominence=prominence, width=width, plateau_size=1
+                )
+                for i in range(block.shape[1])
+            ]
+            peaks = np.concatenate([p for p, _ in results] + [np.empty(0, np.int64)])
+            block_rois = np.repeat(
+                np.arange(block.shape[1]), [len(p) for p, _ in results]
             )
-            peaks += [peak + frame - 1 for peak in tmp_peaks]
-    else:
-        tmp_peaks, _ = find_peaks(intenstiy, height=threshold)
-        peaks += list(tmp_peaks)
-    # specifically for stimulation used it might happen that peaks are detected
-    # twice, when the patience window is higher than the time between two
-    # consecutive pulses
-    peaks = sorted(list(set(peaks)))
-    return peaks
+            left = np.concatenate(
+                [r["left_edges"] for _, r in results] + [np.empty(0, np.int64)]
+            )
+            right = np.concatenate(
+                [r["right_edges"] for _, r in results] + [np.empty(0, np.int64)]
+            )
+        keep = block[peaks, block_rois] >= thresholds[first + block_rois]
+        if use_windows:
+            keep &= in_stimulation_window(left, right, window_starts, patience)
+        rois.append(first + block_rois[keep])
+        frames.append(peaks[keep])
+    if len(rois) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rois), np.concatenate(frames)
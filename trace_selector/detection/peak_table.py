@@ -0,0 +1,39 @@
+import numpy as np
+
+
+class PeakTable:
+    """
+    Peak candidates of all ROIs of a file as a ragged CSR-style table: the
+    frames of all peaks in one array, ordered by ROI, and the offsets where the
+    peaks of every ROI start (the peaks of ROI i are
+    frames[offsets[i]:offsets[i + 1]]).
+    """
+
+    def __init__(self, offsets: np.ndarray, frames: np.ndarray) -> None:
+        self.offsets = offsets
+        self.frames = frames
+
+    @classmethod
+    def from_pairs(cls, rois: np.ndarray, frames: np.ndarray, n_rois: int):
+        """
+        Builds the table from the ROI and frame of every peak, ordered by ROI.
+        """
+        counts = np.bincount(rois, minlength=n_rois)
+        offsets = np.zeros(n_rois + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(offsets, np.asarray(frames, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def counts(self) -> np.ndarray:
+        """
+        Number of peaks of every ROI.
+        """
+        return np.diff(self.offsets)
+
+    def peaks(self, roi: int) -> np.ndarray:
+        """
+        The sorted peaks of a ROI (a view into the table).
+        """
+        return self.frames[self.offsets[roi] : self.offsets[roi + 1]]
@@ -0,0 +1,225 @@
+from typing import Hashable
+import numpy as np
+
+from ..utils.threshold import compute_threshold, compute_thresholds
+from .peak_detection import peak_detection_scipy, peak_detection_matrix
+from .peak_table import PeakTable
+from .nms import non_maximum_suppression
+from .detection_cache import DetectionCache
+
+# settings every detection stage depends on (they change the normalized trace)
+NORMALIZATION_SETTINGS = [
+    "normalization_use_median",
+    "normalization_sliding_window_size",
+]
+THRESHOLD_SETTINGS = NORMALIZATION_SETTINGS + [
+    "normalized_trace",
+    "stim_used",
+    "threshold_mult",
+    "threshold_start",
+    "threshold_stop",
+]
+PEAK_SETTINGS = THRESHOLD_SETTINGS + ["stim_frames_patience"]
+PREDICTION_SETTINGS = NORMALIZATION_SETTINGS + [
+    "model_path",
+    "ml_optimize_for_inference",
+]
+
+
+def stimulation_frames(settings: dict, length: int) -> list[int]:
+    """
+    Returns the stimulation frames used for the analysis. These are either the
+    manually entered frames or are inferred from start and step size.
+    """
+    if not settings["stim_used"]:
+        return parse_stimulation_frames(settings["stim_frames"])
+    if settings["use_manual_stim_frames"] and settings["stim_frames"] != "":
+        return parse_stimulation_frames(settings["stim_frames"])
+    step_size = settings["stim_frames_step"]
+    stimulation_start = settings["stim_frames_start"]
+    num_steps = length // step_size
+    return [
+        step * step_size + stimulation_start
+        for step in range(num_steps)
+        if step * step_size + 2 * stimulation_start <= length
+    ]
+
+
+def parse_stimulation_frames(stim_frames: str) -> list[int]:
+    """
+    Parses a comma separated list of stimulation frames.
+    """
+    if len(stim_frames) == 0:
+        return []
+    return sorted([int(frame) for frame in stim_frames.split(",")])
+
+
+def stage_key(
+    trace_key: Hashable, stage: str, settings: dict, setting_keys: list[str], *extra
+) -> tuple:
+    """
+    Cache key of a detection stage of a trace.
+    """
+    return (trace_key, stage, tuple(settings[k] for k in setting_keys), *extra)
+
+
+def detect_responses(
+    intensity: np.ndarray,
+    norm_intensity: np.ndarray,
+    settings: dict,
+    stim_frames: list[int],
+    model=None,
+    model_key=None,
+    cache: DetectionCache | None = None,
+    trace_key: Hashable = None,
+) -> tuple[float, list[int], np.ndarray]:
+    """
+    Runs threshold and/or ML-based detection on a single trace.
+
+    The threshold is computed on the trace that is displayed (normalized or
+    not), detection always runs on the normalized trace.
+
+    Returns the threshold, the sorted detected peaks and the ML-based
+    probabilities (empty if ML-based detection is not activated). Cached
+    probabilities of the model are looked up by model_key.
+
+    With a cache, the threshold, the threshold-based peaks and the
+    probabilities of the trace identified by trace_key are computed only once
+    per relevant settings, e.g. moving the probability slider only reruns the
+    cheap combination of the results.
+    """
+
+    def cached(stage: str, setting_keys: list[str], compute, *extra):
+        if cache is None or trace_key is None:
+            return compute()
+        return cache.get(
+            stage_key(trace_key, stage, settings, setting_keys, *extra), compute
+        )
+
+    trace = norm_intensity if settings["normalized_trace"] else intensity
+    threshold = cached(
+        "threshold",
+        THRESHOLD_SETTINGS,
+        lambda: compute_threshold(
+            settings["stim_used"],
+            trace,
+            settings["threshold_mult"],
+            settings["threshold_start"],
+            settings["threshold_stop"],
+        ),
+    )
+
+    peaks = []
+    if settings["th_detection"]:
+        peaks = cached(
+            "peaks",
+            PEAK_SETTINGS,
+            lambda: peak_detection_scipy(
+                norm_intensity,
+                threshold,
+                settings["stim_used"],
+                stim_frames,
+                settings["stim_frames_patience"],
+            ),
+            tuple(stim_frames),
+        )
+
+    preds = np.empty(0, dtype=np.float64)
+    if settings["ml_detection"] and model is not None:
+        if not model.weights_loaded:
+            model.load_weights(settings["model_path"])
+        preds = cached(
+            "probabilities",
+            PREDICTION_SETTINGS,
+            lambda: model.probabilities(norm_intensity, model_key),
+        )
+    return threshold, combine_peaks(peaks, preds, norm_intensity, settings), preds
+
+
+def combine_peaks(
+    th_peaks: np.ndarray,
+    preds: np.ndarray,
+    norm_intensity: np.ndarray,
+    settings: dict,
+) -> list[int]:
+    """
+    Combines the threshold-based peaks and the frames where the ML-based
+    probability exceeds the slider and applies non-maximum suppression.
+    Returns the sorted peaks.
+    """
+    peaks = list(th_peaks)
+    peaks += list(np.argwhere(preds > settings["threshold_slider_ml"] / 100).flatten())
+
+    unique_peaks = sorted(set(peaks))
+
+    if settings["nms"]:
+        unique_peaks = list(
+            non_maximum_suppression(
+                np.asarray(unique_peaks, dtype=np.int64),
+                norm_intensity,
+                settings["nms_window"],
+            )
+        )
+    return unique_peaks
+
+
+def detect_file(
+    traces: np.ndarray,
+    norm_traces: np.ndarray,
+    settings: dict,
+    stim_frames: list[int],
+) -> tuple[np.ndarray, PeakTable]:
+    """
+    Threshold-based detection of all ROIs of a file at once, on (frames x ROIs)
+    arrays. Returns the threshold of every ROI and the threshold-based peak
+    candidates of all ROIs, exactly as detect_responses computes them per
+    trace.
+    """
+    thresholds = compute_thresholds(
+        settings["stim_used"],
+        norm_traces if settings["normalized_trace"] else traces,
+        settings["threshold_mult"],
+        settings["threshold_start"],
+        settings["threshold_stop"],
+    )
+    rois, frames = peak_detection_matrix(
+        norm_traces,
+        thresholds,
+        settings["stim_used"],
+        stim_frames,
+        settings["stim_frames_patience"],
+    )
+    return thresholds, PeakTable.from_pairs(rois, frames, traces.shape[1])
+
+
+def precompute_detection(
+    cache: DetectionCache,
+    file_id: Hashable,
+    columns: list[str],
+    traces: np.ndarray,
+    norm_traces: np.ndarray,
+    settings: dict,
+    stim_frames: list[int],
+) -> None:
+    """
+    Runs detect_file and stores the threshold and peaks of every column in the
+    cache, so detect_responses of all traces of the file only combines them.
+    """
+    thresholds, table = detect_file(traces, norm_traces, settings, stim_frames)
+    for i, column in enumerate(columns):
+        cache.put(
+            stage_key((file_id, column), "threshold", settings, THRESHOLD_SETTINGS),
+            thresholds[i],
+        )
+        if settings["th_detection"]:
+            # copied, so evicted entries don't keep the whole table alive
+            cache.put(
+                stage_key(
+                    (file_id, column),
+                    "peaks",
+                    settings,
+                    PEAK_SETTINGS,
+                    tuple(stim_frames),
+                ),
+                table.peaks(i).copy(),
+            )
@@ -7,6 +7,7 @@ class API():
         Created by Andreas
         The API allows to communicate with Trace Selector via stdin. Currently, there is only one command build in
         - open\t[path]
+        Files opened while another file is open are queued and opened once the current file is saved.
         Please note: Seperate the arguments via tabular space, not a regular space!
     """
     def __init__(self, guiObj):
@@ -19,7 +20,7 @@ class API():
         self.thread.start()
 
     def OnOpenFile(self, path):
-        self.gui.open_file(path)
+        self.gui.queue_file(path)
 
 class WorkerStdin(QObject):
 
@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+import threading
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from ..utils.file_cache import FileCache
+from ..utils.trace_data import load_file
+from ..utils.trace_store import TraceStore
+
+
+class LoadingCancelled(Exception):
+    pass
+
+
+class LoadJob:
+    """
+    A file that is being parsed in the background.
+    """
+
+    def __init__(self, filepath: str, key: tuple) -> None:
+        self.filepath = filepath
+        self.key = key
+        self.cancel_event = threading.Event()
+        self.future: Future = None
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self) -> tuple[TraceStore, str | None]:
+        return self.future.result()
+
+
+class FileLoader(QObject):
+    """
+    Parses input files in a background thread, one after another in the order
+    they were requested. A file that was loaded ahead of time (e.g. the next
+    file of the queue) is handed out right away.
+
+    progress and loaded are emitted from the worker thread, connected slots of
+    widgets run on the GUI thread.
+    """
+
+    progress = pyqtSignal(str, int)
+    loaded = pyqtSignal(str)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.jobs: dict[str, LoadJob] = {}
+
+    def load(
+        self,
+        filepath: str,
+        filename: str,
+        meta_columns: list[str],
+        file_cache: FileCache | None = None,
+        compute_hash: bool = False,
+    ) -> LoadJob:
+        """
+        Starts loading a file, unless it is already loaded or loading with
+        the same settings.
+        """
+        key = (
+            tuple(meta_columns),
+            file_cache.folder if file_cache is not None else None,
+            compute_hash,
+        )
+        job = self.jobs.get(filepath)
+        if job is not None and job.key == key:
+            return job
+        self.cancel(filepath)
+        job = LoadJob(filepath, key)
+
+        def progress(percent: int) -> None:
+            if job.cancel_event.is_set():
+                raise LoadingCancelled()
+            self.progress.emit(filepath, percent)
+
+        def run() -> tuple[TraceStore, str | None]:
+            try:
+                progress(0)
+                return load_file(
+                    filepath,
+                    filename,
+                    meta_columns,
+                    file_cache,
+                    progress,
+                    compute_hash,
+                )
+            finally:
+                if not job.cancel_event.is_set():
+                    self.loaded.emit(filepath)
+
+        job.future = self.executor.submit(run)
+        self.jobs[filepath] = job
+        return job
+
+    def take(self, filepath: str) -> tuple[TraceStore, str | None]:
+        """
+        Returns the loaded file and forgets it. Raises the error of the loading,
+        if there was one.
+        """
+        job = self.jobs.pop(filepath)
+        return job.result()
+
+    def cancel(self, filepath: str) -> None:
+        """
+        Stops loading a file. Excel files can't be interrupted, their result
+        is dropped once they are read.
+        """
+        job = self.jobs.pop(filepath, None)
+        if job is None:
+            return
+        job.cancel_event.set()
+        job.future.cancel()
+
+    def cancel_all_except(self, filepaths: list[str]) -> None:
+        for filepath in list(self.jobs):
+            if filepath not in filepaths:
+                self.cancel(filepath)
@@ -10,18 +10,29 @@ from PyQt6.QtWidgets import (
     QSlider,
     QMessageBox,
     QStackedLayout,
+    QProgressBar,
+    QPushButton,
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, pyqtSignal
 from PyQt6.QtGui import QAction, QIcon, QKeySequence, QFont
-from PyQt6 import QtWebEngineWidgets
 
 from .settingswindow import SettingsWindow
 from .add_window import AddWindow
 from .api import API
+from .prefetch import TracePrefetcher
+from .file_loader import FileLoader, LoadingCancelled
+from .qt_plot_view import QtPlotView, pyqtgraph_available
 from ..utils.trace_data import SynapseResponseData
-from ..utils.threshold import compute_threshold
-from ..utils.plot import trace_plot
-from ..detection.peak_detection import peak_detection_scipy
+from ..utils.file_cache import file_cache_from_settings
+from ..utils.output_writer import OutputWriter
+from ..detection.detection_cache import DetectionCache
+from ..utils.journal import SessionJournal
+from ..utils.plot import build_trace_plot
+from ..detection.response_detection import (
+    detect_responses,
+    parse_stimulation_frames,
+    stimulation_frames,
+)
 
 import os
 from typing import Union
@@ -33,6 +44,11 @@ asset_path = os.path.join(parent_directory, "assets")
 
 
 class MainWindow(QMainWindow):
+    # filename and error message ("" on success) of a finished save
+    save_finished = pyqtSignal(str, str)
+    # the model zoo finished checking for updates in the background
+    models_updated = pyqtSignal()
+
     def __init__(self, settings):
         super(MainWindow, self).__init__()
         # --- settings ---
@@ -40,23 +56,38 @@ class MainWindow(QMainWindow):
 
         # --- variables ---
         self.directory = None
+        self.filepath = ""
         self.synapse_response = SynapseResponseData()
+        self._model = None
+        # file and settings the cached probabilities of the model belong to
+        self.prediction_state = None
+        self.preds = []
+        # detection results of visited and prefetched traces
+        self.detection_cache = DetectionCache(self.get_setting("detection_cache_mb"))
+        self.prefetcher = TracePrefetcher(
+            self.get_setting("prefetch_traces"), self.detection_cache
+        )
+        self.file_loader = FileLoader()
+        self.file_loader.progress.connect(self.show_loading_progress)
+        self.file_loader.loaded.connect(self.file_loaded)
+        # file that is being loaded to be shown next
+        self.loading_filepath = None
+        # files opened via the API while another file was open
+        self.file_queue = []
+        self.output_writer = OutputWriter()
+        self.save_finished.connect(self.show_save_result)
 
         # load weights for CNN
         if self.is_ml_detection_activated():
             success = self.model.load_weights(str(self.get_setting("model_path")))
             if not success:
-                self.settings.configuration["th_detection"] = True
-                self.settings.configuration["ml_detection"] = False
-        stim_frames = self.get_setting("stim_frames")
-        self.stim_frames = (
-            sorted([int(frame) for frame in stim_frames.split(",")])
-            if len(stim_frames) > 0
-            else []
-        )
+                self.settings.config["th_detection"] = True
+                self.settings.config["ml_detection"] = False
+        self.stim_frames = parse_stimulation_frames(self.get_setting("stim_frames"))
 
         # --- function calls ---
         self.setup_gui()
+        self.models_updated.connect(self.settings_window.update_models)
         self.showMaximized()
 
         self.api = API(self)
@@ -68,7 +99,29 @@ class MainWindow(QMainWindow):
         # Introduced by Andreas to lazy load torch, as it contributes around 50 % to loading time
         if self._model is None:
             from ..detection.model_wraper import torch_model
-            self._model = torch_model()
+            self._model = torch_model(
+                self.get_setting("ml_batch_size"),
+                self.get_setting("ml_num_threads"),
+                self.get_setting("ml_optimize_for_inference"),
+                self.settings.modelzoo.hash_index,
+            )
+        return self._model
+
+    def preload_model(self, model_path: str) -> None:
+        """
+        Loads a model selected in the settings in the background, so applying
+        the settings doesn't wait for it. Skipped as long as torch isn't loaded.
+        """
+        if self._model is not None:
+            self._model.preload(model_path)
+
+    def update_model_settings(self) -> None:
+        """
+        Applies optimize_for_inference to a loaded model, so the next
+        prediction doesn't use the model built with the previous setting.
+        """
+        if self._model is not None:
+            self._model.set_optimize(self.get_setting("ml_optimize_for_inference"))
 
     # --- gui ---
 
@@ -81,6 +134,15 @@ class MainWindow(QMainWindow):
 
         # status bar
         self.setStatusBar(QStatusBar(self))
+        self.loading_progress = QProgressBar()
+        self.loading_progress.setRange(0, 100)
+        self.loading_progress.setMaximumWidth(200)
+        self.statusBar().addPermanentWidget(self.loading_progress)
+        self.button_cancel_loading = QPushButton("Cancel")
+        self.button_cancel_loading.clicked.connect(self.cancel_loading)
+        self.statusBar().addPermanentWidget(self.button_cancel_loading)
+        self.loading_progress.hide()
+        self.button_cancel_loading.hide()
 
         # main 'tab'
         main_wrapper_widget = QWidget()
@@ -213,9 +275,8 @@ class MainWindow(QMainWindow):
         self.bar_layout_widget_wrapper.setLayout(bar_layout)
         self.main_layout.addWidget(self.bar_layout_widget_wrapper)
 
-        # plot
-        self.trace_plot = QtWebEngineWidgets.QWebEngineView(self)
-        self.trace_plot.hide()
+        # plot, created once a file is opened (loading QtWebEngine takes a while)
+        self.trace_plot = None
 
         # detection slider
         self.threshold_label = QLabel("Current Prediction Threshold (ML-based):")
@@ -292,8 +353,7 @@ class MainWindow(QMainWindow):
             self.tr_plot.add_annotation(peak)
 
         if changed:
-            self.tr_plot.reload_plot()
-            self.trace_plot.setHtml(self.tr_plot.fig.to_html(include_plotlyjs="cdn"))
+            self.trace_plot.update_layout(self.tr_plot)
 
     def back(self):
         """
@@ -404,41 +464,139 @@ class MainWindow(QMainWindow):
         resulting output dataframes and response columns.
         All responses columns will be plotted.
         """
+        filepath = path
         # no directory has been saved
-        if path is None:
-            if not hasattr(self, "filepath") or self.filepath == "":
+        if filepath is None:
+            filepath = self.filepath
+            if filepath == "" and len(self.file_queue) > 0:
+                filepath = self.file_queue.pop(0)
+            if filepath == "":
                 if self.directory is not None:
-                    self.filepath = QFileDialog.getOpenFileName(
+                    filepath = QFileDialog.getOpenFileName(
                         caption="Select Input File",
                         directory=self.directory,
                         filter="Table(*.txt *.csv *.xlsx *.xls)",
                     )[0]
                 else:
-                    self.filepath = QFileDialog.getOpenFileName(
+                    filepath = QFileDialog.getOpenFileName(
                         caption="Select Input File",
                         filter="Table(*.txt *.csv *.xlsx *.xls)",
                     )[0]
 
-            if self.filepath == "":
+            if filepath == "":
                 warning = QMessageBox(self)
                 warning.setWindowTitle("Warning")
                 warning.setText("No file has been selected")
                 warning.exec()
                 return
-        else:
-            self.filepath = path
 
+        # the file is parsed in the background, file_loaded shows it
+        if self.loading_filepath is not None and self.loading_filepath != filepath:
+            self.file_loader.cancel(self.loading_filepath)
+        self.loading_filepath = filepath
+        self.loading_progress.setValue(0)
+        self.loading_progress.show()
+        self.button_cancel_loading.show()
+        self.statusBar().showMessage(f"Loading {os.path.basename(filepath)}")
+        job = self.file_loader.load(
+            filepath,
+            os.path.basename(filepath),
+            self.get_setting("meta_columns"),
+            file_cache_from_settings(self.settings.config),
+            self.needs_file_hash(),
+        )
+        if job.done():
+            # preloaded, its loaded signal has already been handled
+            self.file_loaded(filepath)
+
+    def queue_file(self, path: str) -> None:
+        """
+        Opens a file requested via the API. If a file is open or loading, the
+        file is queued instead and opened once the current file is saved.
+        """
+        if self.filepath != "" or self.loading_filepath is not None:
+            self.file_queue.append(path)
+            self.preload_next_file()
+            return
+        self.open_file(path)
+
+    def preload_next_file(self) -> None:
+        """
+        Parses the next queued file in the background, so it is ready once
+        the current file is saved.
+        """
+        keep = [self.loading_filepath] + self.file_queue[:1]
+        self.file_loader.cancel_all_except(keep)
+        for filepath in self.file_queue[:1]:
+            self.file_loader.load(
+                filepath,
+                os.path.basename(filepath),
+                self.get_setting("meta_columns"),
+                file_cache_from_settings(self.settings.config),
+                self.needs_file_hash(),
+            )
+
+    def needs_file_hash(self) -> bool:
+        """
+        The journal and the aggregated results identify files by their hash.
+        """
+        return self.get_setting("journal_enabled") or self.get_setting(
+            "aggregate_results"
+        )
+
+    def show_loading_progress(self, filepath: str, percent: int) -> None:
+        if filepath != self.loading_filepath:
+            return
+        self.loading_progress.setValue(percent)
+
+    def hide_loading_progress(self) -> None:
+        self.loading_progress.hide()
+        self.button_cancel_loading.hide()
+        self.statusBar().clearMessage()
+
+    def cancel_loading(self) -> None:
+        if self.loading_filepath is None:
+            return
+        self.file_loader.cancel(self.loading_filepath)
+        self.loading_filepath = None
+        self.hide_loading_progress()
+        self.statusBar().showMessage("Loading cancelled", 5000)
+
+    def file_loaded(self, filepath: str) -> None:
+        """
+        Shows a file once the background worker parsed it.
+        """
+        if filepath != self.loading_filepath:
+            # preloaded file or a cancelled one
+            return
+        self.loading_filepath = None
+        self.hide_loading_progress()
+        try:
+            store, file_hash = self.file_loader.take(filepath)
+        except LoadingCancelled:
+            return
+        except Exception as e:
+            warning = QMessageBox(self)
+            warning.setWindowTitle("Warning")
+            warning.setText(f"Could not open {os.path.basename(filepath)}: {e}")
+            warning.exec()
+            return
+
+        self.filepath = filepath
         self.filename = os.path.basename(self.filepath)
         self.directory = os.path.dirname(self.filepath)
         self.update_file_path_label(self.filepath)
 
-        self.synapse_response.open_file(
-            self.filepath,
+        self.synapse_response.set_file(
             self.filename,
-            self.get_setting("meta_columns"),
+            store,
+            file_hash,
             self.get_setting("normalization_use_median"),
             self.get_setting("normalization_sliding_window_size"),
         )
+        # traces prepared for the previous file (or an earlier load of it)
+        self.prefetcher.invalidate()
+        complete = self.start_journal(file_hash)
         self.labels = []
 
         self.switch_to_main_layout()
@@ -446,6 +604,48 @@ class MainWindow(QMainWindow):
         self.current_roi_label.setText(
             f"Current ROI: {self.synapse_response.columns[self.synapse_response.idx]}"
         )
+        self.preload_next_file()
+        if complete:
+            # all traces were decided before, only the save is missing
+            self.next()
+
+    def start_journal(self, file_hash: str | None) -> bool:
+        """
+        Records the decisions on the opened file. If an earlier session on the
+        same file was interrupted, the user can resume it. Returns True if all
+        traces of the resumed file were decided already.
+        """
+        if not self.get_setting("journal_enabled") or file_hash is None:
+            return False
+        journal = SessionJournal(file_hash)
+        complete = False
+        try:
+            records = journal.records() if journal.exists() else []
+            columns = self.synapse_response.columns
+            if len(records) > 1 and records[0].get("columns") == columns:
+                response = QMessageBox.question(
+                    self,
+                    "Resume",
+                    f"{self.filename} was not finished in an earlier session "
+                    f"({len(records) - 1} decisions). Do you want to resume "
+                    "where you left off?",
+                )
+                if response == QMessageBox.StandardButton.Yes:
+                    complete = self.synapse_response.replay(
+                        records,
+                        self.get_setting("normalization_use_median"),
+                        self.get_setting("normalization_sliding_window_size"),
+                    )
+                    journal.resume()
+                else:
+                    journal.start(self.filename, columns)
+            else:
+                journal.start(self.filename, columns)
+        except OSError as e:
+            print(f"Could not open the journal of {self.filename}: {e}")
+            return complete
+        self.synapse_response.journal = journal
+        return complete
 
     def add_slider(self):
         if self.is_ml_detection_activated():
@@ -465,10 +665,40 @@ class MainWindow(QMainWindow):
         except Exception as e:
             None
 
+    def create_plot_view(self) -> QWidget:
+        """
+        Creates the plot widget of the configured backend. Falls back to plotly
+        if pyqtgraph is not installed.
+        """
+        if self.get_setting("plot_backend") == "pyqtgraph" and pyqtgraph_available():
+            return QtPlotView(self)
+        from .plot_view import PlotView
+
+        return PlotView(self)
+
+    def update_plot_backend(self) -> None:
+        """
+        Swaps the plot widget if the plotting backend was changed.
+        """
+        use_pyqtgraph = (
+            self.get_setting("plot_backend") == "pyqtgraph" and pyqtgraph_available()
+        )
+        if self.trace_plot is None or use_pyqtgraph == isinstance(
+            self.trace_plot, QtPlotView
+        ):
+            return
+        new_plot = self.create_plot_view()
+        new_plot.setVisible(self.trace_plot.isVisible())
+        self.main_layout.replaceWidget(self.trace_plot, new_plot)
+        self.trace_plot.deleteLater()
+        self.trace_plot = new_plot
+
     def switch_to_main_layout(self):
         self.main_layout.removeWidget(self.startup_label)
         self.startup_label.hide()
 
+        if self.trace_plot is None:
+            self.trace_plot = self.create_plot_view()
         self.trace_plot.show()
         self.main_layout.addWidget(self.trace_plot)
 
@@ -478,8 +708,9 @@ class MainWindow(QMainWindow):
         self.set_add_button_functionality()
 
     def switch_to_start_layout(self):
-        self.main_layout.removeWidget(self.trace_plot)
-        self.trace_plot.hide()
+        if self.trace_plot is not None:
+            self.main_layout.removeWidget(self.trace_plot)
+            self.trace_plot.hide()
 
         self.remove_slider()
 
@@ -503,68 +734,54 @@ class MainWindow(QMainWindow):
             else self.synapse_response.intensity
         )
 
-        self.threshold = compute_threshold(
-            self.get_setting("stim_used"),
-            trace,
-            self.get_setting("threshold_mult"),
-            self.get_setting("threshold_start"),
-            self.get_setting("threshold_stop"),
+        self.stim_frames = stimulation_frames(
+            self.settings.config, len(self.synapse_response.time)
         )
-
-        self.peak_detection()
-        self.add_window.update_information(
-            self.model.preds if self.is_ml_detection_activated() else [],
-            trace,
+        if self.is_ml_detection_activated():
+            self.start_batch_prediction()
+        model = self.model if self.is_ml_detection_activated() else None
+        prefetch_state = self.prefetcher.make_state(
+            self.synapse_response.file_id, self.settings.config
         )
-        self.initialize_add_window(self.synapse_response.peaks, new_sample=new_sample)
 
-        # create plot depending on mode
-        self.tr_plot = trace_plot(
-            time=self.synapse_response.time,
-            intensity=trace,
-            threshold=self.threshold,
-            threshold_detection_activated=self.is_th_detection_activated(),
-            probabilities=self.model.preds if self.is_ml_detection_activated() else [],
-            always_show_threshold=self.get_setting("always_show_threshold"),
-        )
-        self.tr_plot.create_plot()
-
-        # add responses
-        if self.settings.config["select_responses"]:
-            self.stim_frames = self.settings_window.stimframes
-            if self.settings.config["stim_used"]:
-                if (
-                    self.settings.config["use_manual_stim_frames"]
-                    and self.get_setting("stim_frames") != ""
-                ):
-                    self.tr_plot.add_stimulation_window(
-                        self.stim_frames, self.settings.config["stim_frames_patience"]
-                    )
-                else:
-                    self.tr_plot.add_stimulation_window(
-                        [],
-                        self.settings.config["stim_frames_patience"],
-                        self.get_setting("stim_frames_start"),
-                        self.get_setting("stim_frames_step"),
-                    )
-                    length = len(self.synapse_response.time)
-                    num_steps = length // self.get_setting("stim_frames_step")
-                    # if automaticly detected stim frames - update stim frames
-                    # for later analysis
-                    step_size = self.get_setting("stim_frames_step")
-                    stimulation_start = self.get_setting("stim_frames_start")
-                    self.stim_frames = [
-                        step * step_size + stimulation_start
-                        for step in range(num_steps)
-                        if step * step_size + 2 * stimulation_start <= length
-                    ]
-
-        self.labels = self.tr_plot.add_peaks(
-            self.add_window.get_peak_dict(), self.settings.config["nms"]
-        )
+        # use the prepared trace of the prefetcher if possible
+        prepared = None
+        if new_sample:
+            prepared = self.prefetcher.get(self.synapse_response.idx, prefetch_state)
+        if prepared is None:
+            self.peak_detection()
+        else:
+            self.threshold = prepared.threshold
+            self.preds = prepared.preds
+            self.synapse_response.add_automatic_peaks(prepared.peaks)
+        self.add_window.update_information(self.preds, trace)
+        self.initialize_add_window(self.synapse_response.peaks, new_sample=new_sample)
 
         # set plot
-        self.trace_plot.setHtml(self.tr_plot.fig.to_html(include_plotlyjs="cdn"))
+        if prepared is None:
+            self.tr_plot, self.labels = build_trace_plot(
+                self.synapse_response.time,
+                trace,
+                self.threshold,
+                self.preds,
+                self.add_window.get_peak_dict(),
+                self.settings.config,
+                self.stim_frames,
+            )
+            self.trace_plot.show_plot(self.tr_plot, keep_view=not new_sample)
+        else:
+            self.tr_plot = prepared.tr_plot
+            self.labels = prepared.labels
+            self.trace_plot.show_plot(self.tr_plot)
+
+        # prepare the next traces while the user judges this one
+        self.prefetcher.prefetch(
+            self.synapse_response,
+            prefetch_state,
+            self.settings.config,
+            self.stim_frames,
+            model,
+        )
         self.current_state_indicator.setText(self.synapse_response.return_state())
 
         if not self.is_ml_detection_activated():
@@ -611,7 +828,7 @@ class MainWindow(QMainWindow):
                 "You reached the end of the file. Your data will be saved at the set output path"
             )
             msg.exec()
-            self.synapse_response.save(self.stim_frames, self.settings.config, self)
+            self.save_file()
             # self.clear_selection_buttons()
             self.reset()
             self.open_file()
@@ -629,69 +846,112 @@ class MainWindow(QMainWindow):
         # = QLabel("Current ROI:")
         # self.clear_selection_buttons()
 
-    def peak_detection(self):
+    def save_file(self) -> None:
         """
-        Runs peak detection and hands peaks to synapse_response data class.
+        Saves the current file in the background, the result is shown in the
+        status bar.
         """
-        peaks = []
-        if self.is_th_detection_activated():
-            peaks += peak_detection_scipy(
-                self.synapse_response.norm_intensity,
-                self.threshold,
-                self.settings.config["stim_used"],
-                self.stim_frames,
-                self.settings.config["stim_frames_patience"],
-            )
-
-        if self.is_ml_detection_activated():
-            if not self.model.weights_loaded:
-                self.model.load_weights(self.settings.config["model_path"])
-            peaks += self.model.predict(
-                self.synapse_response.norm_intensity,
-                self.settings.config["threshold_slider_ml"] / 100,
-            )
-
-        unique_peaks = list(set(peaks))
-        unique_peaks.sort()
-
-        # nms
-        if self.get_setting("nms"):
-            result_arr = []
-            processed_peaks = []
-            window_size = self.get_setting("nms_window")
-
-            # iterate over all peaks
-            for idx, peak in enumerate(unique_peaks):
-                if peak in processed_peaks:
-                    continue
-                # get all peaks within the nms window
-                # as we are starting from the front we only have to look half the window size towards the front
-                tmp_arr = []
-                for inner_idx in range(idx, len(unique_peaks)):
-                    if unique_peaks[inner_idx] <= peak + (window_size // 2):
-                        tmp_arr.append(unique_peaks[inner_idx])
+        filename = self.synapse_response.filename
+        journal = self.synapse_response.journal
+        if journal is not None:
+            journal.close()
+        future = self.synapse_response.save(
+            self.stim_frames, self.settings.config, self, self.output_writer
+        )
+        self.statusBar().showMessage(f"Saving {filename}")
 
-                # element itself is always tmp_arr
-                max_idx = tmp_arr[0]
+        def report(future) -> None:
+            error = future.exception()
+            if error is None and journal is not None:
+                # the results are safe, the file doesn't need to be resumed
+                journal.remove()
+            self.save_finished.emit(filename, "" if error is None else str(error))
 
-                for peak_idx in tmp_arr:
-                    if (
-                        self.synapse_response.norm_intensity[peak_idx]
-                        >= self.synapse_response.norm_intensity[max_idx]
-                    ):
-                        max_idx = peak_idx
-                    processed_peaks.append(peak_idx)
+        future.add_done_callback(report)
 
-                result_arr.append(max_idx)
+    def show_save_result(self, filename: str, error: str) -> None:
+        if error == "":
+            self.statusBar().showMessage(f"Saved {filename}", 5000)
+            return
+        self.statusBar().showMessage(f"Saving {filename} failed: {error}")
+        warning = QMessageBox(self)
+        warning.setWindowTitle("Warning")
+        warning.setText(f"Saving {filename} failed: {error}")
+        warning.exec()
+
+    def closeEvent(self, event) -> None:
+        # don't lose results that are still being written
+        self.output_writer.wait()
+        if self.synapse_response.journal is not None:
+            self.synapse_response.journal.close()
+        super().closeEvent(event)
 
-            unique_peaks = result_arr
+    def peak_detection(self):
+        """
+        Runs peak detection and hands peaks to synapse_response data class.
+        """
+        self.threshold, peaks, self.preds = detect_responses(
+            self.synapse_response.intensity,
+            self.synapse_response.norm_intensity,
+            self.settings.config,
+            self.stim_frames,
+            self.model if self.is_ml_detection_activated() else None,
+            (
+                self.synapse_response.file_id,
+                self.synapse_response.columns[self.synapse_response.idx],
+            ),
+            self.detection_cache,
+            (
+                self.synapse_response.file_id,
+                self.synapse_response.columns[self.synapse_response.idx],
+            ),
+        )
+        self.synapse_response.add_automatic_peaks(peaks)
 
-        self.synapse_response.add_automatic_peaks(unique_peaks)
+    def start_batch_prediction(self) -> None:
+        """
+        Predicts the probabilities for all traces of the file in the background,
+        so navigating between traces doesn't wait for the model. Only restarts
+        if the file, the model or the normalization changed.
+        """
+        use_median = self.get_setting("normalization_use_median")
+        window_size = self.get_setting("normalization_sliding_window_size")
+        prediction_state = (
+            self.synapse_response.file_id,
+            self.get_setting("model_path"),
+            self.get_setting("ml_optimize_for_inference"),
+            use_median,
+            window_size,
+        )
+        if prediction_state == self.prediction_state:
+            return
+        self.prediction_state = prediction_state
+        if self.model.weights_loaded and self.model.model_path == prediction_state[1]:
+            self.model.clear_cache()
+        elif not self.model.load_weights(self.get_setting("model_path")):
+            return
+        # snapshot of the data, the worker must not touch synapse_response
+        synapse_response = self.synapse_response
+        if synapse_response.normalization_settings != (use_median, window_size):
+            synapse_response.normalize_traces(use_median, window_size)
+        norm_traces = synapse_response.norm_traces
+        norm_traces_future = synapse_response.norm_traces_future
+        file_id = synapse_response.file_id
+
+        def get_traces() -> np.ndarray:
+            norm_traces_future.result()
+            return norm_traces
+
+        self.model.predict_batch_async(
+            get_traces, [(file_id, column) for column in synapse_response.columns]
+        )
 
     def update_probability_label(self) -> None:
         # self.current_threshold.setText(f"{self.threshold_slider.value()}%")
-        automatic_peaks = self.model.update_predictions(
-            self.settings.config["threshold_slider_ml"] / 100
+        automatic_peaks = list(
+            np.argwhere(
+                np.array(self.preds) > self.settings.config["threshold_slider_ml"] / 100
+            ).flatten()
         )
         self.synapse_response.automatic_peaks = []
         self.synapse_response.add_automatic_peaks(automatic_peaks)
@@ -0,0 +1,221 @@
+import importlib.util
+import json
+import os
+from PyQt6.QtCore import QObject, QUrl, pyqtSlot
+from PyQt6.QtWebChannel import QWebChannel
+from PyQt6.QtWebEngineWidgets import QWebEngineView
+
+# plotly.js is shipped with the plotly python package, no network is needed
+plotly_package_data = os.path.join(
+    importlib.util.find_spec("plotly").submodule_search_locations[0], "package_data"
+)
+
+PLOT_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<script src="plotly.min.js"></script>
+<script src="qrc:///qtwebchannel/qwebchannel.js"></script>
+<style>
+html, body { margin: 0; height: 100%; overflow: hidden; }
+#plot { width: 100%; height: 100%; }
+</style>
+</head>
+<body>
+<div id="plot"></div>
+<script>
+const baseLayout = {
+    margin: { t: 30, l: 60, r: 20, b: 40 },
+    paper_bgcolor: "white",
+    plot_bgcolor: "white",
+    hovermode: "closest",
+    xaxis: {
+        title: { text: "Time" },
+        type: "linear",
+        gridcolor: "#EBF0F8",
+        zerolinecolor: "#EBF0F8",
+        rangeslider: { visible: true },
+    },
+    yaxis: {
+        title: { text: "Intensity" },
+        gridcolor: "#EBF0F8",
+        zerolinecolor: "#EBF0F8",
+    },
+};
+const config = { responsive: true, displaylogo: false };
+let revision = 0;
+let bridge = null;
+let rangeTimer = null;
+let listening = false;
+
+new QWebChannel(qt.webChannelTransport, (channel) => {
+    bridge = channel.objects.bridge;
+});
+
+function decode(b64) {
+    const binary = atob(b64);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    return new Float64Array(bytes.buffer);
+}
+
+function traceData(payload) {
+    const data = { x: decode(payload.x), y: decode(payload.y) };
+    if (payload.confidence !== null) {
+        data.customdata = decode(payload.confidence);
+    }
+    return data;
+}
+
+// asks for the data of the visible x-range once zooming/panning has stopped
+function requestRange() {
+    clearTimeout(rangeTimer);
+    rangeTimer = setTimeout(() => {
+        const xaxis = document.getElementById("plot").layout.xaxis;
+        if (bridge === null) {
+            return;
+        }
+        if (xaxis.autorange) {
+            bridge.request_range(-Infinity, Infinity, revision);
+        } else {
+            bridge.request_range(xaxis.range[0], xaxis.range[1], revision);
+        }
+    }, 100);
+}
+
+function handleRelayout(event) {
+    if (Object.keys(event).some((key) => key.startsWith("xaxis.range") || key === "xaxis.autorange")) {
+        requestRange();
+    }
+}
+
+function updatePlot(payload, newRevision) {
+    const trace = Object.assign(traceData(payload), {
+        type: "scatter",
+        mode: "lines",
+        line: { color: "#636efa" },
+        hovertemplate: "Time=%{x}<br>Intensity=%{y}<extra></extra>",
+    });
+    if (payload.confidence !== null) {
+        trace.hovertemplate =
+            "Time=%{x}<br>Intensity=%{y}<br>Confidence=%{customdata:.2%}<extra></extra>";
+    }
+    revision = newRevision;
+    // the view (zoom) is kept as long as the revision doesn't change
+    const layout = Object.assign({}, baseLayout, payload.layout, { uirevision: revision });
+    Plotly.react("plot", [trace], layout, config).then((plot) => {
+        if (!listening) {
+            plot.on("plotly_relayout", handleRelayout);
+            listening = true;
+        }
+        // a kept zoom needs the full resolution data again
+        if (!plot.layout.xaxis.autorange) {
+            requestRange();
+        }
+    });
+}
+
+function updateData(payload, dataRevision) {
+    if (dataRevision !== revision) {
+        return;
+    }
+    const data = traceData(payload);
+    const update = { x: [data.x], y: [data.y] };
+    if (data.customdata !== undefined) {
+        update.customdata = [data.customdata];
+    }
+    Plotly.restyle("plot", update, [0]);
+}
+
+function updateLayout(layout) {
+    Plotly.relayout("plot", layout);
+}
+</script>
+</body>
+</html>
+"""
+
+
+class PlotBridge(QObject):
+    """
+    Receives the range requests of the plot page via QWebChannel.
+    """
+
+    def __init__(self, view) -> None:
+        super().__init__(view)
+        self.view = view
+
+    @pyqtSlot(float, float, int)
+    def request_range(self, x0: float, x1: float, revision: int) -> None:
+        self.view.send_range(x0, x1, revision)
+
+
+class PlotView(QWebEngineView):
+    """
+    Persistent plot page. The page and plotly.js are loaded once, afterwards
+    trace data and layout are pushed via runJavaScript and rendered with
+    Plotly.react, so switching traces doesn't reload the page.
+
+    Only a downsampled overview of the trace is sent initially. Whenever the
+    user zooms or pans, the page requests the visible range, which is sent in
+    full resolution.
+    """
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self.page_loaded = False
+        self.pending_scripts = []
+        self.revision = 0
+        self.tr_plot = None
+        self.bridge = PlotBridge(self)
+        self.channel = QWebChannel(self.page())
+        self.channel.registerObject("bridge", self.bridge)
+        self.page().setWebChannel(self.channel)
+        self.loadFinished.connect(self.handle_load_finished)
+        self.setHtml(PLOT_PAGE, QUrl.fromLocalFile(plotly_package_data + os.sep))
+
+    def handle_load_finished(self, ok: bool) -> None:
+        self.page_loaded = ok
+        for script in self.pending_scripts:
+            self.page().runJavaScript(script)
+        self.pending_scripts = []
+
+    def run_script(self, script: str) -> None:
+        if not self.page_loaded:
+            self.pending_scripts.append(script)
+            return
+        self.page().runJavaScript(script)
+
+    def show_plot(self, tr_plot, keep_view: bool = False) -> None:
+        """
+        Renders a trace plot (see trace_plot.to_payload). The current zoom is
+        kept if keep_view is set, otherwise the view is reset.
+        """
+        if not keep_view:
+            self.revision += 1
+        self.tr_plot = tr_plot
+        # drop outdated plots that were not rendered yet
+        self.pending_scripts = [
+            script
+            for script in self.pending_scripts
+            if not script.startswith("updatePlot(")
+        ]
+        self.run_script(f"updatePlot({tr_plot.to_payload()}, {self.revision})")
+
+    def update_layout(self, tr_plot) -> None:
+        """
+        Only updates threshold, stimulation windows and annotations.
+        """
+        self.tr_plot = tr_plot
+        self.run_script(f"updateLayout({json.dumps(tr_plot.layout_payload())})")
+
+    def send_range(self, x0: float, x1: float, revision: int) -> None:
+        """
+        Sends the trace data of the x-range [x0, x1] to the page, unless another
+        trace was plotted in the meantime.
+        """
+        if self.tr_plot is None or revision != self.revision:
+            return
+        self.run_script(f"updateData({self.tr_plot.range_payload(x0, x1)}, {revision})")
@@ -0,0 +1,231 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, Future
+import numpy as np
+
+from ..detection.response_detection import (
+    PEAK_SETTINGS,
+    detect_responses,
+    precompute_detection,
+    stage_key,
+)
+from ..detection.detection_cache import DetectionCache
+from ..utils.plot import build_trace_plot, trace_plot
+
+
+class PreparedTrace:
+    """
+    Everything needed to show a trace: data, detection results and the rendered
+    plot for a freshly opened trace (all detected peaks selected).
+    """
+
+    def __init__(
+        self,
+        idx: int,
+        intensity: np.ndarray,
+        norm_intensity: np.ndarray,
+        threshold: float,
+        peaks: list[int],
+        preds: np.ndarray,
+        tr_plot: trace_plot,
+        labels: list,
+    ) -> None:
+        self.idx = idx
+        self.intensity = intensity
+        self.norm_intensity = norm_intensity
+        self.threshold = threshold
+        self.peaks = peaks
+        self.preds = preds
+        self.tr_plot = tr_plot
+        self.labels = labels
+
+
+def prepare_trace(
+    idx: int,
+    intensity: np.ndarray,
+    norm_intensity: np.ndarray,
+    settings: dict,
+    stim_frames: list[int],
+    model=None,
+    model_key=None,
+    cache: DetectionCache | None = None,
+    trace_key=None,
+) -> PreparedTrace:
+    """
+    Runs detection on a trace and creates its plot. The plotly payload is
+    serialized right away, so the GUI thread only needs to send it.
+    """
+    threshold, peaks, preds = detect_responses(
+        intensity,
+        norm_intensity,
+        settings,
+        stim_frames,
+        model,
+        model_key,
+        cache,
+        trace_key,
+    )
+    tr_plot, labels = build_trace_plot(
+        np.arange(len(intensity)),
+        norm_intensity if settings["normalized_trace"] else intensity,
+        threshold,
+        preds,
+        {peak: True for peak in peaks},
+        settings,
+        stim_frames,
+    )
+    if settings["plot_backend"] == "plotly":
+        tr_plot.to_payload()
+    return PreparedTrace(
+        idx,
+        intensity,
+        norm_intensity,
+        threshold,
+        peaks,
+        preds,
+        tr_plot,
+        labels,
+    )
+
+
+class TracePrefetcher:
+    """
+    Prepares the next traces of a file in a background worker while the user
+    judges the current one. All prepared traces are dropped, whenever the file
+    or any setting changes, their detection results are kept in the cache.
+
+    With a cache, the thresholds and threshold-based peaks of all traces of
+    the file are computed in one pass first, whenever the file or a setting
+    they depend on changes.
+    """
+
+    def __init__(
+        self, n_prefetch: int = 3, cache: DetectionCache | None = None
+    ) -> None:
+        self.n_prefetch = n_prefetch
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.futures: dict[int, Future] = {}
+        self.state = None
+        # file and settings of the last file-level detection
+        self.precomputed = None
+        self.precompute_future: Future = None
+
+    def invalidate(self) -> None:
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        self.state = None
+        if self.precompute_future is not None and self.precompute_future.cancel():
+            self.precomputed = None
+
+    def make_state(self, file_id: str, settings: dict) -> str:
+        """
+        Identifies the loaded file (not its path, which might be reopened after
+        it changed) and the settings the traces are prepared with.
+        """
+        return json.dumps([file_id, settings], sort_keys=True)
+
+    def get(self, idx: int, state: str) -> PreparedTrace | None:
+        """
+        Returns the prepared trace, waiting for it if it is in progress, or None
+        if it was not prefetched with the current file and settings.
+        """
+        if state != self.state or idx not in self.futures:
+            return None
+        future = self.futures.pop(idx)
+        if future.cancelled():
+            return None
+        try:
+            return future.result()
+        except Exception:
+            return None
+
+    def prefetch(
+        self,
+        synapse_response,
+        state: str,
+        settings: dict,
+        stim_frames: list[int],
+        model=None,
+    ) -> None:
+        """
+        Schedules the traces following the current trace of synapse_response.
+        """
+        if state != self.state:
+            self.invalidate()
+            self.state = state
+        # drop traces that were skipped
+        for idx in [idx for idx in self.futures if idx <= synapse_response.idx]:
+            self.futures.pop(idx).cancel()
+        # snapshot of the data, the worker must not touch synapse_response
+        norm_traces = synapse_response.norm_traces
+        norm_traces_future = synapse_response.norm_traces_future
+        file_id = synapse_response.file_id
+        settings = dict(settings)
+        if self.cache is not None:
+            self.precompute(synapse_response, settings, stim_frames)
+        for idx in range(
+            synapse_response.idx + 1,
+            min(synapse_response.idx + 1 + self.n_prefetch, len(synapse_response)),
+        ):
+            if idx in self.futures:
+                continue
+            column = synapse_response.columns[idx]
+            col_idx = synapse_response.column_index[column]
+            intensity = synapse_response.store.column(column)
+
+            def prepare(
+                idx=idx, column=column, col_idx=col_idx, intensity=intensity
+            ) -> PreparedTrace:
+                norm_traces_future.result()
+                return prepare_trace(
+                    idx,
+                    intensity,
+                    norm_traces[:, col_idx],
+                    settings,
+                    stim_frames,
+                    model,
+                    (file_id, column),
+                    self.cache,
+                    (file_id, column),
+                )
+
+            self.futures[idx] = self.executor.submit(prepare)
+
+    def precompute(
+        self, synapse_response, settings: dict, stim_frames: list[int]
+    ) -> None:
+        """
+        Schedules the file-level detection of synapse_response, unless it ran
+        with the same file and settings already. Queued before the traces, so
+        they only combine the cached results.
+        """
+        key = stage_key(
+            synapse_response.file_id,
+            "file",
+            settings,
+            PEAK_SETTINGS + ["th_detection"],
+            tuple(stim_frames),
+        )
+        if key == self.precomputed:
+            return
+        self.precomputed = key
+        file_id = synapse_response.file_id
+        columns = synapse_response.store.columns
+        traces = synapse_response.store.traces
+        norm_traces = synapse_response.norm_traces
+        norm_traces_future = synapse_response.norm_traces_future
+
+        def run() -> None:
+            norm_traces_future.result()
+            precompute_detection(
+                self.cache,
+                file_id,
+                columns,
+                traces,
+                norm_traces,
+                settings,
+                stim_frames,
+            )
+
+        self.precompute_future = self.executor.submit(run)
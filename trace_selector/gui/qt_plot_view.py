@@ -0,0 +1,91 @@
+import importlib.util
+from PyQt6.QtWidgets import QVBoxLayout, QWidget
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QColor
+
+
+def pyqtgraph_available() -> bool:
+    return importlib.util.find_spec("pyqtgraph") is not None
+
+
+class QtPlotView(QWidget):
+    """
+    Native Qt plotting backend based on pyqtgraph (optional dependency). Draws
+    directly into the widget and only renders the min/max of the samples per
+    pixel of the visible range, so zooming long traces never re-renders the
+    full data.
+    """
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        import pyqtgraph as pg
+
+        self.pg = pg
+        pg.setConfigOptions(antialias=False)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+        self.plot_widget = pg.PlotWidget(background="w")
+        self.plot_widget.showGrid(x=True, y=True, alpha=0.15)
+        self.plot_widget.setLabel("bottom", "Time")
+        self.plot_widget.setLabel("left", "Intensity")
+        layout.addWidget(self.plot_widget)
+        self.curve = self.plot_widget.plot(pen=pg.mkPen("#636efa", width=1))
+        self.curve.setDownsampling(auto=True, method="peak")
+        self.curve.setClipToView(True)
+        self.layout_items = []
+
+    def show_plot(self, tr_plot, keep_view: bool = False) -> None:
+        """
+        Renders a trace plot. The current zoom is kept if keep_view is set,
+        otherwise the view is reset to the full trace.
+        """
+        self.curve.setData(tr_plot.time, tr_plot.intensity)
+        self.update_layout(tr_plot)
+        if not keep_view:
+            self.plot_widget.enableAutoRange()
+
+    def update_layout(self, tr_plot) -> None:
+        """
+        Only updates threshold, stimulation windows and annotations.
+        """
+        pg = self.pg
+        for item in self.layout_items:
+            self.plot_widget.removeItem(item)
+        self.layout_items = []
+        for shape in tr_plot.shapes:
+            if shape["type"] == "line":
+                item = pg.InfiniteLine(
+                    pos=shape["y0"],
+                    angle=0,
+                    pen=pg.mkPen("r", width=1, style=Qt.PenStyle.DashLine),
+                )
+            else:
+                color = QColor(shape["fillcolor"])
+                color.setAlphaF(shape["opacity"])
+                item = pg.LinearRegionItem(
+                    values=(shape["x0"], shape["x1"]),
+                    movable=False,
+                    brush=pg.mkBrush(color),
+                    pen=pg.mkPen(None),
+                )
+                item.setZValue(-10)
+            self.plot_widget.addItem(item, ignoreBounds=True)
+            self.layout_items.append(item)
+        for annotation in tr_plot.annotations:
+            arrow = pg.ArrowItem(
+                pos=(annotation["x"], annotation["y"]),
+                angle=-90,
+                headLen=10,
+                brush="k",
+            )
+            text = pg.TextItem(
+                annotation["text"],
+                color="k",
+                anchor=(0.5, 1.5),
+                fill=pg.mkBrush(255, 255, 255, 200),
+            )
+            text.setPos(annotation["x"], annotation["y"])
+            for item in (arrow, text):
+                self.plot_widget.addItem(item, ignoreBounds=True)
+                self.layout_items.append(item)
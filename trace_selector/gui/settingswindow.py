@@ -14,10 +14,16 @@ from PyQt6.QtWidgets import (
     QComboBox,
     QTabWidget,
     QListWidget,
+    QMessageBox,
+    QFileDialog,
 )
 from PyQt6.QtCore import Qt
+import os
 import warnings
 
+from .qt_plot_view import pyqtgraph_available
+from ..utils.aggregate import AggregateStore, aggregate_folder
+
 
 class SettingsWindow(QWidget):
     def __init__(self, settings, parent, goBackHandler):
@@ -72,6 +78,59 @@ class SettingsWindow(QWidget):
         self.xlsx_export_box.clicked.connect(self.handle_settings_toggle)
         general_layout.addWidget(self.xlsx_export_box)
 
+        plot_backend_layout = QHBoxLayout()
+        plot_backend_layout.addWidget(QLabel("Plotting backend:"))
+        self.plot_backend = QComboBox()
+        self.plot_backend.addItems(["plotly", "pyqtgraph"])
+        if not pyqtgraph_available():
+            # pyqtgraph is an optional dependency
+            self.plot_backend.model().item(1).setEnabled(False)
+            self.plot_backend.setToolTip("Install pyqtgraph to use the native backend.")
+        else:
+            self.plot_backend.setToolTip(
+                "pyqtgraph draws long traces natively and faster than plotly."
+            )
+        self.plot_backend.activated.connect(self.handle_settings_toggle)
+        plot_backend_layout.addWidget(self.plot_backend)
+        plot_backend_layout.addStretch()
+        general_layout.addLayout(plot_backend_layout)
+
+        file_cache_layout = QHBoxLayout()
+        self.file_cache_box = QCheckBox("Cache opened files, max. size (MB):")
+        self.file_cache_box.setToolTip(
+            "Parsed files are stored in a binary format and reopen much faster."
+        )
+        self.file_cache_box.clicked.connect(self.handle_settings_toggle)
+        file_cache_layout.addWidget(self.file_cache_box)
+        self.file_cache_max_mb = QSpinBox()
+        self.file_cache_max_mb.setMinimumWidth(100)
+        self.file_cache_max_mb.setMaximum(1_000_000)
+        file_cache_layout.addWidget(self.file_cache_max_mb)
+        file_cache_layout.addStretch()
+        general_layout.addLayout(file_cache_layout)
+
+        self.journal_box = QCheckBox("Keep a journal to resume interrupted files")
+        self.journal_box.setToolTip(
+            "Every decision is recorded, so a file can be resumed at the same "
+            "trace after a crash."
+        )
+        self.journal_box.clicked.connect(self.handle_settings_toggle)
+        general_layout.addWidget(self.journal_box)
+
+        aggregate_layout = QHBoxLayout()
+        self.aggregate_box = QCheckBox("Aggregate the results of all saved files")
+        self.aggregate_box.setToolTip(
+            "The analysis tables of every saved file are collected in the "
+            "'aggregate' folder of the output folder."
+        )
+        self.aggregate_box.clicked.connect(self.handle_settings_toggle)
+        aggregate_layout.addWidget(self.aggregate_box)
+        self.button_export_aggregate = QPushButton("Export Aggregated Results")
+        self.button_export_aggregate.clicked.connect(self.export_aggregate)
+        aggregate_layout.addWidget(self.button_export_aggregate)
+        aggregate_layout.addStretch()
+        general_layout.addLayout(aggregate_layout)
+
         column_list_layout = QVBoxLayout()
         column_label = QLabel("Add or remove meta columns for your data:")
         column_list_layout.addWidget(column_label)
@@ -141,10 +200,18 @@ class SettingsWindow(QWidget):
         self.ml_model = QComboBox()
         self.ml_model.addItems(self.settings.modelzoo.available_models.keys())
         self.ml_model.currentIndexChanged.connect(self.handle_settings_toggle)
+        self.ml_model.currentIndexChanged.connect(self.preload_model)
         model_dropdown_layout.addWidget(self.ml_model)
         model_dropdown_layout.addStretch()
         response_layout.addLayout(model_dropdown_layout)
 
+        self.ml_optimize_box = QCheckBox("Optimize the model for inference")
+        self.ml_optimize_box.setToolTip(
+            "Freezes the model and fuses operations, predictions are faster on "
+            "most CPUs but may differ slightly."
+        )
+        response_layout.addWidget(self.ml_optimize_box)
+
         self.threshold_label = QLabel("Current Prediction Threshold (ML-based):")
         response_layout.addWidget(self.threshold_label)
 
@@ -393,6 +460,14 @@ class SettingsWindow(QWidget):
         self.stim_used_box.setChecked(self.settings.config["stim_used"])
         self.threshold_input.setValue(self.settings.config["threshold_mult"])
         self.xlsx_export_box.setChecked(self.settings.config["export_xlsx"])
+        backend = self.settings.config["plot_backend"]
+        if backend == "pyqtgraph" and not pyqtgraph_available():
+            backend = "plotly"
+        self.plot_backend.setCurrentText(backend)
+        self.file_cache_box.setChecked(self.settings.config["file_cache_enabled"])
+        self.file_cache_max_mb.setValue(self.settings.config["file_cache_max_mb"])
+        self.aggregate_box.setChecked(self.settings.config["aggregate_results"])
+        self.journal_box.setChecked(self.settings.config["journal_enabled"])
         self.export_normalized_traces.setChecked(
             self.settings.config["export_normalized_traces"]
         )
@@ -410,6 +485,9 @@ class SettingsWindow(QWidget):
         self.ml_detection_toggle.setChecked(self.settings.config["ml_detection"])
         self.th_detection_toggle.setChecked(self.settings.config["th_detection"])
         self.ml_model.setCurrentIndex(0)
+        self.ml_optimize_box.setChecked(
+            self.settings.config["ml_optimize_for_inference"]
+        )
         self.threshold_slider.setValue(self.settings.config["threshold_slider_ml"])
         self.frames_for_decay.setValue(self.settings.config["frames_for_decay"])
         self.normalized_trace_toggle.setChecked(
@@ -464,6 +542,34 @@ class SettingsWindow(QWidget):
         self.update_settings()
         self.update_output_path(self.settings.config["output_filepath"])
 
+    def export_aggregate(self) -> None:
+        """
+        Exports the aggregated analysis tables of all saved files into one
+        workbook (or one .csv per table).
+        """
+        store = AggregateStore(aggregate_folder(self.settings.config))
+        if not os.path.isdir(store.folder):
+            msg = QMessageBox(self)
+            msg.setIcon(QMessageBox.Icon.Warning)
+            msg.setWindowTitle("Warning")
+            msg.setText(f"No aggregated results found in {store.folder}")
+            msg.exec()
+            return
+        export_path, selected_filter = QFileDialog.getSaveFileName(
+            self,
+            "Export Aggregated Results",
+            os.path.join(self.settings.config["output_filepath"], "aggregate_results"),
+            "Excel (*.xlsx);;CSV (*.csv)",
+        )
+        if export_path == "":
+            return
+        if not export_path.endswith((".xlsx", ".csv")):
+            export_path += ".xlsx" if "xlsx" in selected_filter else ".csv"
+        store.export(export_path)
+        self.parent.statusBar().showMessage(
+            f"Exported aggregated results to {export_path}", 5000
+        )
+
     def update_output_path(self, path: str):
         self.output_folder_path_label.setText("Output Folder Path: " + path)
 
@@ -482,10 +588,14 @@ class SettingsWindow(QWidget):
         self.settings.config["stim_frames"] = self.stimframes_input.text()
         self.settings.config["th_detection"] = self.th_detection_toggle.isChecked()
         self.settings.config["ml_detection"] = self.ml_detection_toggle.isChecked()
-        model_path = self.settings.modelzoo.available_models[
-            self.ml_model.currentText()
-        ]["filepath"]
-        self.settings.config["model_path"] = model_path
+        # no model is listed before the first download finished
+        models = self.settings.modelzoo.available_models
+        if self.ml_model.currentText() in models:
+            model_path = models[self.ml_model.currentText()]["filepath"]
+            self.settings.config["model_path"] = model_path
+        self.settings.config[
+            "ml_optimize_for_inference"
+        ] = self.ml_optimize_box.isChecked()
         self.settings.config["nms"] = self.non_max_supression_button.isChecked()
         self.settings.config["nms_window"] = self.nms_window.value()
         self.settings.config["stim_used"] = self.stim_used_box.isChecked()
@@ -497,6 +607,11 @@ class SettingsWindow(QWidget):
             "export_normalized_traces"
         ] = self.export_normalized_traces.isChecked()
         self.settings.config["export_xlsx"] = self.xlsx_export_box.isChecked()
+        self.settings.config["plot_backend"] = self.plot_backend.currentText()
+        self.settings.config["file_cache_enabled"] = self.file_cache_box.isChecked()
+        self.settings.config["file_cache_max_mb"] = self.file_cache_max_mb.value()
+        self.settings.config["aggregate_results"] = self.aggregate_box.isChecked()
+        self.settings.config["journal_enabled"] = self.journal_box.isChecked()
         self.settings.config[
             "normalization_use_median"
         ] = self.normalization_use_median.isChecked()
@@ -539,6 +654,9 @@ class SettingsWindow(QWidget):
         self.settings.write_settings()
         self.parent.stimframes = self.stimframes
 
+        self.parent.update_plot_backend()
+        self.parent.update_model_settings()
+
         # replot whenever any setting is changed
         if self.parent.synapse_response.file_opened:
             self.parent.plot(new_sample=False)
@@ -568,18 +686,38 @@ class SettingsWindow(QWidget):
                 "QSpinBox" "{" "background : #ff5959;" "}"
             )
 
+    def preload_model(self) -> None:
+        models = self.settings.modelzoo.available_models
+        if self.ml_model.currentText() in models:
+            self.parent.preload_model(models[self.ml_model.currentText()]["filepath"])
+
+    def update_models(self) -> None:
+        """
+        Refreshes the list of models once the model zoo checked for updates,
+        the selected model is kept.
+        """
+        selected = self.ml_model.currentText()
+        self.ml_model.blockSignals(True)
+        self.ml_model.clear()
+        self.ml_model.addItems(self.settings.modelzoo.available_models.keys())
+        if selected != "":
+            self.ml_model.setCurrentText(selected)
+        self.ml_model.blockSignals(False)
+
     def handle_settings_toggle(self) -> None:
         self.current_threshold_label.setText(f"{self.threshold_slider.value()}%")
 
         if self.ml_detection_toggle.isChecked():
             self.ml_model.setEnabled(True)
             self.ml_model_used.setEnabled(True)
+            self.ml_optimize_box.setEnabled(True)
             self.threshold_label.setEnabled(True)
             self.current_threshold_label.setEnabled(True)
             self.threshold_slider.setEnabled(True)
         else:
             self.ml_model.setEnabled(False)
             self.ml_model_used.setEnabled(False)
+            self.ml_optimize_box.setEnabled(False)
             self.threshold_label.setEnabled(False)
             self.current_threshold_label.setEnabled(False)
             self.threshold_slider.setEnabled(False)
@@ -597,6 +735,8 @@ class SettingsWindow(QWidget):
             self.patience_input.setEnabled(False)
             self.compute_ppr.setEnabled(False)
 
+        self.file_cache_max_mb.setEnabled(self.file_cache_box.isChecked())
+
         if self.non_max_supression_button.isChecked():
             self.nms_window.setEnabled(True)
         else:
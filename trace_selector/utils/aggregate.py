@@ -0,0 +1,140 @@
+import datetime
+import importlib.util
+import os
+import pandas as pd
+
+# analysis tables that are collected across files
+AGGREGATED_TABLES = [
+    "responses",
+    "stimulations",
+    "PPR",
+    "failure_analysis",
+    "responses_first_pulse",
+]
+
+# rows per sheet in .xlsx files (including the header)
+EXCEL_MAX_ROWS = 1_048_576
+
+
+def parquet_available() -> bool:
+    return (
+        importlib.util.find_spec("pyarrow") is not None
+        or importlib.util.find_spec("fastparquet") is not None
+    )
+
+
+def aggregate_folder(settings: dict) -> str:
+    if settings["aggregate_folder"] != "":
+        return settings["aggregate_folder"]
+    return os.path.join(settings["output_filepath"], "aggregate")
+
+
+class AggregateStore:
+    """
+    Session-level store of the analysis tables of all saved files. Every table
+    of a file is written to its own partition
+
+        <folder>/<table>/date=<YYYY-MM-DD>/<file key>.parquet
+
+    (.csv if neither pyarrow nor fastparquet is installed), so saving a file
+    only writes its own tables. The file key identifies the input file (its
+    hash), so saving it again replaces all of its tables. The combined export
+    streams over the partitions one at a time.
+    """
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.extension = ".parquet" if parquet_available() else ".csv"
+
+    def partitions(self, table: str) -> list[str]:
+        """
+        Returns all partitions of a table ordered by date and file.
+        """
+        table_folder = os.path.join(self.folder, table)
+        if not os.path.isdir(table_folder):
+            return []
+        paths = []
+        for date_folder in sorted(os.listdir(table_folder)):
+            date_path = os.path.join(table_folder, date_folder)
+            if not os.path.isdir(date_path):
+                continue
+            paths += [
+                os.path.join(date_path, filename)
+                for filename in sorted(os.listdir(date_path))
+                if filename.endswith((".parquet", ".csv"))
+            ]
+        return paths
+
+    def remove(self, table: str, file_key: str) -> None:
+        for path in self.partitions(table):
+            if os.path.splitext(os.path.basename(path))[0] == file_key:
+                os.remove(path)
+
+    def append(
+        self, file_key: str, filename: str, tables: dict[str, pd.DataFrame]
+    ) -> None:
+        """
+        Adds (or replaces) the analysis tables of a file. Tables of a previous
+        save that are missing now (e.g. PPR) are removed as well.
+        """
+        date_folder = f"date={datetime.date.today().isoformat()}"
+        for table in AGGREGATED_TABLES:
+            self.remove(table, file_key)
+        for table, df in tables.items():
+            if table not in AGGREGATED_TABLES:
+                continue
+            if "Filename" not in df.columns:
+                df = df.copy()
+                df.insert(0, "Filename", filename)
+            path = os.path.join(
+                self.folder, table, date_folder, file_key + self.extension
+            )
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            if self.extension == ".parquet":
+                df.to_parquet(tmp_path, index=False)
+            else:
+                df.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+
+    def read_partition(self, path: str) -> pd.DataFrame:
+        if path.endswith(".parquet"):
+            return pd.read_parquet(path)
+        return pd.read_csv(path)
+
+    def export(self, export_path: str) -> None:
+        """
+        Writes all files' tables into one workbook (one sheet per table) or, if
+        export_path doesn't end with .xlsx, into one <export_path>_<table>.csv
+        per table. Only one partition is held in memory at a time.
+        """
+        if export_path.endswith(".xlsx"):
+            self.export_excel(export_path)
+            return
+        prefix = os.path.splitext(export_path)[0]
+        for table in AGGREGATED_TABLES:
+            partitions = self.partitions(table)
+            if len(partitions) == 0:
+                continue
+            with open(f"{prefix}_{table}.csv", "w", newline="") as f:
+                for i, path in enumerate(partitions):
+                    self.read_partition(path).to_csv(f, index=False, header=i == 0)
+
+    def export_excel(self, export_path: str) -> None:
+        with pd.ExcelWriter(export_path) as writer:
+            for table in AGGREGATED_TABLES:
+                sheet, sheet_number, row = table, 1, 0
+                for path in self.partitions(table):
+                    df = self.read_partition(path)
+                    # continue on a new sheet once a sheet is full
+                    if row + len(df) + 1 > EXCEL_MAX_ROWS:
+                        sheet_number += 1
+                        sheet, row = f"{table} ({sheet_number})", 0
+                    df.to_excel(
+                        writer,
+                        sheet_name=sheet,
+                        startrow=row,
+                        index=False,
+                        header=row == 0,
+                    )
+                    row += len(df) + (1 if row == 0 else 0)
@@ -4,18 +4,36 @@ from platformdirs import user_data_dir
 from PyQt6.QtWidgets import QFileDialog
 from ..detection.model_zoo import ModelZoo
 
+current_directory = os.path.dirname(os.path.abspath(__file__))
+parent_directory = os.path.abspath(os.path.join(current_directory, os.pardir))
+default_config_path = os.path.join(parent_directory, "settings", "default_settings.json")
+user_config_path = os.path.join(user_data_dir("trace_selector"), "settings.json")
+
+
+def read_settings(config_path: str = "") -> dict:
+    """
+    Reads the settings without the GUI. If no config file is given, the settings
+    of the last GUI session are used and if these don't exist the default
+    settings. Keys missing in the config file are taken from the default
+    settings.
+    """
+    with open(default_config_path, "r") as in_json:
+        config = json.load(in_json)
+    if config_path == "" and os.path.isfile(user_config_path):
+        config_path = user_config_path
+    if config_path != "":
+        with open(config_path, "r") as in_json:
+            config.update(json.load(in_json))
+    return config
+
 
 class gui_settings:
     def __init__(self, modelzoo: ModelZoo) -> None:
         self.modelzoo = modelzoo
 
         # setup paths
-        current_directory = os.path.dirname(os.path.abspath(__file__))
-        parent_directory = os.path.abspath(os.path.join(current_directory, os.pardir))
-        settings_path = os.path.join(parent_directory, "settings")
-        self.default_config_path = os.path.join(settings_path, "default_settings.json")
-        self.user_config_path = os.path.join(user_data_dir("trace_selector"), "settings.json")
-        
+        self.default_config_path = default_config_path
+        self.user_config_path = user_config_path
 
         self.parse_settings()
 
@@ -0,0 +1,103 @@
+from typing import Callable
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_string_dtype
+
+from .trace_store import allocate_traces, release_traces
+
+# rows parsed per chunk
+CHUNK_ROWS = 50_000
+
+
+def count_lines(filepath: str, buffersize: int = 1024 * 1024) -> int:
+    """
+    Counts the lines of a file without decoding it.
+    """
+    n_lines = 0
+    last = b"\n"
+    with open(filepath, "rb") as f:
+        while True:
+            block = f.read(buffersize)
+            if not block:
+                break
+            n_lines += block.count(b"\n")
+            last = block[-1:]
+    # last line without line break
+    return n_lines + (last != b"\n")
+
+
+def split_columns(
+    df: pd.DataFrame, meta_columns: list[str]
+) -> tuple[list[str], list[str]]:
+    """
+    Splits the (str) columns of df into meta columns (listed in meta_columns or
+    holding text) and ROI columns.
+    """
+    meta = [
+        col for col in df.columns if col in meta_columns or is_string_dtype(df[col])
+    ]
+    return meta, [col for col in df.columns if col not in meta]
+
+
+def read_csv_chunked(
+    filepath: str,
+    meta_columns: list[str],
+    progress: Callable[[int], None] | None = None,
+    chunk_rows: int = CHUNK_ROWS,
+) -> tuple[np.ndarray, list[str], dict[str, str], pd.DataFrame]:
+    """
+    Reads a .csv/.txt file chunk by chunk. Meta columns are detected from the
+    header and the first chunk (listed in meta_columns or strings), all other
+    columns are parsed directly into a preallocated (frames x ROIs) float64
+    array, which is memory-mapped for large files. progress is called with
+    the percentage of rows read after every chunk.
+
+    Returns the same as read_input_file. Raises ValueError if a ROI column
+    holds text after the first chunk.
+    """
+    # upper bound of the number of rows (blank lines are skipped by the parser)
+    max_rows = max(count_lines(filepath) - 1, 0)
+    traces = None
+    meta_chunks = []
+    roi_dtypes = {}
+    n_rows = 0
+    try:
+        for chunk in pd.read_csv(filepath, sep=",", chunksize=chunk_rows):
+            chunk.columns = [str(col) for col in chunk.columns]
+            if traces is None:
+                meta, columns = split_columns(chunk, meta_columns)
+                traces = allocate_traces(max_rows, len(columns))
+            rois = chunk[columns]
+            for col, dtype in rois.dtypes.items():
+                if is_string_dtype(dtype):
+                    raise ValueError(f"column {col} holds text after the first chunk")
+                roi_dtypes[col] = np.result_type(roi_dtypes.get(col, dtype), dtype)
+            traces[n_rows : n_rows + len(chunk)] = rois.to_numpy(dtype=np.float64)
+            meta_chunks.append(chunk[meta])
+            n_rows += len(chunk)
+            if progress is not None and max_rows > 0:
+                progress(min(100, n_rows * 100 // max_rows))
+    except Exception:
+        if traces is not None:
+            release_traces(traces)
+        raise
+    if progress is not None:
+        progress(100)
+    if traces is None:
+        # header only, there are no chunks
+        df = pd.read_csv(filepath, sep=",")
+        df.columns = [str(col) for col in df.columns]
+        meta, columns = split_columns(df, meta_columns)
+        roi_dtypes = df[columns].dtypes.to_dict()
+        traces = np.empty((0, len(columns)), dtype=np.float64, order="F")
+        meta_chunks.append(df[meta])
+    if n_rows < max_rows:
+        trimmed = allocate_traces(n_rows, len(columns))
+        trimmed[:] = traces[:n_rows]
+        release_traces(traces)
+        traces = trimmed
+    dtypes = {
+        col: str(dtype) for col, dtype in roi_dtypes.items() if dtype != np.float64
+    }
+    meta_df = pd.concat(meta_chunks, ignore_index=True)
+    return traces, columns, dtypes, meta_df
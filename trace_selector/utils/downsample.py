@@ -0,0 +1,49 @@
+import numpy as np
+
+
+def minmax_indices(
+    y: np.ndarray, n_out: int, start: int = 0, stop: int | None = None
+) -> np.ndarray:
+    """
+    Returns the sorted indices of the minimum and maximum of y[start:stop] in
+    n_out // 2 equally sized buckets, always including the first and last
+    index. Every extremum (i.e. every response) stays visible in the line, while
+    at most about n_out points are drawn. Ranges that are already short enough
+    are returned in full resolution.
+    """
+    if stop is None:
+        stop = len(y)
+    start = max(start, 0)
+    stop = min(stop, len(y))
+    n = stop - start
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    if n <= n_out:
+        return np.arange(start, stop)
+    n_buckets = max(n_out // 2, 1)
+    bucket_size = n // n_buckets
+    full = bucket_size * n_buckets
+    buckets = y[start : start + full].reshape(n_buckets, bucket_size)
+    offsets = start + np.arange(n_buckets) * bucket_size
+    indices = [
+        np.array([start, stop - 1]),
+        offsets + np.argmin(buckets, axis=1),
+        offsets + np.argmax(buckets, axis=1),
+    ]
+    # remaining frames that don't fill a whole bucket
+    if full < n:
+        rest = y[start + full : stop]
+        indices.append(start + full + np.array([np.argmin(rest), np.argmax(rest)]))
+    return np.unique(np.concatenate(indices))
+
+
+def refine_indices(
+    overview: np.ndarray, y: np.ndarray, n_out: int, start: int, stop: int
+) -> np.ndarray:
+    """
+    Replaces the overview indices within [start, stop) by up to n_out indices of
+    that range, so a zoomed range is shown in (nearly) full resolution while the
+    rest of the trace stays downsampled.
+    """
+    outside = overview[(overview < start) | (overview >= stop)]
+    return np.union1d(outside, minmax_indices(y, n_out, start, stop))
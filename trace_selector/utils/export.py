@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 from ..utils.normalization import sliding_window_normalization
+from .post_selection.stimulation_assignment import StimulationAssignment
+from .output_writer import excel_engine
 
 
 def normalized_trace_df(
@@ -8,13 +10,14 @@ def normalized_trace_df(
     normalization_use_median: bool,
     normalization_sliding_window_size: int,
 ) -> pd.DataFrame:
-    norm_trace_df = pd.DataFrame()
-    for col in trace_df.columns:
-        norm_trace_df[col] = sliding_window_normalization(
-            trace_df[col].to_numpy(),
+    norm_trace_df = pd.DataFrame(
+        sliding_window_normalization(
+            trace_df.to_numpy(dtype=np.float64),
             normalization_use_median,
             normalization_sliding_window_size,
-        )
+        ),
+        columns=trace_df.columns,
+    )
     return norm_trace_df
 
 
@@ -39,21 +42,15 @@ def create_peak_df(selected_peaks: list) -> pd.DataFrame:
 
 
 def create_fraction_first_pulse_df(
-    peaks: pd.DataFrame, stimulation_timepoints: list[int], patience: int
+    peaks: pd.DataFrame,
+    stimulation_timepoints: list[int],
+    patience: int,
+    assignment: StimulationAssignment | None = None,
 ) -> pd.DataFrame:
-    responses = 0
-    total_synapses = 0
-    for roi in peaks["ROI#"].unique():
-        if (
-            peaks[
-                (peaks["Frame"] >= stimulation_timepoints[0])
-                & (peaks["Frame"] <= stimulation_timepoints[0] + patience)
-                & (peaks["ROI#"] == roi)
-            ].shape[0]
-            > 0
-        ):
-            responses += 1
-        total_synapses += 1
+    if assignment is None:
+        assignment = StimulationAssignment(peaks, stimulation_timepoints, patience)
+    responses = int(np.sum(assignment.responded()[:, 0]))
+    total_synapses = len(assignment.rois)
     return pd.DataFrame(
         {
             "No. responses first pulse": [responses],
@@ -66,124 +63,87 @@ def create_fraction_first_pulse_df(
 
 
 def create_stimulation_df(
-    stimulations: list[int], patience: int, responses: pd.DataFrame
+    stimulations: list[int],
+    patience: int,
+    responses: pd.DataFrame,
+    assignment: StimulationAssignment | None = None,
 ) -> pd.DataFrame:
-    stimulation_list = []
+    """
+    Lists the largest response (by rel. Amplitude, the last one on ties) of
+    every ROI to every stimulation. Stimulations without a response have an
+    amplitude of 0 and no response frame.
+    """
+    if assignment is None:
+        assignment = StimulationAssignment(responses, stimulations, patience)
     filename = responses.loc[0, "Filename"]
-    for roi in responses["ROI#"].unique():
-        responses_roi = responses[responses["ROI#"] == roi]
-        for stimulation in stimulations:
-            responses_stim = responses_roi[
-                (responses_roi["Frame"] >= stimulation)
-                & (responses_roi["Frame"] <= stimulation + patience)
-            ]
-            if responses_stim.shape[0] == 0:
-                stimulation_list.append([filename, roi, stimulation, np.nan, 0, 0])
-                continue
-            # abs. Amplitude	rel. Amplitude
-            rel_amplitude = -np.inf
-            abs_amplitude = -np.inf
-            rel_norm_amplitude = -np.inf
-            abs_norm_amplitude = -np.inf
-            frame = -np.inf
-            for _, row in responses_stim.iterrows():
-                if row["rel. Amplitude"] < rel_amplitude:
-                    continue
-                rel_amplitude = row["rel. Amplitude"]
-                rel_norm_amplitude = row["rel. norm. Amplitude"]
-                abs_amplitude = row["abs. Amplitude"]
-                abs_norm_amplitude = row["abs. norm. Amplitude"]
-                frame = row["Frame"]
-            stimulation_list.append(
-                [
-                    filename,
-                    roi,
-                    stimulation,
-                    frame,
-                    abs_amplitude,
-                    rel_amplitude,
-                    abs_norm_amplitude,
-                    rel_norm_amplitude,
-                ]
-            )
-    stimulation_df = pd.DataFrame(
-        stimulation_list,
-        columns=[
-            "Filename",
-            "ROI#",
-            "Stimulation Frame",
-            "Response Frame",
-            "abs. Amplitude",
-            "rel. Amplitude",
-            "abs. norm. Amplitude",
-            "rel. norm. Amplitude",
-        ],
+    best = assignment.cell_argmax(responses["rel. Amplitude"].to_numpy(np.float64))
+    responded = best >= 0
+    best_responses = responses.iloc[best[responded]]
+
+    def response_values(column: str, no_response) -> np.ndarray:
+        values = np.full(len(best), no_response, dtype=np.float64)
+        values[responded] = best_responses[column].to_numpy(np.float64)
+        return values
+
+    if np.all(responded):
+        response_frames = best_responses["Frame"].to_numpy()
+    else:
+        response_frames = response_values("Frame", np.nan)
+    return pd.DataFrame(
+        {
+            "Filename": filename,
+            "ROI#": np.repeat(assignment.rois.to_numpy(), len(stimulations)),
+            "Stimulation Frame": np.tile(
+                np.asarray(stimulations, dtype=np.int64), len(assignment.rois)
+            ),
+            "Response Frame": response_frames,
+            "abs. Amplitude": response_values("abs. Amplitude", 0),
+            "rel. Amplitude": response_values("rel. Amplitude", 0),
+            "abs. norm. Amplitude": response_values("abs. norm. Amplitude", np.nan),
+            "rel. norm. Amplitude": response_values("rel. norm. Amplitude", np.nan),
+        }
     )
-    return stimulation_df
 
 
 def create_ppr_df(
-    peaks: pd.DataFrame, stimulation_timepoints: list[int], patience: int
+    peaks: pd.DataFrame,
+    stimulation_timepoints: list[int],
+    patience: int,
+    assignment: StimulationAssignment | None = None,
 ) -> pd.DataFrame:
-    result = []
-    for roi in peaks["ROI#"].unique():
-        roi_response = []
-        response_for_each_pulse = True
-        first_pulse_response_abs = np.nan
-        first_pulse_response_rel = np.nan
-        for i, stimulation in enumerate(stimulation_timepoints):
-            if (
-                peaks[
-                    (peaks["Frame"] >= stimulation)
-                    & (peaks["Frame"] <= stimulation + patience)
-                    & (peaks["ROI#"] == roi)
-                ].shape[0]
-                == 0
-            ):
-                response_for_each_pulse = False
-                roi_response.append(
-                    [f"Pulse {i+1}", roi, np.nan, np.nan, np.nan, np.nan]
-                )
-                continue
-            max_response_rel = peaks[
-                (peaks["Frame"] >= stimulation)
-                & (peaks["Frame"] <= stimulation + patience)
-                & (peaks["ROI#"] == roi)
-            ]["rel. Amplitude"].max()
-            max_response_abs = peaks[
-                (peaks["Frame"] >= stimulation)
-                & (peaks["Frame"] <= stimulation + patience)
-                & (peaks["ROI#"] == roi)
-            ]["abs. Amplitude"].max()
-            if np.isnan(first_pulse_response_abs):
-                first_pulse_response_abs = max_response_abs
-                first_pulse_response_rel = max_response_rel
-            ppr_tmp_abs = max_response_abs / first_pulse_response_abs
-            ppr_tmp_rel = max_response_rel / first_pulse_response_rel
-            roi_response.append(
-                [
-                    f"Pulse {i+1}",
-                    roi,
-                    max_response_rel,
-                    max_response_abs,
-                    ppr_tmp_abs,
-                    ppr_tmp_rel,
-                ]
-            )
-        for i in range(len(roi_response)):
-            roi_response[i].append(response_for_each_pulse)
-        result += roi_response
+    """
+    Paired-pulse ratios of the maximum response to every pulse relative to the
+    first pulse with a response of every ROI.
+    """
+    if assignment is None:
+        assignment = StimulationAssignment(peaks, stimulation_timepoints, patience)
+    responded = assignment.responded()
+    max_rel = assignment.cell_max(peaks["rel. Amplitude"].to_numpy(np.float64))
+    max_abs = assignment.cell_max(peaks["abs. Amplitude"].to_numpy(np.float64))
+    # the reference of every ROI is the first pulse with a (non NaN) response,
+    # before it the latest pulse with a response
+    n_pulses = len(stimulation_timepoints)
+    pulses = np.arange(n_pulses)
+    valid = responded & ~np.isnan(max_abs)
+    first = n_pulses - np.sum(np.cumsum(valid, axis=1) > 0, axis=1)
+    candidates = np.where(responded & (pulses <= first[:, None]), pulses, -1)
+    reference = np.maximum.accumulate(candidates, axis=1)
+    rows = np.arange(len(assignment.rois))[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ppr_abs = max_abs / max_abs[rows, reference]
+        ppr_rel = max_rel / max_rel[rows, reference]
+    ppr_abs[~responded] = np.nan
+    ppr_rel[~responded] = np.nan
     return pd.DataFrame(
-        result,
-        columns=[
-            "Pulse",
-            "ROI",
-            "rel. Amplitute",
-            "max. Amplitute",
-            "PPR_abs",
-            "PPR_rel",
-            "responded to all pulses",
-        ],
+        {
+            "Pulse": np.tile([f"Pulse {i+1}" for i in pulses], len(rows)),
+            "ROI": np.repeat(assignment.rois.to_numpy(), n_pulses),
+            "rel. Amplitute": max_rel.ravel(),
+            "max. Amplitute": max_abs.ravel(),
+            "PPR_abs": ppr_abs.ravel(),
+            "PPR_rel": ppr_rel.ravel(),
+            "responded to all pulses": np.repeat(np.all(responded, axis=1), n_pulses),
+        }
     )
 
 
@@ -197,6 +157,6 @@ def create_settings_df(settings_dict: dict) -> pd.DataFrame:
 def write_excel_output(
     dataframes: list[pd.DataFrame], df_names: list[str], export_path: str
 ) -> None:
-    with pd.ExcelWriter(export_path) as writer:
+    with pd.ExcelWriter(export_path, engine=excel_engine()) as writer:
         for df, sheet_name in zip(dataframes, df_names):
             df.to_excel(writer, sheet_name=sheet_name, index=False)
@@ -0,0 +1,157 @@
+import json
+import os
+import time
+from hashlib import sha256
+import numpy as np
+import pandas as pd
+from platformdirs import user_data_dir
+
+# bump whenever the parsing or the cache layout changes
+CACHE_VERSION = 1
+
+default_cache_folder = os.path.join(user_data_dir("trace_selector"), "file_cache")
+
+
+class FileCache:
+    """
+    On-disk cache of parsed input files. Every entry consists of
+
+    - <key>.npy: the ROI traces as (frames x ROIs) float64 matrix (column-major),
+      which is memory-mapped on reopen
+    - <key>.meta.pkl: the meta columns as DataFrame
+    - <key>.json: a small sidecar with the column names and the entry size
+
+    Entries are keyed by the sha256 hash of the file content and the parse
+    options, so renamed or moved files are found again and changed files are
+    never served from the cache. The least recently used entries are evicted
+    once the cache exceeds max_mb.
+    """
+
+    def __init__(self, folder: str = default_cache_folder, max_mb: int = 2048) -> None:
+        self.folder = folder
+        self.max_mb = max_mb
+
+    def key(self, file_hash: str, options: dict) -> str:
+        options = json.dumps(
+            {"version": CACHE_VERSION, **options}, sort_keys=True
+        ).encode("utf-8")
+        return sha256(file_hash.encode("ascii") + options).hexdigest()
+
+    def paths(self, key: str) -> tuple[str, str, str]:
+        base = os.path.join(self.folder, key)
+        return f"{base}.npy", f"{base}.meta.pkl", f"{base}.json"
+
+    def load(
+        self, key: str
+    ) -> tuple[np.ndarray, list[str], dict[str, str], pd.DataFrame] | None:
+        """
+        Returns the memory-mapped traces, the ROI column names, the original
+        dtypes of non-float ROI columns and the meta columns of a cached file or
+        None if it is not cached (or unreadable).
+        """
+        traces_path, meta_path, sidecar_path = self.paths(key)
+        if not os.path.isfile(sidecar_path):
+            return None
+        try:
+            with open(sidecar_path, "r") as f:
+                sidecar = json.load(f)
+            columns = sidecar["columns"]
+            dtypes = sidecar["dtypes"]
+            traces = np.load(traces_path, mmap_mode="r")
+            meta_df = pd.read_pickle(meta_path)
+        except Exception:
+            # corrupted entries or pickles of another pandas version
+            # (UnpicklingError, AttributeError, ModuleNotFoundError, ...)
+            self.remove(key)
+            return None
+        # mark the entry as recently used
+        os.utime(sidecar_path)
+        return traces, columns, dtypes, meta_df
+
+    def store(
+        self,
+        key: str,
+        traces: np.ndarray,
+        columns: list[str],
+        dtypes: dict[str, str],
+        meta_df: pd.DataFrame,
+        filename: str = "",
+    ) -> np.ndarray:
+        """
+        Writes a parsed file to the cache and returns the memory-mapped traces.
+        All files are written to temporary files and renamed, the sidecar last,
+        so interrupted or concurrent writes are never loaded.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        traces_path, meta_path, sidecar_path = self.paths(key)
+        tmp_suffix = f".{os.getpid()}.tmp"
+        with open(traces_path + tmp_suffix, "wb") as f:
+            np.save(f, np.asfortranarray(traces, dtype=np.float64))
+        os.replace(traces_path + tmp_suffix, traces_path)
+        meta_df.to_pickle(meta_path + tmp_suffix)
+        os.replace(meta_path + tmp_suffix, meta_path)
+        sidecar = {
+            "version": CACHE_VERSION,
+            "filename": filename,
+            "columns": columns,
+            "dtypes": dtypes,
+            "shape": list(traces.shape),
+            "size": os.path.getsize(traces_path) + os.path.getsize(meta_path),
+            "created": time.time(),
+        }
+        with open(sidecar_path + tmp_suffix, "w") as f:
+            json.dump(sidecar, f)
+        os.replace(sidecar_path + tmp_suffix, sidecar_path)
+        self.evict(keep=key)
+        return np.load(traces_path, mmap_mode="r")
+
+    def remove(self, key: str) -> None:
+        for path in self.paths(key):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        """
+        Returns (last use, size, key) of all cache entries.
+        """
+        if not os.path.isdir(self.folder):
+            return []
+        entries = []
+        for filename in os.listdir(self.folder):
+            if not filename.endswith(".json"):
+                continue
+            sidecar_path = os.path.join(self.folder, filename)
+            try:
+                with open(sidecar_path, "r") as f:
+                    size = json.load(f)["size"]
+                last_use = os.path.getmtime(sidecar_path)
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((last_use, size, filename[: -len(".json")]))
+        return entries
+
+    def evict(self, keep: str = "") -> None:
+        """
+        Removes the least recently used entries (except keep) until the cache
+        fits max_mb.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        max_bytes = self.max_mb * 1024 * 1024
+        for _, size, key in entries:
+            if total <= max_bytes:
+                break
+            if key == keep:
+                continue
+            self.remove(key)
+            total -= size
+
+    def clear(self) -> None:
+        for _, _, key in self.entries():
+            self.remove(key)
+
+
+def file_cache_from_settings(settings: dict) -> FileCache | None:
+    if not settings["file_cache_enabled"]:
+        return None
+    return FileCache(max_mb=settings["file_cache_max_mb"])
@@ -1,4 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
+import json
+import os
+import threading
 
 
 def sha256_hash(filepath: str, buffersize: int = 65536) -> str:
@@ -10,3 +14,102 @@ def sha256_hash(filepath: str, buffersize: int = 65536) -> str:
                 break
             hasher.update(data)
     return hasher.hexdigest()
+
+
+class HashIndex:
+    """
+    Persistent index of file hashes, stored as JSON:
+
+        {path: {"size": ..., "mtime_ns": ..., "sha256": ...}, ...}
+
+    A hash is reused as long as size and modification time of the file are
+    unchanged, so only new or changed files are read. Thread-safe.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.changed = False
+        try:
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            # missing or corrupt, all files are hashed again
+            self.entries = {}
+
+    def lookup(self, filepath: str) -> str | None:
+        """
+        Returns the indexed hash of filepath or None if the file is not indexed
+        or changed since.
+        """
+        stat = os.stat(filepath)
+        with self.lock:
+            entry = self.entries.get(os.path.abspath(filepath))
+        if (
+            entry is None
+            or entry["size"] != stat.st_size
+            or entry["mtime_ns"] != stat.st_mtime_ns
+        ):
+            return None
+        return entry["sha256"]
+
+    def add(self, filepath: str, file_hash: str, stat: os.stat_result = None) -> None:
+        """
+        Indexes the hash of filepath. stat has to be taken before the file was
+        hashed, so a change during hashing is detected on the next lookup.
+        """
+        if stat is None:
+            stat = os.stat(filepath)
+        with self.lock:
+            self.entries[os.path.abspath(filepath)] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": file_hash,
+            }
+            self.changed = True
+
+    def hash(self, filepath: str) -> str:
+        """
+        Returns the hash of filepath, hashing it only if it is not indexed.
+        """
+        file_hash = self.lookup(filepath)
+        if file_hash is None:
+            stat = os.stat(filepath)
+            file_hash = sha256_hash(filepath, buffersize=1024 * 1024)
+            self.add(filepath, file_hash, stat)
+        return file_hash
+
+    def hash_files(self, filepaths: list[str], max_workers: int = 4) -> dict[str, str]:
+        """
+        Returns the hashes of all files and saves the index. Files that need
+        to be hashed are read concurrently.
+        """
+        stale = [filepath for filepath in filepaths if self.lookup(filepath) is None]
+        if len(stale) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(stale))) as pool:
+                list(pool.map(self.hash, stale))
+        hashes = {filepath: self.hash(filepath) for filepath in filepaths}
+        self.save()
+        return hashes
+
+    def save(self) -> None:
+        """
+        Writes the index if it changed, entries of deleted files are dropped.
+        """
+        with self.lock:
+            entries = {
+                path: entry
+                for path, entry in self.entries.items()
+                if os.path.isfile(path)
+            }
+            if not self.changed and len(entries) == len(self.entries):
+                return
+            self.entries = entries
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(self.entries, f)
+                os.replace(tmp_path, self.path)
+                self.changed = False
+            except OSError as e:
+                print(f"Could not save the hash index: {e}")
@@ -0,0 +1,111 @@
+import json
+import os
+import time
+from platformdirs import user_data_dir
+
+default_journal_folder = os.path.join(user_data_dir("trace_selector"), "journal")
+
+# the journal is flushed after every record, but only synced to disk after
+# this many records or seconds
+FSYNC_RECORDS = 20
+FSYNC_SECONDS = 2.0
+
+
+def to_json(value):
+    # numpy scalars (np.int64, np.bool_) of the response rows
+    return value.item()
+
+
+class SessionJournal:
+    """
+    Append-only journal of the decisions made on a file, one JSON record per
+    line, so an interrupted file can be resumed at the exact trace:
+
+        {"action": "open", "filename": ..., "columns": [...]}
+        {"action": "keep", "idx": 3, "responses": [[...], ...]}
+        {"action": "discard", "idx": 4}
+        {"action": "back", "idx": 5}
+        {"action": "discard_rest", "idx": 5}
+
+    Kept traces store their complete response rows, so replaying doesn't
+    recompute anything. The journal is keyed by the hash of the input file
+    and removed once the file was saved.
+    """
+
+    def __init__(self, file_hash: str, folder: str = default_journal_folder) -> None:
+        self.path = os.path.join(folder, f"{file_hash}.jsonl")
+        self.file = None
+        self.valid_size = 0
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def records(self) -> list[dict]:
+        """
+        Reads all records. A line that was only partially written when the
+        program stopped is ignored.
+        """
+        records = []
+        # size of the complete records
+        self.valid_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break
+                self.valid_size += len(line)
+        return records
+
+    def start(self, filename: str, columns: list[str]) -> None:
+        """
+        Starts a new journal, replacing an existing one.
+        """
+        self.close()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "w")
+        self.append({"action": "open", "filename": filename, "columns": columns})
+
+    def resume(self) -> None:
+        """
+        Continues an existing journal after its records were read, a partially
+        written last line is cut off.
+        """
+        self.close()
+        os.truncate(self.path, self.valid_size)
+        self.file = open(self.path, "a")
+
+    def append(self, record: dict) -> None:
+        if self.file is None:
+            return
+        self.file.write(json.dumps(record, default=to_json) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if (
+            self.unsynced >= FSYNC_RECORDS
+            or time.monotonic() - self.last_sync > FSYNC_SECONDS
+        ):
+            self.sync()
+
+    def sync(self) -> None:
+        if self.file is None or self.unsynced == 0:
+            return
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if self.file is None:
+            return
+        self.sync()
+        self.file.close()
+        self.file = None
+
+    def remove(self) -> None:
+        self.close()
+        if self.exists():
+            os.remove(self.path)
@@ -1,5 +1,11 @@
+from bisect import bisect_left, insort
+from typing import Callable
 import numpy as np
 import numpy.typing as npt
+from numpy.lib.stride_tricks import sliding_window_view
+
+# upper bound of elements materialized at once by the strided median
+_MAX_WINDOW_ELEMENTS = 1 << 24
 
 
 def sliding_window_normalization(
@@ -8,41 +14,143 @@ def sliding_window_normalization(
     """
     Normalize a 1D numpy array using a sliding window.
 
+    The frame at position `pos` is divided by the median (or mean) of
+    trace[max(0, pos - window_size // 2) : min(pos + window_size // 2, len - 1)].
+
     Parameters:
-    - trace (np.ndarray): Input 1D array to be normalized.
+    - trace (np.ndarray): Input 1D array to be normalized. A 2D array of shape
+      (frames, traces) normalizes every column in one call.
     - use_median (bool): If True, use median for normalization; else, use mean.
     - window_size (int): Size of the sliding window.
 
     Returns:
-    - np.ndarray: Normalized array.
+    - np.ndarray: Normalized array with the same shape as the input. For 2D
+      input the array is column-major, so every normalized trace is contiguous.
     """
-    if not isinstance(trace, np.ndarray) or trace.ndim != 1:
-        raise ValueError("Input 'trace' must be a 1D numpy array.")
+    if not isinstance(trace, np.ndarray) or trace.ndim not in (1, 2):
+        raise ValueError("Input 'trace' must be a 1D or 2D numpy array.")
 
-    if len(trace) == 0:
+    if trace.shape[0] == 0:
         raise ValueError("Input array 'trace' is empty.")
 
-    if window_size >= len(trace):
+    if window_size >= trace.shape[0]:
         raise ValueError(
             "Window size should be smaller than the length of the input array."
         )
 
-    window_before = window_size // 2
-    window_after = window_size // 2
-    norm_trace = np.empty_like(trace, dtype=np.float64)
+    # work on (traces, frames) so that every trace is contiguous in memory
+    rows = np.ascontiguousarray(np.atleast_2d(trace.T), dtype=np.float64)
+    if use_median:
+        norm_factor = rolling_median(rows, window_size)
+    else:
+        norm_factor = rolling_mean(rows, window_size)
+    norm_trace = rows / norm_factor
+    if trace.ndim == 1:
+        return norm_trace[0]
+    return norm_trace.T
 
-    for pos, dp in enumerate(trace):
-        norm_window_start = max(0, pos - window_before)
-        norm_window_end = min(pos + window_after, len(trace) - 1)
 
-        # Calculate normalization factor
-        norm_factor = (
-            np.median(trace[norm_window_start:norm_window_end])
-            if use_median
-            else np.mean(trace[norm_window_start:norm_window_end])
-        )
+def window_bounds(length: int, window_size: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns start (inclusive) and end (exclusive) of the normalization window
+    for every frame of a trace with the given length.
+    """
+    half_window = window_size // 2
+    pos = np.arange(length)
+    starts = np.maximum(0, pos - half_window)
+    ends = np.minimum(pos + half_window, length - 1)
+    return starts, ends
+
 
-        # Normalize data point and assign to result array
-        norm_trace[pos] = dp / norm_factor
+def rolling_mean(rows: np.ndarray, window_size: int) -> npt.NDArray[np.float64]:
+    """
+    Sliding window mean of every row of a 2D array of shape (traces, frames)
+    computed from cumulative sums in O(frames). Rows with NaN or inf values
+    fall back to a batched mean over a strided view, a single non-finite
+    frame would otherwise spoil the cumulative sum of all later frames.
+    """
+    starts, ends = window_bounds(rows.shape[1], window_size)
+    cumsum = np.zeros((rows.shape[0], rows.shape[1] + 1), dtype=np.float64)
+    np.cumsum(rows, axis=1, out=cumsum[:, 1:])
+    counts = (ends - starts).astype(np.float64)
+    counts[counts == 0] = np.nan
+    means = (cumsum[:, ends] - cumsum[:, starts]) / counts
+    for i in np.flatnonzero(~np.isfinite(rows).all(axis=1)):
+        means[i] = _strided_window_stat(rows[i], starts, ends, np.mean)
+    return means
+
+
+def rolling_median(rows: np.ndarray, window_size: int) -> npt.NDArray[np.float64]:
+    """
+    Sliding window median of every row of a 2D array of shape (traces, frames).
 
-    return norm_trace
+    Every row is swept once with a sorted window, that is updated by inserting
+    the frames entering and deleting the frames leaving the window. Rows with
+    missing values fall back to a batched median over a strided view to keep
+    the NaN semantics of np.median.
+    """
+    starts, ends = window_bounds(rows.shape[1], window_size)
+    medians = np.empty(rows.shape, dtype=np.float64)
+    for row, median_row in zip(rows, medians):
+        if np.isnan(row).any():
+            median_row[:] = _strided_window_stat(row, starts, ends, np.median)
+        else:
+            median_row[:] = _sorted_window_median(row, starts, ends)
+    return medians
+
+
+def _sorted_window_median(
+    row: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> list[float]:
+    """
+    Median of row[start:end] for monotonically increasing window bounds.
+    """
+    values = row.tolist()
+    window = []
+    medians = []
+    current_start = 0
+    current_end = 0
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        while current_end < end:
+            insort(window, values[current_end])
+            current_end += 1
+        while current_start < start:
+            del window[bisect_left(window, values[current_start])]
+            current_start += 1
+        size = len(window)
+        if size == 0:
+            medians.append(np.nan)
+        elif size % 2 == 1:
+            medians.append(window[size // 2])
+        else:
+            medians.append((window[size // 2 - 1] + window[size // 2]) / 2)
+    return medians
+
+
+def _strided_window_stat(
+    row: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    stat: Callable[..., np.ndarray],
+) -> npt.NDArray[np.float64]:
+    """
+    stat (np.median or np.mean) of row[start:end] computed batched for all
+    full-length windows and individually for the shortened windows at the
+    edges of the trace. Keeps the NaN and inf semantics of stat.
+    """
+    values = np.empty(len(row), dtype=np.float64)
+    full_window = int(np.max(ends - starts))
+    if full_window == 0:
+        # every window is empty
+        values.fill(np.nan)
+        return values
+    is_full = (ends - starts) == full_window
+    windows = sliding_window_view(row, full_window)
+    full_positions = np.flatnonzero(is_full)
+    chunk = max(1, _MAX_WINDOW_ELEMENTS // full_window)
+    for offset in range(0, len(full_positions), chunk):
+        tmp_positions = full_positions[offset : offset + chunk]
+        values[tmp_positions] = stat(windows[starts[tmp_positions]], axis=1)
+    for pos in np.flatnonzero(~is_full):
+        values[pos] = stat(row[starts[pos] : ends[pos]])
+    return values
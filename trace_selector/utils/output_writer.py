@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable
+import importlib.util
+import os
+import threading
+import pandas as pd
+
+
+def excel_engine() -> str | None:
+    """
+    xlsxwriter writes .xlsx files considerably faster than openpyxl (pandas'
+    default), it is used if installed.
+    """
+    if importlib.util.find_spec("xlsxwriter") is not None:
+        return "xlsxwriter"
+    return None
+
+
+def temporary_path(path: str) -> str:
+    # keeps the extension, the Excel writers choose the format by it
+    root, ext = os.path.splitext(path)
+    return f"{root}.tmp{ext}"
+
+
+def write_atomic(path: str, write: Callable[[str], None]) -> None:
+    """
+    Calls write with a temporary path next to path and renames the result, so
+    path is either missing or complete.
+    """
+    tmp_path = temporary_path(path)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_table(df: pd.DataFrame, path: str) -> None:
+    """
+    Writes df as .xlsx or .csv (depending on the extension of path) atomically.
+    """
+    if path.endswith(".xlsx"):
+        write_atomic(
+            path, lambda tmp: df.to_excel(tmp, index=False, engine=excel_engine())
+        )
+    else:
+        write_atomic(path, lambda tmp: df.to_csv(tmp, index=False))
+
+
+class OutputWriter:
+    """
+    Background writer of the output files. Saves are processed one after
+    another in the order they were submitted, the files of a save are written
+    concurrently.
+    """
+
+    def __init__(self, max_workers: int = 4) -> None:
+        self.queue = ThreadPoolExecutor(max_workers=1)
+        self.files = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        # output paths of saves that are not written yet
+        self.pending = set()
+
+    def exists(self, path: str) -> bool:
+        """
+        Whether path exists or will be written by a pending save.
+        """
+        with self.lock:
+            return path in self.pending or os.path.exists(path)
+
+    def submit(self, tasks: list[tuple[str, Callable[[], None]]]) -> Future:
+        """
+        Queues a save. tasks holds the output path and the function writing it
+        of every file. The returned future fails with the first error.
+        """
+        paths = [path for path, _ in tasks]
+        with self.lock:
+            self.pending.update(paths)
+
+        def save() -> None:
+            try:
+                futures = [self.files.submit(write) for _, write in tasks]
+                for future in futures:
+                    future.result()
+            finally:
+                with self.lock:
+                    self.pending.difference_update(paths)
+
+        return self.queue.submit(save)
+
+    def wait(self) -> None:
+        """
+        Blocks until all queued saves are written.
+        """
+        self.queue.submit(lambda: None).result()
+
+    def close(self) -> None:
+        self.queue.shutdown(wait=True)
+        self.files.shutdown(wait=True)
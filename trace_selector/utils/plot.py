@@ -1,10 +1,27 @@
+import base64
+import json
 import numpy as np
-import plotly.express as px
-import pandas as pd
-from typing import Union
+
+from .downsample import minmax_indices, refine_indices
+
+
+def encode_array(arr: np.ndarray) -> str:
+    """
+    Encodes an array as base64 string of its float64 bytes, that is decoded to a
+    Float64Array in the plot page.
+    """
+    return base64.b64encode(np.ascontiguousarray(arr, dtype="<f8").tobytes()).decode(
+        "ascii"
+    )
 
 
 class trace_plot:
+    """
+    Holds the data, threshold line, stimulation windows and peak annotations of
+    a trace plot independent of the plotting backend (see gui/plot_view.py and
+    gui/qt_plot_view.py).
+    """
+
     def __init__(
         self,
         time: np.ndarray,
@@ -13,39 +30,57 @@ class trace_plot:
         threshold_detection_activated: bool,
         probabilities=[],
         always_show_threshold=False,
+        max_points: int = 4000,
     ):
         self.time = time
         self.intensity = intensity
         self.threshold = threshold
         self.threshold_detection_activated = threshold_detection_activated
         self.always_show_threshold = always_show_threshold
-
-        if len(probabilities) == 0:
-            self.probabilities = [0 for _ in range(len(time))]
-        else:
-            self.probabilities = [f"{np.round(p*100,2)}%" for p in probabilities]
-        self.plot_df = pd.DataFrame(
-            {
-                "Time": self.time,
-                "Intensity": self.intensity,
-                "Confidence": self.probabilities,
-            }
-        )
+        self.probabilities = np.asarray(probabilities, dtype=np.float64)
+        self.max_points = max_points
+        self.overview = None
+        self.shapes = []
+        self.annotations = []
+        self.payload = None
 
     def create_plot(self) -> None:
         """
         Creates the basic trace plot with a threshold.
         """
-        self.fig = px.line(
-            self.plot_df, x="Time", y="Intensity", hover_data="Confidence"
-        )
-        self.fig.update_layout(
-            template="plotly_white",
-            xaxis=dict(rangeslider=dict(visible=True), type="linear"),
-        )
-
+        self.shapes = []
+        self.annotations = []
+        self.payload = None
         if self.threshold_detection_activated or self.always_show_threshold:
-            self.fig.add_hline(y=self.threshold, line_color="red", line_dash="dash")
+            self.shapes.append(
+                {
+                    "type": "line",
+                    "xref": "paper",
+                    "x0": 0,
+                    "x1": 1,
+                    "yref": "y",
+                    "y0": float(self.threshold),
+                    "y1": float(self.threshold),
+                    "line": {"color": "red", "dash": "dash"},
+                }
+            )
+
+    def add_vrect(self, x0: float, x1: float) -> None:
+        self.payload = None
+        self.shapes.append(
+            {
+                "type": "rect",
+                "xref": "x",
+                "x0": float(x0),
+                "x1": float(x1),
+                "yref": "paper",
+                "y0": 0,
+                "y1": 1,
+                "fillcolor": "yellow",
+                "opacity": 0.25,
+                "line": {"width": 0},
+            }
+        )
 
     def add_stimulation_window(
         self, frames: list[int], patience: int, start: int = 0, step: int = 30
@@ -57,25 +92,14 @@ class trace_plot:
         # if frames is not empty
         if frames:
             for frame in frames:
-                self.fig.add_vrect(
-                    x0=frame,
-                    x1=frame + patience,
-                    fillcolor="yellow",
-                    opacity=0.25,
-                    line_width=0,
-                )
+                self.add_vrect(frame, frame + patience)
             return
         length = len(self.time)
         num_steps = length // step
-        steps = np.arange(0, num_steps) * step + start
         steps = [i * step + start for i in range(num_steps)]
         for step in steps:
-            self.fig.add_vrect(
-                x0=step,
-                x1=step + patience if step + patience < length else length - 1,
-                fillcolor="yellow",
-                opacity=0.25,
-                line_width=0,
+            self.add_vrect(
+                step, step + patience if step + patience < length else length - 1
             )
 
     def add_peaks(
@@ -96,22 +120,111 @@ class trace_plot:
         return res
 
     def add_annotation(self, peak) -> None:
+        text = f"Frame: {peak} | Int.: {np.round(self.intensity[peak], 2)}"
         if len(self.probabilities) > 0:
-            self.fig.add_annotation(
-                x=peak,
-                y=self.intensity[peak],
-                text=f"Frame: {peak} | Int.: {np.round(self.intensity[peak], 2)} | Conf.: {self.probabilities[peak]}",
-                showarrow=True,
+            text += f" | Conf.: {np.round(self.probabilities[peak] * 100, 2)}%"
+        self.payload = None
+        self.annotations.append(
+            {
+                "x": int(peak),
+                "y": float(self.intensity[peak]),
+                "text": text,
+                "showarrow": True,
+            }
+        )
+
+    def layout_payload(self) -> dict:
+        return {"shapes": self.shapes, "annotations": self.annotations}
+
+    def overview_indices(self) -> np.ndarray:
+        """
+        Frames that are drawn for the full view of the trace.
+        """
+        if self.overview is None:
+            self.overview = minmax_indices(self.intensity, self.max_points)
+        return self.overview
+
+    def data_payload(self, indices: np.ndarray) -> dict:
+        return {
+            "x": encode_array(self.time[indices]),
+            "y": encode_array(self.intensity[indices]),
+            "confidence": (
+                encode_array(self.probabilities[indices])
+                if len(self.probabilities) > 0
+                else None
+            ),
+        }
+
+    def to_payload(self) -> str:
+        """
+        Returns the JSON payload for the plotly page with the downsampled trace
+        data as base64 encoded typed arrays and the layout (threshold,
+        stimulation windows, annotations). The payload is kept until the plot
+        changes.
+        """
+        if self.payload is not None:
+            return self.payload
+        payload = self.data_payload(self.overview_indices())
+        payload["layout"] = self.layout_payload()
+        self.payload = json.dumps(payload)
+        return self.payload
+
+    def range_payload(self, x0: float, x1: float) -> str:
+        """
+        Returns the JSON payload of the trace data with the x-range [x0, x1] in
+        full resolution (or downsampled to max_points if it is still longer).
+        """
+        start = int(np.searchsorted(self.time, x0, side="left"))
+        stop = int(np.searchsorted(self.time, x1, side="right"))
+        # include the neighbouring frames, so the line reaches the borders
+        indices = refine_indices(
+            self.overview_indices(),
+            self.intensity,
+            self.max_points,
+            start - 1,
+            stop + 1,
+        )
+        return json.dumps(self.data_payload(indices))
+
+
+def build_trace_plot(
+    time: np.ndarray,
+    intensity: np.ndarray,
+    threshold: float,
+    probabilities: np.ndarray,
+    peak_dict: dict[int, bool],
+    settings: dict,
+    stim_frames: list[int],
+) -> tuple[trace_plot, list]:
+    """
+    Creates the trace plot with threshold, stimulation windows and peak
+    annotations as configured in the settings. Returns the plot and the
+    annotated peaks.
+    """
+    tr_plot = trace_plot(
+        time=time,
+        intensity=intensity,
+        threshold=threshold,
+        threshold_detection_activated=settings["th_detection"],
+        probabilities=probabilities,
+        always_show_threshold=settings["always_show_threshold"],
+        max_points=settings["plot_max_points"],
+    )
+    tr_plot.create_plot()
+
+    # add responses
+    if settings["select_responses"] and settings["stim_used"]:
+        if settings["use_manual_stim_frames"] and settings["stim_frames"] != "":
+            tr_plot.add_stimulation_window(
+                stim_frames, settings["stim_frames_patience"]
             )
         else:
-            self.fig.add_annotation(
-                x=peak,
-                y=self.intensity[peak],
-                text=f"Frame: {peak} | Int.: {np.round(self.intensity[peak], 2)}",
-                showarrow=True,
+            tr_plot.add_stimulation_window(
+                [],
+                settings["stim_frames_patience"],
+                settings["stim_frames_start"],
+                settings["stim_frames_step"],
             )
 
-    def reload_plot(self) -> None:
-        self.fig.update_layout(
-            xaxis=dict(rangeslider=dict(visible=True), type="linear")
-        )
+    labels = tr_plot.add_peaks(peak_dict, settings["nms"])
+    return tr_plot, labels
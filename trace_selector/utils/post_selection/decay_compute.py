@@ -1,24 +1,311 @@
-from scipy.optimize import curve_fit
+import warnings
 import numpy as np
 
+# limits the exponent to keep exp() finite for diverging fits
+MAX_EXPONENT = 700.0
+# invTau of the additional starting points of the refinement
+START_INV_TAUS = (-0.3, 0.05, 0.3, 1.0, 3.0)
+# damping at which no step decreases the cost any more
+MAX_DAMPING = 1e12
+# condition number of J^T J above which a fit is degenerate (e.g. invTau so
+# large that exp(-invTau * t) vanishes), such fits are compared to curve_fit
+MAX_CONDITION = 1e14
 
-def compute_tau(voltage: np.ndarray) -> tuple[float, float]:
+
+def decay_windows(
+    traces: np.ndarray, peaks: np.ndarray, rois: np.ndarray, frames_for_decay: int
+) -> tuple[np.ndarray, np.ndarray]:
     """
-    Fit an exponential curve to calculate the decay constant tau.
+    Cuts the decay windows [peak, peak + frames_for_decay) of all peaks out of
+    the (frames x ROIs) traces. Windows at the end of a trace are shorter, they
+    are padded and their lengths are returned.
+    """
+    peaks = np.asarray(peaks, dtype=np.int64)
+    rois = np.asarray(rois, dtype=np.int64)
+    n_frames = traces.shape[0]
+    lengths = np.clip(n_frames - peaks, 0, frames_for_decay)
+    frames = np.minimum(peaks[:, None] + np.arange(frames_for_decay), n_frames - 1)
+    return traces[frames, rois[:, None]], lengths
+
+
+def initial_estimate(
+    y: np.ndarray, mask: np.ndarray, t: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Closed-form estimate of y0 + A * exp(-invTau * t) for every window, based on
+    the integral equation y(t) - y(0) = -invTau * (integral of y - y0 * t), which
+    is linear in its coefficients (Jacquelin's method). Returns y0, A and invTau.
+    """
+    # cumulative trapezoidal integral of every window
+    s = np.zeros_like(y)
+    s[:, 1:] = np.cumsum((y[:, 1:] + y[:, :-1]) / 2, axis=1)
+    dy = (y - y[:, :1]) * mask
+    dt = t * mask
+    s = s * mask
+    # least squares of dy = a * dt + b * s, solved per window (2 x 2)
+    s_tt = np.sum(dt * dt, axis=1)
+    s_ts = np.sum(dt * s, axis=1)
+    s_ss = np.sum(s * s, axis=1)
+    s_ty = np.sum(dt * dy, axis=1)
+    s_sy = np.sum(s * dy, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        det = s_tt * s_ss - s_ts * s_ts
+        inv_tau = -(s_tt * s_sy - s_ts * s_ty) / det
+    inv_tau = np.where(np.isfinite(inv_tau), inv_tau, 0.0)
+    y0, amplitude = linear_parameters(y, mask, t, inv_tau)
+    return y0, amplitude, inv_tau
+
+
+def linear_parameters(
+    y: np.ndarray, mask: np.ndarray, t: np.ndarray, inv_tau: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns y0 and A of every window, which follow from linear least squares
+    with invTau fixed.
+    """
+    e = np.exp(np.clip(-inv_tau[:, None] * t, -MAX_EXPONENT, MAX_EXPONENT)) * mask
+    n = np.sum(mask, axis=1)
+    s_e = np.sum(e, axis=1)
+    s_ee = np.sum(e * e, axis=1)
+    s_y = np.sum(y * mask, axis=1)
+    s_ey = np.sum(e * y, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        det = n * s_ee - s_e * s_e
+        amplitude = (n * s_ey - s_e * s_y) / det
+        y0 = (s_y - amplitude * s_e) / n
+    degenerate = ~(np.isfinite(amplitude) & np.isfinite(y0))
+    amplitude[degenerate] = 0.0
+    y0[degenerate] = (s_y / np.maximum(n, 1))[degenerate]
+    return y0, amplitude
+
+
+def starting_points(y: np.ndarray, mask: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """
+    Returns the (starts x windows x 3) starting points of the refinement: the
+    closed-form estimate, (1, 1, 1) as used by curve_fit and y0 and A of
+    several fixed invTau.
+    """
+    starts = [np.stack(initial_estimate(y, mask, t), axis=1), np.ones((len(y), 3))]
+    for seed in START_INV_TAUS:
+        inv_tau = np.full(len(y), seed)
+        starts.append(
+            np.stack([*linear_parameters(y, mask, t, inv_tau), inv_tau], axis=1)
+        )
+    return np.stack(starts)
+
+
+def model_and_jacobian(
+    params: np.ndarray, t: np.ndarray, mask: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    e = np.exp(np.clip(-params[:, 2:3] * t, -MAX_EXPONENT, MAX_EXPONENT))
+    model = params[:, 0:1] + params[:, 1:2] * e
+    jacobian = (
+        np.stack([np.ones_like(e), e, -params[:, 1:2] * t * e], axis=2)
+        * mask[:, :, None]
+    )
+    return model, jacobian
+
+
+def levenberg_marquardt(
+    y: np.ndarray,
+    mask: np.ndarray,
+    t: np.ndarray,
+    params: np.ndarray,
+    max_iter: int = 200,
+    ftol: float = 1.5e-8,
+    xtol: float = 1.5e-8,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Levenberg-Marquardt refinement of all windows at once. Windows that have
+    converged or stalled are not updated any more. Returns the parameters, the
+    sum of squared residuals and whether each window converged within
+    max_iter iterations. A stalled window (no step decreases the cost, but the
+    convergence criteria aren't met) didn't converge.
     """
-    """def exp_decay(t, V0, tau):
-        return V0 * np.exp(-t / tau)"""
+    params = params.copy()
+    model, jacobian = model_and_jacobian(params, t, mask)
+    residuals = (y - model) * mask
+    cost = np.sum(residuals**2, axis=1)
+    damping = np.full(len(y), 1e-3)
+    converged = cost == 0
+    done = converged | ~np.isfinite(cost)
+    for _ in range(max_iter):
+        active = np.flatnonzero(~done)
+        if len(active) == 0:
+            break
+        jac = jacobian[active]
+        jtj = np.einsum("wli,wlj->wij", jac, jac)
+        gradient = np.einsum("wli,wl->wi", jac, residuals[active])
+        diagonal = np.einsum("wii->wi", jtj)
+        scaled = jtj + (damping[active, None] * (diagonal + 1e-12))[
+            :, :, None
+        ] * np.eye(3)
+        try:
+            step = np.linalg.solve(scaled, gradient[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            # singular for some window (e.g. A = 0)
+            step = np.einsum("wij,wj->wi", np.linalg.pinv(scaled), gradient)
+        new_params = params[active] + step
+        new_model, new_jacobian = model_and_jacobian(new_params, t, mask[active])
+        new_residuals = (y[active] - new_model) * mask[active]
+        with np.errstate(over="ignore", invalid="ignore"):
+            # diverging steps are rejected
+            new_cost = np.sum(new_residuals**2, axis=1)
+
+        improved = np.isfinite(new_cost) & (new_cost < cost[active])
+        accepted = active[improved]
+        # both the actual and the by the linearization predicted decrease are
+        # small (as in MINPACK), a heavily damped step decreases the cost only
+        # a little, but doesn't mean a minimum
+        jac_step = np.einsum("wli,wi->wl", jac[improved], step[improved])
+        predicted = np.sum(residuals[accepted] ** 2, axis=1) - np.sum(
+            (residuals[accepted] - jac_step) ** 2, axis=1
+        )
+        small_decrease = (
+            (cost[accepted] - new_cost[improved]) <= ftol * cost[accepted]
+        ) & (predicted <= ftol * cost[accepted])
+        # relative to the parameters scaled by the norms of the Jacobian's
+        # columns (as in MINPACK), y0 and A can be orders of magnitude larger
+        # than invTau
+        scale = np.sqrt(diagonal[improved])
+        small_step = np.linalg.norm(scale * step[improved], axis=1) <= xtol * (
+            np.linalg.norm(scale * new_params[improved], axis=1) + xtol
+        )
+        params[accepted] = new_params[improved]
+        jacobian[accepted] = new_jacobian[improved]
+        residuals[accepted] = new_residuals[improved]
+        cost[accepted] = new_cost[improved]
+        damping[accepted] /= 10
+        converged[accepted] = small_decrease | small_step
+        done[accepted] = converged[accepted]
+        rejected = active[~improved]
+        damping[rejected] *= 10
+        done[rejected] = damping[rejected] > MAX_DAMPING
+    return params, cost, converged
+
+
+def curve_fit_decay(y: np.ndarray) -> np.ndarray:
+    """
+    Fits a single window with scipy's curve_fit, used for the windows the
+    batched refinement didn't converge for or only found a degenerate fit.
+    NaN if the fit fails.
+    """
+    from scipy.optimize import OptimizeWarning, curve_fit
 
     def exp_decay(t, y0, A, invTau):
         return y0 + A * np.exp(-t * invTau)
 
-    if len(voltage) <= 1:
-        return (np.nan, np.nan)
-    frames = [i for i in range(len(voltage))]
     try:
-        params, _ = curve_fit(exp_decay, frames, voltage, maxfev=5000)
-    except:
+        with np.errstate(all="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", OptimizeWarning)
+            params, _ = curve_fit(
+                exp_decay, np.arange(len(y), dtype=np.float64), y, maxfev=5000
+            )
+    except (RuntimeError, ValueError):
+        return np.full(3, np.nan)
+    return params
+
+
+def refine_fits(
+    y: np.ndarray, mask: np.ndarray, t: np.ndarray, max_iter: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Refines all starting points of all windows in one batch and returns the
+    parameters with the lowest cost of every window and whether it converged.
+    """
+    starts = starting_points(y, mask, t)
+    n_starts, n_windows = starts.shape[:2]
+    params, cost, converged = levenberg_marquardt(
+        np.tile(y, (n_starts, 1)),
+        np.tile(mask, (n_starts, 1)),
+        t,
+        starts.reshape(-1, 3),
+        max_iter,
+    )
+    params = params.reshape(n_starts, n_windows, 3)
+    cost = np.where(converged, cost, np.inf).reshape(n_starts, n_windows)
+    best = np.argmin(cost, axis=0)
+    cost = cost[best, np.arange(n_windows)]
+    params = params[best, np.arange(n_windows)]
+    converged = np.isfinite(cost)
+    # the lowest cost of degenerate fits is approached by diverging parameters
+    # and depends on where the fit stops, curve_fit might get further
+    _, jacobian = model_and_jacobian(params[converged], t, mask[converged])
+    degenerate = np.zeros(n_windows, dtype=bool)
+    degenerate[converged] = (cost[converged] > 0) & (
+        np.linalg.cond(np.einsum("wli,wlj->wij", jacobian, jacobian)) > MAX_CONDITION
+    )
+    for i in np.flatnonzero(~converged | degenerate):
+        fallback = curve_fit_decay(y[i, mask[i] > 0])
+        model, _ = model_and_jacobian(fallback[None, :], t, mask[i : i + 1])
+        if np.sum(((y[i] - model[0]) * mask[i]) ** 2) < cost[i]:
+            params[i] = fallback
+            converged[i] = True
+    return params, converged
+
+
+def fit_decays(
+    windows: np.ndarray,
+    lengths: np.ndarray | None = None,
+    refine: bool = True,
+    max_iter: int = 200,
+) -> dict[str, np.ndarray]:
+    """
+    Fits y0 + A * exp(-invTau * t) to every row of windows (one decay per row).
+    Rows shorter than the window are padded, their lengths are given by lengths.
+
+    Unless refine is False, the closed-form estimate is refined with a
+    vectorized Levenberg-Marquardt from several starting points (see
+    starting_points) and the converged fit with the lowest cost is kept.
+    Windows without a converged or with a degenerate fit are fitted with
+    curve_fit as well. Returns y0, A, invTau, tau, the coefficient of
+    determination r_squared and whether the fit converged. Windows with less
+    than three frames can't be fitted and are NaN.
+    """
+    y = np.atleast_2d(np.asarray(windows, dtype=np.float64))
+    n_windows, window_size = y.shape
+    if lengths is None:
+        lengths = np.full(n_windows, window_size)
+    t = np.arange(window_size, dtype=np.float64)
+    mask = (t < np.asarray(lengths)[:, None]).astype(np.float64)
+    # frames outside the window must not propagate NaN/inf
+    y = np.where(mask > 0, y, 0.0)
+    valid = (np.asarray(lengths) >= 3) & np.all(np.isfinite(y), axis=1)
+    params = np.full((n_windows, 3), np.nan)
+    converged = np.zeros(n_windows, dtype=bool)
+    if np.any(valid):
+        y_valid, mask_valid = y[valid], mask[valid]
+        if refine:
+            params[valid], converged[valid] = refine_fits(
+                y_valid, mask_valid, t, max_iter
+            )
+        else:
+            params[valid] = np.stack(initial_estimate(y_valid, mask_valid, t), axis=1)
+            converged[valid] = True
+    model, _ = model_and_jacobian(params, t, mask)
+    n = np.maximum(np.sum(mask, axis=1), 1)
+    mean = np.sum(y * mask, axis=1) / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ss_res = np.sum(((y - model) * mask) ** 2, axis=1)
+        ss_tot = np.sum(((y - mean[:, None]) * mask) ** 2, axis=1)
+        r_squared = 1 - ss_res / ss_tot
+        tau = 1 / params[:, 2]
+    converged &= np.all(np.isfinite(params), axis=1)
+    return {
+        "y0": params[:, 0],
+        "A": params[:, 1],
+        "inv_tau": params[:, 2],
+        "tau": tau,
+        "r_squared": r_squared,
+        "converged": converged,
+    }
+
+
+def compute_tau(voltage: np.ndarray) -> tuple[float, float]:
+    """
+    Fit an exponential curve to calculate the decay constant tau.
+    """
+    fit = fit_decays(np.asarray(voltage, dtype=np.float64)[None, :])
+    if not fit["converged"][0]:
         return (np.nan, np.nan)
-    inv_tau = params[2]
-    tau = 1 / inv_tau
-    return (inv_tau, tau)
+    return (fit["inv_tau"][0], fit["tau"][0])
@@ -1,28 +1,24 @@
+import numpy as np
 import pandas as pd
 
+from .stimulation_assignment import StimulationAssignment
+
 
 def failure_rate(
     peaks: pd.DataFrame,
     stimulation_timepoints: list[int],
     patience: int,
     columns: list[str],
+    assignment: StimulationAssignment | None = None,
 ) -> pd.DataFrame:
+    if assignment is None:
+        assignment = StimulationAssignment(peaks, stimulation_timepoints, patience)
+    rates = np.sum(assignment.responded(), axis=1) / len(stimulation_timepoints)
+    roi_rates = dict(zip(assignment.rois, rates))
     result = []
     for roi in columns:
-        if roi not in peaks["ROI#"].tolist():
+        if roi not in roi_rates:
             result.append([roi, 0, True])
             continue
-        responses = 0
-        for stimulation in stimulation_timepoints:
-            if (
-                peaks[
-                    (peaks["Frame"] >= stimulation)
-                    & (peaks["Frame"] <= stimulation + patience)
-                    & (peaks["ROI#"] == roi)
-                ].shape[0]
-                > 0
-            ):
-                responses += 1
-        rate = responses / len(stimulation_timepoints)
-        result.append([roi, rate, False])
+        result.append([roi, roi_rates[roi], False])
     return pd.DataFrame(result, columns=["ROI", "response rate", "discarded"])
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+def baseline_medians(
+    traces: np.ndarray, peaks: np.ndarray, rois: np.ndarray, baseline_frames: int
+) -> np.ndarray:
+    """
+    Median of the baseline_frames frames before every peak. Peaks closer to
+    the start of the trace use all frames before them (NaN for frame 0).
+    """
+    medians = np.empty(len(peaks), dtype=np.float64)
+    full = peaks >= baseline_frames
+    if np.any(full):
+        # (peaks x baseline_frames) index matrix of the full windows
+        frames = peaks[full, None] + np.arange(-baseline_frames, 0)
+        medians[full] = np.median(traces[frames, rois[full, None]], axis=1)
+    for i in np.flatnonzero(~full):
+        window = traces[: peaks[i], rois[i]]
+        medians[i] = np.median(window) if len(window) > 0 else np.nan
+    return medians
+
+
+def evoked_responses(
+    peaks: np.ndarray, stimulation: list[int], patience: int
+) -> np.ndarray:
+    """
+    Whether every peak lies within [stim, stim + patience] of any stimulation.
+    """
+    stimulation = np.sort(np.asarray(stimulation, dtype=np.int64))
+    if len(stimulation) == 0:
+        return np.zeros(len(peaks), dtype=bool)
+    # latest stimulation at or before each peak
+    last_stim = np.searchsorted(stimulation, peaks, side="right") - 1
+    return (last_stim >= 0) & (
+        peaks <= stimulation[np.maximum(last_stim, 0)] + patience
+    )
+
+
+def peak_metrics(
+    intensity: np.ndarray,
+    norm_intensity: np.ndarray,
+    peaks: np.ndarray,
+    stimulation: list[int],
+    patience: int,
+    rois: np.ndarray | None = None,
+    baseline_frames: int = 15,
+) -> dict[str, np.ndarray]:
+    """
+    Computes amplitude, relative height (amplitude - median of the preceding
+    baseline_frames), the same for the normalized trace and whether the
+    response was evoked by a stimulation for all peaks at once.
+
+    intensity and norm_intensity are either a single trace or all traces of a
+    file as (frames x ROIs) array, then rois holds the ROI index of each peak.
+    """
+    peaks = np.asarray(peaks, dtype=np.int64)
+    if intensity.ndim == 1:
+        intensity = intensity[:, None]
+        norm_intensity = norm_intensity[:, None]
+        rois = np.zeros(len(peaks), dtype=np.int64)
+    else:
+        rois = np.asarray(rois, dtype=np.int64)
+    amplitude = intensity[peaks, rois]
+    norm_amplitude = norm_intensity[peaks, rois]
+    return {
+        "amplitude": amplitude,
+        "relative_height": amplitude
+        - baseline_medians(intensity, peaks, rois, baseline_frames),
+        "norm_amplitude": norm_amplitude,
+        "norm_rel_amplitude": norm_amplitude
+        - baseline_medians(norm_intensity, peaks, rois, baseline_frames),
+        "evoked": evoked_responses(peaks, stimulation, patience),
+    }
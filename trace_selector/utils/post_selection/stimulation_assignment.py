@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+
+class StimulationAssignment:
+    """
+    Assigns every response to the stimulations it lies within (stim <= frame <=
+    stim + patience) in a single pass. Overlapping stimulation windows assign a
+    response to several stimulations.
+
+    pairs_response and pairs_stimulation hold the indices of all (response,
+    stimulation) pairs, stimulations are indexed in the order they are given.
+    ROIs are indexed by their first appearance in the responses.
+    """
+
+    def __init__(
+        self, responses: pd.DataFrame, stimulations: list[int], patience: int
+    ) -> None:
+        self.stimulations = list(stimulations)
+        self.roi_codes, self.rois = pd.factorize(responses["ROI#"])
+        frames = responses["Frame"].to_numpy()
+        stims = np.asarray(self.stimulations, dtype=np.int64)
+        order = np.argsort(stims, kind="stable")
+        sorted_stims = stims[order]
+        # stimulations [lo, hi) of the sorted stimulations contain the frame
+        lo = np.searchsorted(sorted_stims + patience, frames, side="left")
+        hi = np.searchsorted(sorted_stims, frames, side="right")
+        counts = np.maximum(hi - lo, 0)
+        self.pairs_response = np.repeat(np.arange(len(frames)), counts)
+        offsets = np.arange(np.sum(counts)) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        self.pairs_stimulation = order[np.repeat(lo, counts) + offsets]
+        # (ROI x stimulation) cell of every pair
+        self.pairs_cell = (
+            self.roi_codes[self.pairs_response] * len(self.stimulations)
+            + self.pairs_stimulation
+        )
+
+    @property
+    def n_cells(self) -> int:
+        return len(self.rois) * len(self.stimulations)
+
+    def responded(self) -> np.ndarray:
+        """
+        (ROI x stimulation) array, whether the ROI responded to the stimulation.
+        """
+        responded = np.zeros(self.n_cells, dtype=bool)
+        responded[self.pairs_cell] = True
+        return responded.reshape(len(self.rois), len(self.stimulations))
+
+    def cell_max(self, values: np.ndarray) -> np.ndarray:
+        """
+        (ROI x stimulation) array of the maximum of values (one per response)
+        of all responses to a stimulation, ignoring NaN. NaN if there is none.
+        """
+        maxima = pd.Series(values[self.pairs_response]).groupby(self.pairs_cell).max()
+        result = np.full(self.n_cells, np.nan)
+        result[maxima.index.to_numpy()] = maxima.to_numpy(dtype=np.float64)
+        return result.reshape(len(self.rois), len(self.stimulations))
+
+    def cell_argmax(self, values: np.ndarray) -> np.ndarray:
+        """
+        Index of the response with the maximum value per (ROI x stimulation) cell
+        (-1 if there is none). On ties the last response wins. A NaN value
+        replaces the current maximum and is replaced by the next response, as
+        in a sequential scan with `if value < maximum: continue`.
+        """
+        best = np.full(self.n_cells, -1, dtype=np.int64)
+        if len(self.pairs_response) == 0:
+            return best
+        pair_values = values[self.pairs_response]
+        # sorted by cell, then value, then response: the last entry of a cell wins
+        order = np.lexsort((self.pairs_response, pair_values, self.pairs_cell))
+        cells = self.pairs_cell[order]
+        last = np.append(cells[1:] != cells[:-1], True)
+        best[cells[last]] = self.pairs_response[order][last]
+        nan_cells = np.unique(self.pairs_cell[np.isnan(pair_values)])
+        for cell in nan_cells:
+            maximum = -np.inf
+            for response in self.pairs_response[self.pairs_cell == cell]:
+                if values[response] < maximum:
+                    continue
+                maximum = values[response]
+                best[cell] = response
+        return best
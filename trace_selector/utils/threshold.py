@@ -19,3 +19,31 @@ def compute_threshold(
     std_ = np.std(vals)
     median_ = np.median(vals)
     return median_ + threshold_mult * std_
+
+
+def compute_thresholds(
+    stim_used: bool,
+    traces: np.ndarray,
+    threshold_mult: float,
+    threshold_start: int = 0,
+    threshold_stop: int = 50,
+    block_size: int = 64,
+) -> np.ndarray:
+    """
+    compute_threshold for all traces of a (frames x ROIs) array at once.
+    The statistics are reduced over contiguous rows of the transposed traces,
+    which gives the exact same values as the computation per trace. ROIs are
+    processed in blocks to bound the memory of the median.
+    """
+    rows = traces.T
+    thresholds = np.empty(rows.shape[0], dtype=np.float64)
+    for first in range(0, rows.shape[0], block_size):
+        block = np.ascontiguousarray(rows[first : first + block_size])
+        if stim_used > 0:
+            block = block[:, threshold_start:threshold_stop]
+            center = np.mean(block, axis=1)
+        else:
+            center = np.median(block, axis=1)
+        std_ = np.std(block, axis=1)
+        thresholds[first : first + block_size] = center + threshold_mult * std_
+    return thresholds
@@ -1,13 +1,25 @@
 import pandas as pd
-from pandas.api.types import is_string_dtype
 import numpy as np
 import os
+import itertools
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable
 from PyQt6.QtWidgets import QMessageBox
 from io import StringIO
 
-from .post_selection.decay_compute import compute_tau
+from ..detection.nms import stimulation_nms
+from .post_selection.decay_compute import decay_windows, fit_decays
 from .post_selection.failure_rate import failure_rate
+from .post_selection.peak_metrics import peak_metrics
+from .post_selection.stimulation_assignment import StimulationAssignment
 from .normalization import sliding_window_normalization
+from .file_cache import FileCache
+from .csv_reader import read_csv_chunked, split_columns
+from .aggregate import AggregateStore, aggregate_folder
+from .trace_store import TraceStore, release_traces
+from .output_writer import OutputWriter, write_atomic, write_table
+from .journal import SessionJournal
+from .hash import sha256_hash
 from .export import (
     create_stimulation_df,
     create_peak_df,
@@ -15,16 +27,192 @@ from .export import (
     create_fraction_first_pulse_df,
     create_settings_df,
     write_excel_output,
-    normalized_trace_df,
 )
 
 
+def reader_name(filepath: str) -> str:
+    if filepath.endswith(".txt") or filepath.endswith(".csv"):
+        return "csv"
+    return "excel"
+
+
+def read_input_file(
+    filepath: str,
+    filename: str,
+    meta_columns: list[str],
+    progress: Callable[[int], None] | None = None,
+) -> tuple[np.ndarray, list[str], dict[str, str], pd.DataFrame]:
+    """
+    Parses an input file. Returns the ROI traces as (frames x ROIs) float64
+    array (column-major), the ROI column names, the original dtypes of all ROI
+    columns that are not float64 and the meta columns.
+
+    .csv/.txt files are read in chunks, progress is called with the percentage
+    of rows read.
+    """
+    if filename.endswith(".virtual"):
+        df = pd.read_csv(StringIO(filepath), sep=",")
+    elif reader_name(filepath) == "csv":
+        try:
+            return read_csv_chunked(filepath, meta_columns, progress)
+        except ValueError:
+            # text in a column that looked numeric in the first chunk
+            df = pd.read_csv(filepath, sep=",")
+    else:
+        df = pd.read_excel(filepath)
+    # format all columns to str
+    df.columns = [str(col) for col in df.columns]
+    meta, columns = split_columns(df, meta_columns)
+    traces = np.asfortranarray(df[columns].to_numpy(dtype=np.float64))
+    dtypes = {
+        col: str(dtype)
+        for col, dtype in df[columns].dtypes.items()
+        if dtype != np.float64
+    }
+    return traces, columns, dtypes, df[meta]
+
+
+def load_file(
+    filepath: str,
+    filename: str,
+    meta_columns: list[str],
+    file_cache: FileCache | None = None,
+    progress: Callable[[int], None] | None = None,
+    compute_hash: bool = False,
+) -> tuple[TraceStore, str | None]:
+    """
+    Parses an input file (or takes it from the file cache). Returns the traces
+    and the hash of the file, which is only computed if the cache is used or
+    compute_hash is set. Doesn't touch any state, so files can be loaded in a
+    background thread.
+    """
+    file_hash = None
+    cache_key = None
+    cached = None
+    if (file_cache is not None or compute_hash) and not filename.endswith(".virtual"):
+        file_hash = sha256_hash(filepath, buffersize=1024 * 1024)
+    if file_cache is not None and file_hash is not None:
+        cache_key = file_cache.key(
+            file_hash,
+            {"reader": reader_name(filepath), "meta_columns": sorted(meta_columns)},
+        )
+        cached = file_cache.load(cache_key)
+    if cached is not None:
+        traces, columns, dtypes, meta_df = cached
+    else:
+        traces, columns, dtypes, meta_df = read_input_file(
+            filepath, filename, meta_columns, progress
+        )
+        if cache_key is not None:
+            try:
+                cached_traces = file_cache.store(
+                    cache_key, traces, columns, dtypes, meta_df, filename
+                )
+                release_traces(traces)
+                traces = cached_traces
+            except OSError as e:
+                print(f"Could not cache {filename}: {e}")
+    return TraceStore(traces, columns, dtypes, meta_df), file_hash
+
+
+def write_analysis(
+    selected_peaks: list[dict],
+    columns: list[str],
+    stimulation_timepoints: list[int],
+    settings: dict,
+    output_path: str,
+    aggregate_key: str,
+    filename: str,
+) -> None:
+    """
+    Creates the analysis tables of the kept responses, writes them to the
+    analysis workbook and adds them to the aggregated results (as the file
+    aggregate_key) if enabled.
+    """
+    ppr = settings["compute_ppr"]
+    patience = settings["stim_frames_patience"]
+    analysis_dfs = []
+    analysis_names = []
+    settings_df = create_settings_df(settings)
+    analysis_dfs.append(settings_df)
+    analysis_names.append("parameters")
+    if len(selected_peaks) > 0:
+        peak_df = create_peak_df(selected_peaks)
+        analysis_dfs.append(peak_df)
+        analysis_names.append("responses")
+        # responses are assigned to the stimulations once for all tables
+        assignment = StimulationAssignment(peak_df, stimulation_timepoints, patience)
+        stimulation_df = create_stimulation_df(
+            stimulation_timepoints, patience, peak_df, assignment
+        )
+        analysis_dfs.append(stimulation_df)
+        analysis_names.append("stimulations")
+        if ppr:
+            ppr_df = create_ppr_df(
+                peak_df, stimulation_timepoints, patience, assignment
+            )
+            analysis_dfs.append(ppr_df)
+            analysis_names.append("PPR")
+        if len(stimulation_timepoints) > 0:
+            # failure rate on a synaptic level
+            failure_df = failure_rate(
+                peak_df, stimulation_timepoints, patience, columns, assignment
+            )
+            analysis_dfs.append(failure_df)
+            analysis_names.append("failure_analysis")
+            # fraction responding to the first pulse
+            responses_first_pulse_df = create_fraction_first_pulse_df(
+                peak_df, stimulation_timepoints, patience, assignment
+            )
+            analysis_dfs.append(responses_first_pulse_df)
+            analysis_names.append("responses_first_pulse")
+    write_atomic(
+        output_path,
+        lambda tmp_path: write_excel_output(analysis_dfs, analysis_names, tmp_path),
+    )
+    if settings["aggregate_results"]:
+        AggregateStore(aggregate_folder(settings)).append(
+            aggregate_key, filename, dict(zip(analysis_names, analysis_dfs))
+        )
+
+
+def output_extension(filename: str, settings: dict) -> str:
+    """
+    Extension of the keep and discard files of an input file.
+    """
+    if (
+        settings["export_xlsx"]
+        or filename.endswith(".xlsx")
+        or filename.endswith(".xls")
+    ):
+        return ".xlsx"
+    return ".csv"
+
+
+def unique_output_prefix(file_prefix: str, taken: Callable[[str], bool]) -> str:
+    """
+    Returns file_prefix or, if taken, the first of file_prefix(1),
+    file_prefix(2), ... that isn't.
+    """
+    output_prefix = file_prefix
+    i = 1
+    while taken(output_prefix):
+        output_prefix = f"{file_prefix}({i})"
+        i += 1
+    return output_prefix
+
+
+# ids of opened files without hash
+file_ids = itertools.count()
+
+
 class SynapseResponseData:
     def __init__(self) -> None:
         self.filename = ""
-        self.df = pd.DataFrame()
-        self.meta_columns = []
+        self.store = TraceStore(np.empty((0, 0), dtype=np.float64), [])
         self.columns = []
+        self.file_hash = None
+        self.file_id = None
         self.keep_data = []
         self.discard_data = []
         self.idx = 0
@@ -37,6 +225,15 @@ class SynapseResponseData:
         self.time = np.empty(0, dtype=np.float64)
         self.automatic_peaks = []
         self.file_opened = False
+        # normalized traces of all ROI columns (frames x columns, column-major)
+        self.column_index = {}
+        self.norm_traces = np.empty((0, 0), dtype=np.float64)
+        self.norm_traces_future: Future = None
+        self.normalization_settings = None
+        self.norm_first_idx = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # records the decisions on the file if set
+        self.journal: SessionJournal | None = None
 
     def open_file(
         self,
@@ -45,23 +242,41 @@ class SynapseResponseData:
         meta_columns: list[str],
         normalization_use_median: bool,
         normalization_sliding_window: int,
+        file_cache: FileCache | None = None,
+        progress: Callable[[int], None] | None = None,
+        compute_hash: bool = False,
     ):
+        store, file_hash = load_file(
+            filepath, filename, meta_columns, file_cache, progress, compute_hash
+        )
+        self.set_file(
+            filename,
+            store,
+            file_hash,
+            normalization_use_median,
+            normalization_sliding_window,
+        )
+
+    def set_file(
+        self,
+        filename: str,
+        store: TraceStore,
+        file_hash: str | None,
+        normalization_use_median: bool,
+        normalization_sliding_window: int,
+    ) -> None:
+        """
+        Starts working on a file parsed by load_file.
+        """
         self.filename = filename
-        if filename.endswith(".virtual"):
-            self.df = pd.read_csv(StringIO(filepath), sep=",")
-        elif filepath.endswith(".txt") or filepath.endswith(".csv"):
-            self.df = pd.read_csv(filepath, sep=",")
-        else:
-            self.df = pd.read_excel(filepath)
-        # format all columns to str
-        all_columns = [str(col) for col in self.df.columns]
-        self.df.columns = all_columns
-        self.meta_columns = [
-            col
-            for col in all_columns
-            if col in meta_columns or is_string_dtype(self.df[col])
-        ]
-        self.columns = [col for col in all_columns if col not in self.meta_columns]
+        self.file_hash = file_hash
+        # identifies the traces in caches, files without hash are never shared
+        self.file_id = (
+            file_hash if file_hash is not None else f"{filename}#{next(file_ids)}"
+        )
+        self.journal = None
+        self.store = store
+        self.columns = self.store.columns
 
         self.keep_data = []
         self.discard_data = []
@@ -70,9 +285,11 @@ class SynapseResponseData:
         self.peaks = []
         self.manual_peaks = []
         self.selected_peaks = []
-        self.intensity = self.df[self.columns[self.idx]].to_numpy(dtype=np.float64)
-        self.norm_intensity = sliding_window_normalization(
-            self.df[self.columns[self.idx]].to_numpy(),
+        self.column_index = self.store.column_index
+        self.normalize_traces(normalization_use_median, normalization_sliding_window)
+        self.intensity = self.store.column(self.columns[self.idx])
+        self.norm_intensity = self.get_norm_trace(
+            self.columns[self.idx],
             normalization_use_median,
             normalization_sliding_window,
         )
@@ -80,6 +297,77 @@ class SynapseResponseData:
         self.automatic_peaks = []
         self.file_opened = True
 
+    def normalize_traces(
+        self, normalization_use_median: bool, normalization_sliding_window: int
+    ) -> None:
+        """
+        Normalizes all ROI columns of the file once. The current trace is
+        normalized right away, all remaining traces in a background worker.
+        """
+        self.normalization_settings = (
+            normalization_use_median,
+            normalization_sliding_window,
+        )
+        traces = self.store.traces
+        self.norm_traces = np.empty(traces.shape, dtype=np.float64, order="F")
+        self.norm_first_idx = self.idx
+        self.norm_traces[:, self.idx] = sliding_window_normalization(
+            traces[:, self.idx],
+            normalization_use_median,
+            normalization_sliding_window,
+        )
+        remaining = [i for i in range(len(self.columns)) if i != self.idx]
+        norm_traces = self.norm_traces
+
+        def normalize_remaining() -> None:
+            norm_traces[:, remaining] = sliding_window_normalization(
+                traces[:, remaining],
+                normalization_use_median,
+                normalization_sliding_window,
+            )
+
+        self.norm_traces_future = self.executor.submit(normalize_remaining)
+
+    def get_norm_traces(
+        self, normalization_use_median: bool, normalization_sliding_window: int
+    ) -> np.ndarray:
+        """
+        Returns the normalized traces of all ROI columns as (frames x columns)
+        array. Waits for the background normalization if it is still running and
+        renormalizes the file if the normalization settings changed.
+        """
+        if self.normalization_settings != (
+            normalization_use_median,
+            normalization_sliding_window,
+        ):
+            self.normalize_traces(
+                normalization_use_median, normalization_sliding_window
+            )
+        self.norm_traces_future.result()
+        return self.norm_traces
+
+    def get_norm_trace(
+        self,
+        column: str,
+        normalization_use_median: bool,
+        normalization_sliding_window: int,
+    ) -> np.ndarray:
+        """
+        Returns the normalized trace of a single ROI column.
+        """
+        if self.normalization_settings != (
+            normalization_use_median,
+            normalization_sliding_window,
+        ):
+            self.normalize_traces(
+                normalization_use_median, normalization_sliding_window
+            )
+        col_idx = self.column_index[column]
+        # the first trace is available before the background worker finished
+        if col_idx != self.norm_first_idx:
+            self.norm_traces_future.result()
+        return self.norm_traces[:, col_idx]
+
     def __len__(self) -> int:
         """
         returns number of traces to look at as length.
@@ -94,119 +382,127 @@ class SynapseResponseData:
         percentage = np.round(((self.idx + 1) / len(self)) * 100, 2)
         return f"{self.idx+1}/{len(self)} ({np.round(percentage,2)}%)"
 
-    def save(self, stimulation_timepoints: list[int], settings: dict, parent) -> None:
+    def save(
+        self,
+        stimulation_timepoints: list[int],
+        settings: dict,
+        parent,
+        writer: OutputWriter | None = None,
+        output_prefix: str | None = None,
+    ) -> Future | None:
         """
         Save the sorted trace to the respective keep and discard file and if peak
         detection was used also save the result table for the keep responses.
+
+        With a writer, the files are written in its background queue and the
+        future of the save is returned. Otherwise they are written right away.
+
+        The output files are named after the input file, numbered if the
+        output exists already. output_prefix overrides the name, it has to be
+        unique already (e.g. reserved by the batch mode for all its files).
         """
         keep_path = os.path.join(settings["output_filepath"], "keep_folder")
         discard_path = os.path.join(settings["output_filepath"], "discard_folder")
-        export_xlsx = settings["export_xlsx"]
-        ppr = settings["compute_ppr"]
-        patience = settings["stim_frames_patience"]
         os.makedirs(keep_path, exist_ok=True)
         os.makedirs(discard_path, exist_ok=True)
-        keep_df = self.df[self.meta_columns + self.keep_data]
-        discard_df = self.df[self.meta_columns + self.discard_data]
-        file_prefix = ".".join(self.filename.split(".")[:-1])
-        if settings["export_normalized_traces"]:
-            normalized_keep_df = normalized_trace_df(
-                keep_df[self.keep_data],
-                settings["normalization_use_median"],
-                settings["normalization_sliding_window_size"],
-            )
-            # instert meta_columns
-            for i, col in enumerate(self.meta_columns):
-                normalized_keep_df.insert(i, col, self.df[col])
-        if (
-            export_xlsx
-            or self.filename.endswith(".xlsx")
-            or self.filename.endswith(".xls")
-        ):
-            output_name = f"{file_prefix}.xlsx"
-            output_path = os.path.join(keep_path, output_name)
-            if os.path.exists(output_path):
-                i = 1
-                original_output_name = output_name
-                while os.path.exists(output_path):
-                    tmp_file_prefix = f"{file_prefix}({i})"
-                    output_name = f"{tmp_file_prefix}.xlsx"
-                    output_path = os.path.join(keep_path, output_name)
-                    i += 1
-                file_prefix = tmp_file_prefix
-                msg = QMessageBox(parent)
-                msg.setIcon(QMessageBox.Icon.Warning)
-                msg.setWindowTitle("Warning")
-                msg.setText(
-                    f"The file {original_output_name} alreads exists in {keep_path}. Saved as {output_name}"
-                )
-                msg.exec()
-            keep_df.to_excel(output_path, index=False)
-            if settings["export_normalized_traces"]:
-                normalized_keep_df.to_excel(
-                    os.path.join(keep_path, f"{file_prefix}_normalized.xlsx"),
-                    index=False,
-                )
-            discard_df.to_excel(os.path.join(discard_path, output_name), index=False)
+        wait = writer is None
+        if wait:
+            writer = OutputWriter()
+        extension = output_extension(self.filename, settings)
+        input_prefix = ".".join(self.filename.split(".")[:-1])
+        # the aggregated tables of the file are replaced, however it is named
+        aggregate_key = self.file_hash if self.file_hash is not None else input_prefix
+        if output_prefix is not None:
+            file_prefix = output_prefix
         else:
-            output_name = f"{file_prefix}.csv"
-            output_path = os.path.join(keep_path, output_name)
-            if os.path.exists(output_path):
-                i = 1
-                original_output_name = output_name
-                while os.path.exists(output_path):
-                    tmp_file_prefix = f"{file_prefix}({i})"
-                    output_name = f"{tmp_file_prefix}.csv"
-                    output_path = os.path.join(keep_path, output_name)
-                    i += 1
-                file_prefix = tmp_file_prefix
-                msg = QMessageBox(parent)
-                msg.setIcon(QMessageBox.Icon.Warning)
-                msg.setWindowTitle("Warning")
-                msg.setText(
-                    f"The file {original_output_name} alreads exists in {keep_path}. Saved as {output_name}"
-                )
-                msg.exec()
-            keep_df.to_csv(output_path, index=False)
-            if settings["export_normalized_traces"]:
-                normalized_keep_df.to_csv(
-                    os.path.join(keep_path, f"{file_prefix}_normalized.csv"),
-                    index=False,
-                )
-            discard_df.to_csv(os.path.join(discard_path, output_name), index=False)
-        analysis_dfs = []
-        analysis_names = []
-        settings_df = create_settings_df(settings)
-        analysis_dfs.append(settings_df)
-        analysis_names.append("parameters")
-        if len(self.selected_peaks) > 0:
-            peak_df = create_peak_df(self.selected_peaks)
-            analysis_dfs.append(peak_df)
-            analysis_names.append("responses")
-            stimulation_df = create_stimulation_df(
-                stimulation_timepoints, patience, peak_df
+            file_prefix = input_prefix
+            original_output_name = f"{file_prefix}{extension}"
+            file_prefix = unique_output_prefix(
+                file_prefix,
+                lambda prefix: writer.exists(
+                    os.path.join(keep_path, f"{prefix}{extension}")
+                ),
             )
-            analysis_dfs.append(stimulation_df)
-            analysis_names.append("stimulations")
-            if ppr:
-                ppr_df = create_ppr_df(peak_df, stimulation_timepoints, patience)
-                analysis_dfs.append(ppr_df)
-                analysis_names.append("PPR")
-            if len(stimulation_timepoints) > 0:
-                # failure rate on a synaptic level
-                failure_df = failure_rate(peak_df, stimulation_timepoints, patience, self.columns)
-                analysis_dfs.append(failure_df)
-                analysis_names.append("failure_analysis")
-                # fraction responding to the first pulse
-                responses_first_pulse_df = create_fraction_first_pulse_df(
-                    peak_df, stimulation_timepoints, patience
+            if f"{file_prefix}{extension}" != original_output_name:
+                self.warn(
+                    f"The file {original_output_name} alreads exists in {keep_path}. Saved as {file_prefix}{extension}",
+                    parent,
                 )
-                analysis_dfs.append(responses_first_pulse_df)
-                analysis_names.append("responses_first_pulse")
-        output_name = f"{file_prefix}_analysis.xlsx"
-        analysis_outputpath = os.path.join(keep_path, output_name)
-        if len(analysis_dfs) > 0:
-            write_excel_output(analysis_dfs, analysis_names, analysis_outputpath)
+        output_name = f"{file_prefix}{extension}"
+        output_path = os.path.join(keep_path, output_name)
+
+        # the tables are created by the writer, this file may be closed by then
+        store = self.store
+        keep_data = list(self.keep_data)
+        discard_data = list(self.discard_data)
+        selected_peaks = list(self.selected_peaks)
+        columns = list(self.columns)
+        filename = self.filename
+        analysis_settings = dict(settings)
+        tasks = [
+            (
+                output_path,
+                lambda: write_table(store.to_frame(keep_data), output_path),
+            ),
+            (
+                os.path.join(discard_path, output_name),
+                lambda: write_table(
+                    store.to_frame(discard_data),
+                    os.path.join(discard_path, output_name),
+                ),
+            ),
+        ]
+        if settings["export_normalized_traces"]:
+            normalized_path = os.path.join(
+                keep_path, f"{file_prefix}_normalized{extension}"
+            )
+            use_median = settings["normalization_use_median"]
+            window_size = settings["normalization_sliding_window_size"]
+            if self.normalization_settings != (use_median, window_size):
+                self.normalize_traces(use_median, window_size)
+            norm_traces = self.norm_traces
+            norm_traces_future = self.norm_traces_future
+
+            def write_normalized() -> None:
+                norm_traces_future.result()
+                write_table(store.to_frame(keep_data, norm_traces), normalized_path)
+
+            tasks.append((normalized_path, write_normalized))
+        analysis_outputpath = os.path.join(keep_path, f"{file_prefix}_analysis.xlsx")
+        tasks.append(
+            (
+                analysis_outputpath,
+                lambda: write_analysis(
+                    selected_peaks,
+                    columns,
+                    list(stimulation_timepoints),
+                    analysis_settings,
+                    analysis_outputpath,
+                    aggregate_key,
+                    filename,
+                ),
+            )
+        )
+        future = writer.submit(tasks)
+        if wait:
+            writer.close()
+            future.result()
+            return None
+        return future
+
+    def warn(self, text: str, parent) -> None:
+        """
+        Shows a warning to the user or prints it, if no parent window exists
+        (headless mode).
+        """
+        if parent is None:
+            print(f"Warning: {text}")
+            return
+        msg = QMessageBox(parent)
+        msg.setIcon(QMessageBox.Icon.Warning)
+        msg.setWindowTitle("Warning")
+        msg.setText(text)
+        msg.exec()
 
     def next(
         self, normalization_use_median: bool, normalization_sliding_window: int
@@ -217,9 +513,9 @@ class SynapseResponseData:
         self.idx += 1
         self.peaks = []
         self.manual_peaks = []
-        self.intensity = self.df[self.columns[self.idx]].to_numpy()
-        self.norm_intensity = sliding_window_normalization(
-            self.df[self.columns[self.idx]].to_numpy(),
+        self.intensity = self.store.column(self.columns[self.idx])
+        self.norm_intensity = self.get_norm_trace(
+            self.columns[self.idx],
             normalization_use_median,
             normalization_sliding_window,
         )
@@ -232,6 +528,8 @@ class SynapseResponseData:
         """
         if self.idx == 0:
             return False
+        if self.journal is not None:
+            self.journal.append({"action": "back", "idx": self.idx})
         if self.last[-1] == "keep":
             _ = self.keep_data.pop()
             _ = self.last.pop()
@@ -261,41 +559,66 @@ class SynapseResponseData:
         """
         self.keep_data.append(self.columns[self.idx])
         self.last.append("keep")
-        if not select_responses:
-            return
-        # -------------------------- save selected responses ------------------------- #
-        for peak_tp in [peak for peak, selected in peak_dict.items() if selected]:
-            amplitude = self.intensity[peak_tp]
-            baseline = np.median(self.intensity[max(0, peak_tp - 15) : peak_tp])
-            relative_height = amplitude - baseline
-            norm_amplitude = self.norm_intensity[peak_tp]
-            norm_baseline = np.median(
-                self.norm_intensity[max(0, peak_tp - 15) : peak_tp]
+        n_selected = len(self.selected_peaks)
+        if select_responses:
+            # ------------------------ save selected responses ----------------------- #
+            peaks = [peak for peak, selected in peak_dict.items() if selected]
+            self.add_responses(
+                [self.idx] * len(peaks),
+                peaks,
+                [peak in self.automatic_peaks for peak in peaks],
+                frames_for_decay,
+                stimulation,
+                patience,
             )
-            norm_rel_amplitude = norm_amplitude - norm_baseline
-            pos_after_peak = min(peak_tp + frames_for_decay, len(self.intensity - 1))
-            inv_tau, tau = compute_tau(self.intensity[peak_tp:pos_after_peak])
-            automatic_detected = True if peak_tp in self.automatic_peaks else False
-            responded_to_stim = np.array(
-                [
-                    True if stim <= peak_tp and peak_tp <= stim + patience else False
-                    for stim in stimulation
-                ]
+        if self.journal is not None:
+            self.journal.append(
+                {
+                    "action": "keep",
+                    "idx": self.idx,
+                    "responses": self.selected_peaks[n_selected:],
+                }
             )
-            evoked = np.any(responded_to_stim)
+
+    def add_responses(
+        self,
+        rois: list[int],
+        peaks: list[int],
+        automatic: list[bool],
+        frames_for_decay: int,
+        stimulation: list[int],
+        patience: int,
+    ) -> None:
+        """
+        Computes the metrics of responses of any ROIs (indices of columns) in
+        one go and appends them to the selected_peaks.
+        """
+        if len(peaks) == 0:
+            return
+        # the normalization of other traces might still be running
+        if any(roi != self.norm_first_idx for roi in rois):
+            self.norm_traces_future.result()
+        traces = self.store.traces
+        metrics = peak_metrics(
+            traces, self.norm_traces, peaks, stimulation, patience, rois
+        )
+        decay = fit_decays(*decay_windows(traces, peaks, rois, frames_for_decay))
+        inv_taus = np.where(decay["converged"], decay["inv_tau"], np.nan)
+        taus = np.where(decay["converged"], decay["tau"], np.nan)
+        for i, (roi, peak_tp) in enumerate(zip(rois, peaks)):
             self.selected_peaks.append(
                 [
                     self.filename,
-                    self.columns[self.idx],
+                    self.columns[roi],
                     peak_tp,
-                    amplitude,
-                    relative_height,
-                    norm_amplitude,
-                    norm_rel_amplitude,
-                    evoked,
-                    automatic_detected,
-                    tau,
-                    inv_tau,
+                    metrics["amplitude"][i],
+                    metrics["relative_height"][i],
+                    metrics["norm_amplitude"][i],
+                    metrics["norm_rel_amplitude"][i],
+                    metrics["evoked"][i],
+                    automatic[i],
+                    taus[i],
+                    inv_taus[i],
                 ]
             )
 
@@ -305,16 +628,60 @@ class SynapseResponseData:
         """
         self.discard_data.append(self.columns[self.idx])
         self.last.append("trash")
+        if self.journal is not None:
+            self.journal.append({"action": "discard", "idx": self.idx})
 
     def discard_rest(self) -> None:
         """
         Discards all remaining not seen traces.
         """
+        if self.journal is not None:
+            self.journal.append({"action": "discard_rest", "idx": self.idx})
         self.discard_data += [
             self.columns[i] for i in range(self.idx, len(self.columns))
         ]
         self.idx = len(self.columns) - 1
 
+    def replay(
+        self,
+        records: list[dict],
+        normalization_use_median: bool,
+        normalization_sliding_window: int,
+    ) -> bool:
+        """
+        Restores the decisions of a journal and shows the next undecided trace.
+        Returns True if all traces were decided, so the file only needs to be
+        saved (the last trace is shown then).
+        """
+        for record in records:
+            if record["action"] == "open":
+                continue
+            # trace shown when the decision was made
+            self.idx = record["idx"]
+            match record["action"]:
+                case "keep":
+                    self.keep_data.append(self.columns[self.idx])
+                    self.last.append("keep")
+                    for row in record["responses"]:
+                        self.selected_peaks.append([self.filename] + row[1:])
+                case "discard":
+                    self.discard()
+                case "back":
+                    self.back()
+                case "discard_rest":
+                    self.discard_rest()
+            # the GUI moves on to the next trace after every decision
+            self.idx += 1
+        complete = self.idx >= len(self.columns)
+        self.idx = min(self.idx, len(self.columns) - 1)
+        self.intensity = self.store.column(self.columns[self.idx])
+        self.norm_intensity = self.get_norm_trace(
+            self.columns[self.idx],
+            normalization_use_median,
+            normalization_sliding_window,
+        )
+        return complete
+
     def end_of_file(self) -> bool:
         """
         Checks whether a next trace can be loaded or end of file will be reached.
@@ -347,19 +714,13 @@ class SynapseResponseData:
 
     def non_max_supression(self, stimframes: list[int], patience: int) -> list[int]:
         """
-        Keeps only maximum peak per stimulation
-        """
-        nms_peaks = []
-        for stimframe in stimframes:
-            tmp_peaks = []
-            tmp_amplitudes = []
-            for peak in self.automatic_peaks:
-                if peak < stimframe or peak > stimframe + patience:
-                    continue
-                tmp_peaks.append(peak)
-                tmp_amplitudes.append(self.intensity[peak])
-            if len(tmp_peaks) > 1:
-                _ = tmp_peaks.pop(np.argmax(tmp_amplitudes))
-                for peak in tmp_peaks:
-                    nms_peaks.append(peak)
-        return nms_peaks
+        Keeps only maximum peak per stimulation, returns the peaks to remove.
+        """
+        return list(
+            stimulation_nms(
+                np.asarray(self.automatic_peaks, dtype=np.int64),
+                self.intensity,
+                stimframes,
+                patience,
+            )
+        )
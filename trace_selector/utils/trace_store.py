@@ -0,0 +1,160 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+# traces larger than this are moved from RAM to a temporary memory-mapped file
+MEMMAP_THRESHOLD_MB = 256
+TMP_PREFIX = "trace_selector_"
+
+
+def allocate_traces(n_frames: int, n_columns: int) -> np.ndarray:
+    """
+    Allocates an uninitialized (frames x ROIs) column-major float64 matrix.
+    Above MEMMAP_THRESHOLD_MB it is backed by a temporary file instead of RAM,
+    a TraceStore created from it takes over the file.
+    """
+    if n_frames * n_columns * 8 <= MEMMAP_THRESHOLD_MB * 1024 * 1024:
+        return np.empty((n_frames, n_columns), dtype=np.float64, order="F")
+    with tempfile.NamedTemporaryFile(
+        prefix=TMP_PREFIX, suffix=".dat", delete=False
+    ) as f:
+        path = f.name
+    return np.memmap(
+        path, dtype=np.float64, mode="w+", shape=(n_frames, n_columns), order="F"
+    )
+
+
+def temporary_path(traces: np.ndarray) -> str | None:
+    """
+    Path of the temporary file backing traces, None for traces in RAM or
+    traces mapped from any other file (e.g. the file cache).
+    """
+    if not isinstance(traces, np.memmap) or traces.filename is None:
+        return None
+    path = os.path.abspath(traces.filename)
+    if os.path.dirname(path) != os.path.abspath(
+        tempfile.gettempdir()
+    ) or not os.path.basename(path).startswith(TMP_PREFIX):
+        return None
+    return path
+
+
+def release_traces(traces: np.ndarray) -> None:
+    """
+    Removes the temporary file of traces from allocate_traces, if there is one.
+    """
+    path = temporary_path(traces)
+    if path is not None:
+        try:
+            os.remove(path)
+        except OSError:
+            # still mapped (Windows), the OS cleans up the temp dir
+            pass
+
+
+class TraceStore:
+    """
+    Compact storage of an opened file: all ROI traces in one contiguous
+    (frames x ROIs) float64 matrix (column-major, so every trace is contiguous)
+    and the meta columns, where constant columns (e.g. the recording name
+    repeated on every row) are stored as a single value.
+
+    Traces are handed out as zero-copy views, a DataFrame is only materialized
+    for the export.
+    """
+
+    def __init__(
+        self,
+        traces: np.ndarray,
+        columns: list[str],
+        dtypes: dict[str, str] | None = None,
+        meta_df: pd.DataFrame | None = None,
+    ) -> None:
+        # temporary file backing the traces, removed on close
+        self.tmp_path = temporary_path(traces)
+        if (
+            not isinstance(traces, np.memmap)
+            and traces.nbytes > MEMMAP_THRESHOLD_MB * 1024 * 1024
+        ):
+            traces = self.spill_to_disk(traces)
+        self.traces = traces
+        self.columns = columns
+        self.column_index = {col: i for i, col in enumerate(columns)}
+        # original dtypes of ROI columns that are not float64 (e.g. integer counts)
+        self.dtypes = dtypes if dtypes is not None else {}
+        self.meta_columns = []
+        # constant meta columns as series of length 1, all others in full
+        self.meta = {}
+        self.meta_constant = {}
+        if meta_df is not None:
+            for col in meta_df.columns:
+                self.add_meta_column(col, meta_df[col])
+
+    def spill_to_disk(self, traces: np.ndarray) -> np.memmap:
+        mapped = allocate_traces(*traces.shape)
+        self.tmp_path = temporary_path(mapped)
+        mapped[:] = traces
+        mapped.flush()
+        return mapped
+
+    def add_meta_column(self, col: str, values: pd.Series) -> None:
+        values = values.reset_index(drop=True)
+        self.meta_columns.append(col)
+        self.meta_constant[col] = len(values) > 0 and values.nunique(dropna=False) == 1
+        self.meta[col] = values.iloc[:1] if self.meta_constant[col] else values
+
+    def close(self) -> None:
+        """
+        Releases the traces and removes the temporary file, if there is one.
+        """
+        self.traces = np.empty((0, len(self.columns)), dtype=np.float64, order="F")
+        if self.tmp_path is not None:
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                # still mapped by views (Windows), the OS cleans up the temp dir
+                pass
+            self.tmp_path = None
+
+    def __del__(self) -> None:
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    @property
+    def n_frames(self) -> int:
+        return self.traces.shape[0]
+
+    def column(self, col: str) -> np.ndarray:
+        """
+        Returns the trace of a ROI column (no copy).
+        """
+        return self.traces[:, self.column_index[col]]
+
+    def meta_column(self, col: str) -> pd.Series:
+        values = self.meta[col]
+        if self.meta_constant[col]:
+            values = values.repeat(self.n_frames).reset_index(drop=True)
+        return values
+
+    def to_frame(
+        self, columns: list[str], traces: np.ndarray | None = None
+    ) -> pd.DataFrame:
+        """
+        Materializes the meta columns and the given ROI columns as DataFrame.
+        If traces (frames x ROIs) is given, the ROI values are taken from it
+        instead, e.g. for the normalized traces.
+        """
+        idx = [self.column_index[col] for col in columns]
+        if traces is None:
+            df = pd.DataFrame(self.traces[:, idx], columns=columns)
+            dtypes = {col: self.dtypes[col] for col in columns if col in self.dtypes}
+            if len(dtypes) > 0:
+                df = df.astype(dtypes)
+        else:
+            df = pd.DataFrame(traces[:, idx], columns=columns)
+        for i, col in enumerate(self.meta_columns):
+            df.insert(i, col, self.meta_column(col))
+        return df